@@ -1,144 +1,490 @@
 import os
-import socket
-import struct
+import re
 import time
-import subprocess
+import json
+import socket
+import signal
 import hashlib
-import paramiko
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import nullcontext
+from typing import Optional
 from utils import CommandResult
+from debuglog import get_logger
+from timeouts import DurationStore, percentile
+from bmp import BMPCollector
+from cassette import Cassette, RecordingTransport, ReplayTransport
+from memshare import MEMORY_MODES, MemoryTemplate, enable_ksm, ksm_status, qemu_footprint
+from supervisor import QemuSupervisor, QMPClient
+from concurrent.futures import ThreadPoolExecutor
+from transports import GuestAgentTransport, GuestDaemonTransport, SSHTransport, FailoverTransport, TransportError, benchmark
+
+log = get_logger("vm")
+
+# firmware: SeaBIOS, GRUB and the image's default target, kernel: -kernel/-initrd extracted by prepare_image.py
+BOOT_MODES = ("firmware", "kernel")
+
 
 class BGPHVirtualMachine:
-    def __init__(self) -> None:
+    """
+    Lifecycle of the QEMU VM that runs Mininet. Commands reach the guest through whichever
+    transport (guest agent or SSH) answered fastest at startup, falling back to the others.
+    """
+
+    def __init__(self, transports=("guestd", "guest-agent", "ssh"), instance="", memory_mode="private",
+                 boot_mode="firmware") -> None:
+        # instance names a second VM on the same host, its sockets and images must not collide
+        self.instance = instance
+        suffix = f"-{instance}" if instance else ""
         self.topology_start_output = ""
-        self.submission_dir = "/autograder/submission/"
-        self.BGPHijacking_dir = f"{self.submission_dir}BGPHijacking"
-        self.ssh_client = None
-        self.hostipv4 = "127.0.0.1"
+        self.submission_dir = Path("/autograder/submission/BGPHijacking")
+        self.host_share_dir = Path("/autograder/submission")
         self.SSH_FWD_PORT = 8022
+        self.hostipv4 = "127.0.0.1"
+        self.host_from_guest = "192.168.101.2"  # gateway of the user network, QEMU connects it to the host's loopback
         self.username = "mininet"
         self.password = "mininet"
-        self.init_complete = False
+        self.ga_socket_path = f"/tmp/qemu-ga{suffix}.sock"
+        self.ga = GuestAgentTransport(self.ga_socket_path)
+        self.guestd_socket_path = f"/tmp/bgph-guestd{suffix}.sock"
+        self.guestd = None  # GuestDaemonTransport once scripts/guestd.py runs in the guest
+        self.transport_names = transports
+        self.transport = FailoverTransport([])
+        self.monitor_socket_path = f"/tmp/qemu-monitor{suffix}.sock"
+        self.base_image = Path("/autograder/source/mininet-vm-x86_64.qcow2")
+        self.overlay_image = Path(f"/tmp/mininet-vm-overlay{suffix}.qcow2")
+        self.use_overlay = True
+        self.active_image = None  # the image QEMU writes to, changes when the VM is cloned
+        self.extra_images = []  # overlays created by clone(), removed on shutdown
+        self.memory_mb = 1536
+        self.vcpus = 1  # -smp, what telemetry measures QEMU's CPU saturation against
+        # private: plain guest RAM, ksm: RAM marked mergeable, template: restored copy-on-write from memshare.MemoryTemplate
+        if memory_mode not in MEMORY_MODES:
+            raise ValueError(f"memory_mode must be one of {MEMORY_MODES}, not {memory_mode!r}")
+        self.memory_mode = memory_mode
+        self.template = None  # MemoryTemplate the VM was restored from
+        if boot_mode not in BOOT_MODES:
+            raise ValueError(f"boot_mode must be one of {BOOT_MODES}, not {boot_mode!r}")
+        self.boot_mode = boot_mode
+        self.kernel_args = []  # -kernel/-initrd/-append of a direct kernel boot, empty for a firmware boot
+        self.boot_phase = None  # how the guest came up: boot_to_agent, kernel_boot_to_agent or restore_to_agent
+        self.staged = False  # the submission was copied onto the guest disk and 9p unmounted
+        self.checkpoints = {}  # savevm name -> the image that holds it
+        self.time_to_agent = None  # seconds from QEMU launch until the guest agent answered
+        self.qemu_process = None
+        self.qmp_socket_path = f"/tmp/qemu-qmp{suffix}.sock"
+        self.qmp = QMPClient(self.qmp_socket_path)
+        self.supervisor = None  # QemuSupervisor of the running QEMU process
+        self.restarts = 0  # how often recover() replaced a crashed VM
+        self.boot_cancelled = threading.Event()
+        self._boot_thread = None
+        self._boot_result = None
         self.anti_cheating_secret = hashlib.sha256(f"CS6250{time.time()}666".encode()).hexdigest()[0:16]
+        self.random_seed = int.from_bytes(os.urandom(8), "big")  # seeds the grader's host and router choices
+        self.cassette = None  # Cassette every guest interaction is recorded to, see record()
+        self.replaying = False  # the guest is a recorded run, there is no QEMU
+        self.probe_latencies = []  # (kind, seconds) per website check and survey pass, for the run store
+        self.bmp = None  # BMPCollector the routers stream their routes to, see start_bmp()
+        self.running_topology = None  # signature of the topology bgp.py is running, for hot restarts
+        self.durations = DurationStore()  # learned deadlines for this kind of host
 
+    ## Record and replay
 
-    # def _kvm_available(self) -> bool:
-    #     """Check if KVM is available on this host"""
-    #     return os.path.exists("/dev/kvm") and os.access("/dev/kvm", os.R_OK | os.W_OK)
-
-
-    def start_vm(self):
-        print(f"\n==> BGPHVirtualMachine.start_vm()")
+    def record(self, path: Path, grader_options: Optional[dict] = None) -> Cassette:
+        """
+        Record every guest interaction of this run, its secret and random seed, and the grader's
+        settings (see bgph_grader.grader_options) to a cassette at `path`.
+        """
+        log.info(f"==> BGPHVirtualMachine.record()\n    {path}")
+        self.cassette = Cassette.create(path, {"anti_cheating_secret": self.anti_cheating_secret,
+                                               "random_seed": self.random_seed,
+                                               "grader": dict(grader_options or {})})
+        return self.cassette
+
+    @classmethod
+    def replay(cls, cassette: Cassette) -> "BGPHVirtualMachine":
+        """A VM that answers from a recorded run instead of booting QEMU, for regrading with a changed rubric."""
+        vm = cls(transports=())
+        vm.anti_cheating_secret = cassette.meta["anti_cheating_secret"]
+        vm.random_seed = cassette.meta["random_seed"]
+        vm.transport = ReplayTransport(cassette)
+        # the recorded run used guestd if anything was sent to a node directly
+        if any(entry.get("n") for entry in cassette.entries):
+            vm.guestd = vm.transport
+        vm.durations = DurationStore(path=None)  # replayed runs say nothing about this host
+        vm.replaying = True
+        vm._boot_result = True
+        return vm
+
+    def sleep(self, seconds: float):
+        """Wait for the guest to settle, a replayed guest has nothing to wait for."""
+        if not self.replaying:
+            time.sleep(seconds)
+
+    ## Speculative boot
+
+    def start_vm_async(self):
+        """Boot the VM on a background thread so the host-side checks can run in the meantime."""
+        log.info(f"==> BGPHVirtualMachine.start_vm_async()")
+
+        def _boot():
+            try:
+                self._boot_result = self.start_vm()
+            except Exception as e:
+                print(f"==> QEMU VM boot raised {type(e).__name__}: {e}")
+                self._boot_result = False
+
+        self._boot_thread = threading.Thread(target=_boot, name="vm-boot", daemon=True)
+        self._boot_thread.start()
+
+    def wait_for_boot(self, timeout=None) -> bool:
+        """Block until the background boot finishes. Returns True if the VM is ready for grading."""
+        log.info(f"==> BGPHVirtualMachine.wait_for_boot()")
+        if self._boot_thread is None:
+            return bool(self._boot_result)
+        self._boot_thread.join(timeout)
+        if self._boot_thread.is_alive():
+            print(f"    VM still booting after {timeout}s")
+            return False
+        return bool(self._boot_result) and not self.boot_cancelled.is_set()
 
-        # use_kvm = self._kvm_available()
-        # print(f"KVM available: {use_kvm}")
-
-        # qemu_command = [
-        #     "qemu-system-x86_64",  # QEMU binary
-        #     "-m", "1536",  # Memory allocation in MB (was 1024)
-        #     "-nographic",  # Run without a graphical interface
-        #     "-net", "nic,model=virtio",  # Network interface configuration
-        #     "-net", f"user,net=192.168.101.0/24,hostfwd=tcp::{self.SSH_FWD_PORT}-:22",  # User-mode networking with port forwarding
-        #     "-virtfs", "local,id=hostshare,path=/autograder/submission,mount_tag=submission,security_model=none",
-        #     # "-drive", "file=/autograder/source/mininet-vm-x86_64.vmdk,format=vmdk",
-        #     "-drive", "file=/autograder/source/mininet-vm-x86_64.qcow2,format=qcow2",
-        #     # "/autograder/source/mininet-vm-x86_64.vmdk",  # Path to the VMDK file
-        # ]
-
-        # qemu_command = [
-        #     "qemu-system-x86_64",  # QEMU binary
-        #     "-m", "1536",  # Memory allocation in MB
-        #     "-nographic",  # Run without a graphical interface
-        #     "-device", "virtio-net-pci,netdev=net0",
-        #     "-netdev", f"user,id=net0,net=192.168.101.0/24,hostfwd=tcp::{self.SSH_FWD_PORT}-:22",
-        #     "-virtfs", "local,id=hostshare,path=/autograder/submission,mount_tag=submission,security_model=none",
-        #     # "-drive", "file=/autograder/source/mininet-vm-x86_64.vmdk,format=vmdk",
-        #     "-drive", "file=/autograder/source/mininet-vm-x86_64.qcow2,format=qcow2",
-        # ]
-
-        # Create log files in current directory
-
-        qemu_command = [
-            "qemu-system-x86_64",  # QEMU binary
-            "-m", "1536",  # Memory allocation in MB
+    def boot_failed(self) -> bool:
+        """True if the boot finished without a usable VM and was not cancelled on purpose."""
+        if self.boot_cancelled.is_set() or self._boot_thread is None or self._boot_thread.is_alive():
+            return False
+        return not self._boot_result
+
+    def cancel_boot(self):
+        """Abandon the boot: kill QEMU and discard the overlay, the base image is never touched."""
+        log.info(f"==> BGPHVirtualMachine.cancel_boot()")
+        self.boot_cancelled.set()
+        if self.supervisor:
+            self.supervisor.stop()
+        self._kill_qemu()
+        if self._boot_thread is not None:
+            self._boot_thread.join(15)
+        self.overlay_image.unlink(missing_ok=True)
+
+    def _kill_qemu(self):
+        if self.qemu_process is None or self.qemu_process.poll() is not None:
+            return
+        try:
+            os.killpg(self.qemu_process.pid, signal.SIGKILL)
+        except OSError:
+            self.qemu_process.kill()
+        self.qemu_process.wait(timeout=10)
+
+    def _check_image_manifest(self):
+        """Report whether the base image is the one prepare_image.py optimized, it is only a warning if not."""
+        manifest_path = self.base_image.with_name(self.base_image.name + ".manifest.json")
+        if not manifest_path.exists():
+            print(f"    No image manifest at {manifest_path}, the image was not prepared with prepare_image.py")
+            return False
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            with open(self.base_image, "rb") as f:
+                header_sha256 = hashlib.sha256(f.read(1024 * 1024)).hexdigest()
+            size = self.base_image.stat().st_size
+        except (OSError, ValueError) as e:
+            print(f"    Could not check the image manifest: {e}")
+            return False
+        if manifest.get("size") != size or manifest.get("header_sha256") != header_sha256:
+            print(f"    WARNING: {self.base_image} does not match its manifest, it was modified after prepare_image.py")
+            return False
+        print(f"    Optimized image {manifest.get('sha256', '')[:16]}, prepared {manifest.get('created')}, "
+              f"measured time to agent {manifest.get('boot_seconds')}s ({manifest.get('accel')})")
+        return True
+
+    def _create_overlay(self, backing: Optional[Path] = None, overlay: Optional[Path] = None) -> Path:
+        """Create a throwaway qcow2 overlay on top of the base image, so a cancelled or finished run can just delete it."""
+        backing = backing or self.base_image
+        overlay = overlay or self.overlay_image
+        if not self.use_overlay and backing == self.base_image:
+            return self.base_image
+        overlay.unlink(missing_ok=True)
+        cmd = ["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", str(backing), str(overlay)]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=30)
+            return overlay
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"    Could not create overlay ({e}), booting the base image directly")
+            return self.base_image
+
+
+    def _memory_args(self) -> list:
+        if self.template is not None:
+            return self.template.backend(share=False)
+        if self.memory_mode != "private":  # also a template mode VM that had to boot without one
+            return ["-machine", "mem-merge=on"]
+        return []
+
+    def _direct_kernel(self) -> list:
+        """QEMU arguments booting the kernel prepare_image.py extracted from the base image, empty if there is none."""
+        directory = self.base_image.with_name(self.base_image.name + ".kernel")
+        try:
+            kernel = json.loads((directory / "kernel.json").read_text())
+            with open(self.base_image, "rb") as f:
+                header_sha256 = hashlib.sha256(f.read(1024 * 1024)).hexdigest()
+        except (OSError, ValueError) as e:
+            print(f"    No extracted kernel ({e}), booting through firmware")
+            return []
+        if not all((directory / name).exists() for name in ("vmlinuz", "initrd.img")):
+            print(f"    {directory} is incomplete, booting through firmware")
+            return []
+        if kernel.get("header_sha256") != header_sha256:
+            # its modules on the disk would not match, the guest would come up without 9p and virtio-serial
+            print(f"    The kernel in {directory} was extracted from another image, booting through firmware")
+            return []
+        print(f"    Direct kernel boot of {kernel.get('release')}: {kernel['append']}")
+        return ["-kernel", str(directory / "vmlinuz"), "-initrd", str(directory / "initrd.img"),
+                "-append", kernel["append"]]
+
+    def _boot_phase(self) -> str:
+        return "kernel_boot_to_agent" if self.kernel_args else "boot_to_agent"
+
+    def _compare_boot(self, phase: str) -> str:
+        """How this boot compares to the other boot mode on this host, from the learned durations."""
+        other = {"boot_to_agent": "kernel_boot_to_agent", "kernel_boot_to_agent": "boot_to_agent"}.get(phase)
+        samples = self.durations.samples(other) if other else []
+        if not samples:
+            return ""
+        name = "direct kernel boot" if other == "kernel_boot_to_agent" else "firmware boot"
+        return f" ({name} p50 {percentile(samples, 50):.1f}s over {len(samples)} boots)"
+
+    def _qemu_command(self, drive: Path, memory_args: Optional[list] = None) -> list:
+        return [
+            "qemu-system-x86_64",
+            "-m", str(self.memory_mb),
+            "-smp", str(self.vcpus),
+            *(self._memory_args() if memory_args is None else memory_args),
+            *self.kernel_args,
             "-display", "none",
-            "-serial", "stdio",  # was "none"
-            "-monitor", "unix:/tmp/qemu-monitor.sock,server,nowait",
-            # "-net", "nic,model=virtio",  # Network interface configuration
-            # "-net", f"user,net=192.168.101.0/24,hostfwd=tcp::{self.SSH_FWD_PORT}-:22",  # User-mode networking with port forwarding
+            "-serial", "none",
+            "-monitor", f"unix:{self.monitor_socket_path},server,nowait",
+            "-qmp", f"unix:{self.qmp_socket_path},server=on,wait=off",
             "-device", "virtio-net-pci,netdev=net0",
             "-netdev", f"user,id=net0,net=192.168.101.0/24,hostfwd=tcp::{self.SSH_FWD_PORT}-:22",
-            "-virtfs", "local,id=hostshare,path=/autograder/submission,mount_tag=submission,security_model=none",
-            "-drive", "file=/autograder/source/mininet-vm-x86_64.qcow2,format=qcow2",
+            "-virtfs", f"local,id=hostshare,path={self.host_share_dir},mount_tag=submission,security_model=none",
+            "-device", "virtio-serial",
+            "-chardev", f"socket,id=qga0,path={self.ga_socket_path},server=on,wait=off",
+            "-device", "virtserialport,chardev=qga0,name=org.qemu.guest_agent.0",
+            "-chardev", f"socket,id=guestd0,path={self.guestd_socket_path},server=on,wait=off",
+            "-device", "virtserialport,chardev=guestd0,name=org.bgph.guestd.0",
+            "-drive", f"file={drive},format=qcow2,id=disk0",
             "-no-reboot",
-            "-D", "/tmp/qemu-debug.log", "-d", "guest_errors,unimp",
+            "-D", f"/tmp/qemu-debug{f'-{self.instance}' if self.instance else ''}.log", "-d", "guest_errors,unimp",
         ]
 
-        # if use_kvm:
-        #     qemu_command.insert(1, "-enable-kvm")
-
-        print(f"QEMU command:\n{' '.join(qemu_command)}")
-
-        # @contextmanager
-        # def qemu_logs():
-        #     qemu_stdout_log = open("qemu_stdout.log", "ab")
-        #     qemu_stderr_log = open("qemu_stderr.log", "ab")
-        #     try:
-        #         yield qemu_stdout_log, qemu_stderr_log
-        #     finally:
-        #         qemu_stdout_log.close()
-        #         qemu_stderr_log.close()
+    def start_vm(self):
+        print(f"\n==> BGPHVirtualMachine.start_vm()")
+        if self.boot_cancelled.is_set():
+            return False
 
+        self._check_image_manifest()
+        self.kernel_args = self._direct_kernel() if self.boot_mode == "kernel" else []
+        if self.memory_mode != "private":
+            enable_ksm()
+        self.template = self._memory_template() if self.memory_mode == "template" else None
+        drive = self.active_image = self._create_overlay(self.template.disk if self.template else None)
+        self.staged = False
+        self.checkpoints = {}
+        qemu_command = self._qemu_command(drive)
+        if self.template:
+            qemu_command += ["-incoming", "defer"]
+
+        print("\n\n###\n### QEMU Startup Command\n###")
+        print(f"{' '.join(qemu_command)}\n\n")
+
+        launched = time.time()
         try:
             self.qemu_process = subprocess.Popen(
                 qemu_command,
                 start_new_session=True,
                 stdin=subprocess.DEVNULL,
-                stdout=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
             )
-        #     with qemu_logs() as (qemu_stdout_log, qemu_stderr_log):
-        #         self.qemu_process = subprocess.Popen(
-        #             qemu_command,
-        #             start_new_session=True,
-        #             stdin=subprocess.DEVNULL,
-        #             stdout=qemu_stdout_log,
-        #             stderr=qemu_stderr_log,
-        #         )
         except (OSError, FileNotFoundError) as e:
-            print(f"Failed to start QEMU: {e}")
+            print(f"==> QEMU VM Failed to Start:\n{e}")
             return False
+        self.supervisor = QemuSupervisor(self)
 
-        # Check QEMU didn't exit immediately (e.g. bad args, missing VMDK)
-        time.sleep(3)
+        # Check QEMU didn't exit immediately
+        if self.boot_cancelled.wait(3):
+            self._kill_qemu()  # the cancel may have raced with Popen
+            return False
         if self.qemu_process.poll() is not None:
-            stdout_output = self.qemu_process.stdout.read().decode()
-            stderr_output = self.qemu_process.stderr.read().decode()
-            print(f"QEMU exited immediately (code {self.qemu_process.returncode})")
-            print(f"stdout (serial): {stdout_output}")
-            print(f"stderr: {stderr_output}")
+            self.supervisor.wait_stderr(2)
+            print(f"==> QEMU Exited Immediately (code {self.qemu_process.returncode})")
+            print(f"STDERR:\n{self.supervisor.stderr_text()}")
+            return False
+        if self.template and not self._restore_template():
             return False
 
-        print(f"     Waiting for the QEMU VM sshd to initialize")
+        # Wait for the guest agent to become available
+        print("\n\n###\n### Waiting for QEMU Guest Agent\n###")
+        phase = "restore_to_agent" if self.template else self._boot_phase()
+        if not self._wait_for_ga(total_wait=self.durations.timeout(phase, 120 if self.kernel_args else 600, floor=60),
+                                 interval=self.durations.interval(phase, 2 if self.kernel_args else 10)):
+            if self.kernel_args and not self.template and not self.boot_cancelled.is_set():
+                print("==> Guest agent never responded to the direct kernel boot, booting through firmware")
+                self.supervisor.stop()
+                self._kill_qemu()
+                self.boot_mode = "firmware"
+                return self.start_vm()
+            print("==> Guest agent never responded - exiting")
+            return False
+        self.time_to_agent = time.time() - launched
+        self.boot_phase = phase
+        self.supervisor.guest_up.set()
+        self.durations.record(phase, self.time_to_agent)
+        print(f"    Guest agent ready {self.time_to_agent:.1f}s after QEMU launch{self._compare_boot(phase)}")
+        if self.template:
+            self._sync_guest_clock()
+        if self.boot_cancelled.is_set():
+            self._kill_qemu()
+            return False
 
-        print(f"     Sleeping for 120s to give the QEMU VM time to boot and sshd to initialize")
-        # There is also retry logic in get_ssh_client() that will wait for sshd to initialize
-        time.sleep(120)
+        print(f"{self.qemu_monitor_cmd('info network')}\n\n")
 
-        print(f"     Waiting for the QEMU VM sshd banner")
-        if not self._wait_for_sshd(hostname=self.hostipv4, port=self.SSH_FWD_PORT, total_wait=600, interval=5):
-            print("QEMU VM sshd never initialized - exiting")
+        if not self._select_transport():
+            print("==> No transport to the guest is usable - exiting")
             return False
+        print(f"    memory ({self.memory_mode}): {self.memory_footprint()}")
+
+        # we have a working guest agent, now do initial setup
+        print("\n\n###\n### Setup for Grading\n###\n\n")
+        init_cmds = [
+            f"sudo mkdir -p {self.submission_dir.parent}",
+            # mount the submission directory via 9p virtfs, unless bgph-fast.target already did
+            f"mountpoint -q {self.submission_dir.parent} || "
+            f"sudo mount -t 9p -o trans=virtio,msize=262144 submission {self.submission_dir.parent}",
+            f"cd {self.submission_dir} && sudo chmod +x *.sh",
+            f"echo '{self.anti_cheating_secret}' > /tmp/anti_cheating_secret5566.txt",
+            f"ls -lAFgR {self.submission_dir}",  # Debug: show submission contents
+        ]
+        for cmd in init_cmds:
+            ret, out, err = self.exec(cmd)
+            print(f"    > {cmd} ({ret = })")
+            if out:
+                print(f"STDOUT:\n{out.strip()}")
+            if err:
+                print(f"STDERR:\n{err.strip()}")
 
-        print(f"QEMU network info:\n{self.qemu_monitor_cmd('info network')}")
+        return True
 
-        return self.init()
+    ## Guest communication, everything goes through the selected transport
 
+    def _wait_for_ga(self, total_wait=600, interval=10) -> bool:
+        """Wait for the guest agent to respond to pings."""
+        print(f"\n==> BGPHVirtualMachine._wait_for_ga()")
+        deadline = time.time() + total_wait
+        while time.time() < deadline and not self.boot_cancelled.is_set():
+            if self.ga.ping():
+                print("\n\n###\n### QEMU VM Ready\n###\n\n")
+                return True
+            self.boot_cancelled.wait(interval)
+        return False
+
+    def _select_transport(self, start_guestd=True):
+        """
+        Benchmark the transports that are available and keep them in latency order, with failover.
+        Without start_guestd, connect to a guestd that already runs in the guest, as in a clone.
+        """
+        log.info(f"==> BGPHVirtualMachine._select_transport()")
+        candidates, fallbacks = [], []
+        for name in self.transport_names:
+            if name == "guest-agent":
+                candidates.append(self.ga)
+            elif name == "guestd":
+                guestd = self._start_guestd(launch=start_guestd)
+                if guestd:
+                    candidates.append(guestd)
+            elif name == "ssh":
+                if not SSHTransport.available():
+                    print("    paramiko is not installed, skipping the SSH transport")
+                    continue
+                ssh = SSHTransport(self.hostipv4, self.SSH_FWD_PORT, self.username, self.password)
+                if name != self.transport_names[0]:
+                    # only a preferred SSH is connected and measured now, otherwise it waits as the last resort
+                    fallbacks.append(ssh)
+                elif ssh.connect():
+                    candidates.append(ssh)
+        self.transport = benchmark(candidates, fallbacks=fallbacks)
+        if not self.transport.transports:
+            return False
+        if self.cassette:
+            self.transport = RecordingTransport(self.transport, self.cassette)
+            if self.guestd:
+                self.guestd = RecordingTransport(self.guestd, self.cassette)
+        return True
+
+    def _start_guestd(self, launch=True) -> Optional[GuestDaemonTransport]:
+        """
+        Push scripts/guestd.py through the guest agent, start it as root and connect to its port.
+        Without launch, only connect, to a guestd that kept running across a migration.
+        """
+        log.info(f"==> BGPHVirtualMachine._start_guestd()")
+        try:
+            if launch:
+                result = self.ga.write_file(Path(__file__).parent / "scripts/guestd.py", "/tmp/bgph-guestd.py")
+                if not result.success:
+                    print(f"    could not push guestd: {result.message}")
+                    return None
+                self.ga.exec_background("python3 /tmp/bgph-guestd.py --port /dev/virtio-ports/org.bgph.guestd.0")
+        except TransportError as e:
+            print(f"    could not start guestd: {e}")
+            return None
+        guestd = GuestDaemonTransport(self.guestd_socket_path)
+        if not guestd.connect():
+            print("    guestd did not answer, continuing without it")
+            return None
+        self.guestd = guestd
+        return guestd
+
+    def _exec_timeout(self) -> float:
+        """Deadline for a guest command that names none, never below the old fixed 60s."""
+        return self.durations.timeout("exec", 60, floor=60)
+
+    def _in_node(self, node, command, timeout=None) -> Optional[list]:
+        """Run a command in a Mininet node through guestd, None if guestd is not available."""
+        if self.guestd is None:
+            return None
+        try:
+            return self.guestd.exec(command, timeout=timeout or self._exec_timeout(), node=node)
+        except TransportError as e:
+            log.warning(f"guestd failed ({e}), falling back to run.py")
+            self.guestd = None
+            return None
+
+    def exec(self, command, timeout=None, on_chunk=None, max_output=None):
+        """Execute a shell command inside the VM. Returns [exitcode, stdout, stderr]."""
+        if timeout is not None:
+            return self.transport.exec(command, timeout=timeout, on_chunk=on_chunk, max_output=max_output)
+        started = time.time()
+        result = self.transport.exec(command, timeout=self._exec_timeout(), on_chunk=on_chunk, max_output=max_output)
+        self.durations.record("exec", time.time() - started, save=False)  # saved with the node durations
+        return result
+
+    def exec_bg(self, command):
+        """Execute a shell command inside the VM, fully detached."""
+        return self.transport.exec_background(command)
+
+    def read_file(self, remote_path, local_path) -> CommandResult:
+        return self.transport.read_file(remote_path, local_path)
+
+    def write_file(self, local_path, remote_path) -> CommandResult:
+        return self.transport.write_file(local_path, remote_path)
+
+    ## QEMU Monitor
 
     def qemu_monitor_cmd(self, cmd: str) -> str:
         """Send a command to the QEMU monitor via Unix socket."""
+        print(f"\n==> BGPHVirtualMachine.qemu_monitor_cmd()\n    > {cmd} @ {time.asctime(time.localtime())}")
         try:
             s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            s.connect("/tmp/qemu-monitor.sock")
+            s.connect(self.monitor_socket_path)
             s.settimeout(5)
             s.recv(1024)  # consume the "(qemu) " prompt
             s.send((cmd + "\n").encode())
@@ -149,253 +495,639 @@ class BGPHVirtualMachine:
         except (OSError, socket.timeout) as e:
             return f"Monitor error: {e}"
 
+    ## VM lifecycle
 
-    def _attempt_ssh_connection(self, hostname: str = None, port: int = None, username: str = None, password: str = None,
-                               timeout: int = 10) -> paramiko.SSHClient:
-        print(f"\n==> BGPHVirtualMachine._attempt_ssh_connection()")
-
-        if hostname is None:
-            hostname = self.hostipv4
-        if port is None:
-            port = self.SSH_FWD_PORT
-        if username is None:
-            username = self.username
-        if password is None:
-            password = self.password
+    def shutdown(self, graceful=False, timeout=10):
+        """
+        Stop QEMU with QMP quit and SIGKILL it if it is still there after `timeout` seconds.
+        graceful first lets the guest power itself off, which only matters when the disk is kept.
+        """
+        print(f"\n==> BGPHVirtualMachine.shutdown()")
+        if self.cassette and not self.instance:  # clones record into their parent's cassette
+            self.cassette.close()
+        if self.bmp:
+            self.bmp.close()
+            self.bmp = None
+        if self.boot_cancelled.is_set() or self.qemu_process is None:
+            return
+        if self.supervisor:
+            self.supervisor.stop()
+        if graceful and self.qemu_process.poll() is None:
+            try:
+                self.exec("sudo shutdown -h now", timeout=5)
+            except Exception:
+                pass  # VM is shutting down, connection will drop
+            try:
+                self.qemu_process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                pass
+        self.transport.close()
+        if self.qemu_process.poll() is None:
+            try:
+                self.qmp.command("quit")
+                self.qemu_process.wait(timeout)
+            except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+                log.warning(f"QMP quit did not stop QEMU ({e!r}), killing it")
+        self._kill_qemu()
+        for image in self.extra_images:
+            image.unlink(missing_ok=True)
+        if self.use_overlay:
+            self.overlay_image.unlink(missing_ok=True)
+
+    def is_ready(self) -> bool:
+        return bool(self._boot_result) and not self.boot_cancelled.is_set()
+
+    def healthy(self) -> bool:
+        """False once the supervisor saw QEMU exit or the guest stop answering."""
+        if self.replaying:
+            return True
+        return self.supervisor is not None and self.supervisor.healthy()
+
+    def recover(self) -> bool:
+        """Replace a crashed or hung VM with a fresh boot from a new overlay. Returns True if the new VM is up."""
+        reason = self.supervisor.reason if self.supervisor else "QEMU never started"
+        log.info(f"==> BGPHVirtualMachine.recover()\n    {reason}")
+        if self.supervisor:
+            self.supervisor.stop()
+        self.transport.close()
+        self._kill_qemu()
+        self.guestd = None
+        self.running_topology = None
+        self.restarts += 1
+        self._boot_result = self.start_vm()
+        return bool(self._boot_result)
+
+    ## Cloning
+
+    def stage_submission(self) -> CommandResult:
+        """
+        Copy the submission onto the guest disk and unmount the 9p share, QEMU refuses to migrate
+        a guest that has a 9p export mounted. The guest path stays the same, so nothing else changes,
+        but from here on the host no longer sees what the guest writes into the submission folder.
+        """
+        log.info(f"==> BGPHVirtualMachine.stage_submission()")
+        share = self.submission_dir.parent
+        ret, out, err = self.exec(
+            f"sudo rm -rf /tmp/bgph-stage && sudo cp -a {share} /tmp/bgph-stage && sudo umount {share} && "
+            f"sudo cp -a /tmp/bgph-stage/. {share}/ && sudo rm -rf /tmp/bgph-stage", timeout=120)
+        self.staged = ret == 0
+        if not self.staged:
+            return CommandResult(False, f"staging failed ({ret}): {err.strip()}")
+        return CommandResult(True)
 
+    def checkpoint(self, name="converged") -> CommandResult:
+        """
+        savevm into the VM's own overlay: RAM, devices and disk at this moment, for revert().
+        Needs the submission staged, and an overlay so the base image is never written.
+        """
+        log.info(f"==> BGPHVirtualMachine.checkpoint({name})")
+        if not self.staged:
+            return CommandResult(False, "the submission is still on 9p, which blocks snapshots")
+        if self.active_image in (None, self.base_image):
+            return CommandResult(False, "no overlay to hold the snapshot")
+        started = time.time()
         try:
-            # Create a new SSH client
-            ssh_client = paramiko.SSHClient()
-
-            # Load system host keys and set policy for missing host keys
-            # ssh_client.load_system_host_keys()
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            # Connect to the server with a timeout
-            # ssh_client.connect(hostname, port=port, username=username, password=password, timeout=connection_timeout_sec)
-            ssh_client.connect(
-                hostname=hostname,
-                port=port,
-                username=username,
-                password=password,
-                timeout=timeout,
-                banner_timeout=30,
-                auth_timeout=20,
-                look_for_keys=False,
-                allow_agent=False,
-            )
-            print(f"Successfully connected to {hostname}:{port}")
-            return ssh_client
-        except paramiko.SSHException as e:
-            print(f"SSH connection error: {e}")
-        except (OSError, EOFError, socket.error, ConnectionResetError) as e:
-            print(f"Connection error (retryable): {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-
-
-    def get_ssh_client(self):
-        print(f"\n==> BGPHVirtualMachine.get_ssh_client()")
-
-        # Retry configuration
-        max_retries = 20
-        retry_interval = 15  # seconds
-        client_connect_timeout = 10  # seconds (increased from 3)
-
-        ssh_client = None
-        for attempt in range(max_retries):
-            print(f"SSH connection attempt {attempt + 1}/{max_retries}")
-            ssh_client = self._attempt_ssh_connection(
-                hostname=self.hostipv4, port=self.SSH_FWD_PORT, username=self.username, password=self.password, timeout=client_connect_timeout)
-            if ssh_client:
-                break
-            time.sleep(retry_interval)  # Wait before the next attempt
-        else:
-            print("Max attempts reached. Unable to connect.")
-
-        return ssh_client
-
-
-    def _ssh_exec_command(self, cmd: str, show_output: bool = False):
-        print(f"\n==> BGPHVirtualMachine._ssh_exec_command()")
-        if not self.ssh_client:
-            print(f"     > {cmd} -- SSH client not initialized")
-            return [-1, "", "SSH client not initialized"]
+            with self._paused():
+                out = self._qmp_ok("human-monitor-command", {"command-line": f"savevm {name}"}, timeout=300)
+        except (OSError, ValueError, RuntimeError) as e:
+            return CommandResult(False, f"savevm failed: {e}")
+        if "rror" in out:
+            return CommandResult(False, f"savevm failed: {out.strip()}")
+        self.checkpoints[name] = self.active_image
+        print(f"    saved in {time.time() - started:.1f}s")
+        return CommandResult(True)
 
+    def revert(self, name="converged") -> CommandResult:
+        """loadvm a checkpoint(), the guest continues from that moment with its clock set to now."""
+        log.info(f"==> BGPHVirtualMachine.revert({name})")
+        if self.checkpoints.get(name) != self.active_image or self.active_image is None:
+            # a clone() moved this VM onto a new overlay, the snapshot stayed in the old one
+            return CommandResult(False, f"no checkpoint {name} in {self.active_image}")
+        started = time.time()
         try:
-            print(f"     > {cmd}", end='')
-            _, std_out, std_err = self.ssh_client.exec_command(cmd)
-            retcode = std_out.channel.recv_exit_status()
-            std_err_txt = std_err.read().decode()
-            std_out_txt = std_out.read().decode()
-            print(f" ({retcode = })")
-
-            if show_output and std_out_txt:
-                print(f"     stdout:\n{std_out_txt}\n")
-            if show_output and std_err_txt:
-                print(f"     stderr:\n{std_err_txt}\n")
-        except paramiko.SSHException as e:
-            print(f" -- SSH command execution error: {e}")
-            return [-1, "", str(e)]
-
-        return [retcode, std_out_txt, std_err_txt]
+            with self._paused():
+                out = self._qmp_ok("human-monitor-command", {"command-line": f"loadvm {name}"}, timeout=300)
+        except (OSError, ValueError, RuntimeError) as e:
+            return CommandResult(False, f"loadvm failed: {e}")
+        if "rror" in out:
+            return CommandResult(False, f"loadvm failed: {out.strip()}")
+        self._sync_guest_clock()
+        print(f"    reverted in {time.time() - started:.1f}s")
+        return CommandResult(True)
 
+    def _paused(self):
+        """Keeps the supervisor from taking a guest the grader stopped itself for a hung one."""
+        return self.supervisor.paused() if self.supervisor else nullcontext()
 
-    def init(self):
-        print(f"\n==> BGPHVirtualMachine.init()")
-        self.ssh_client = self.get_ssh_client()
+    def _qmp_ok(self, execute, arguments=None, timeout=5) -> dict:
+        reply = self.qmp.command(execute, arguments, timeout=timeout)
+        if "error" in reply:
+            raise RuntimeError(f"QMP {execute}: {reply['error'].get('desc')}")
+        return reply.get("return", {})
 
-        if not self.ssh_client:
+    def _room_for_clone(self) -> bool:
+        """A clone needs its RAM on top of what the host has left now, and a CPU of its own."""
+        try:
+            with open("/proc/meminfo") as f:
+                meminfo = dict(line.split(":", 1) for line in f)
+            available_mb = int(meminfo["MemAvailable"].split()[0]) // 1024
+        except (OSError, KeyError, ValueError):
             return False
+        print(f"    {available_mb} MB available, {os.cpu_count()} CPUs")
+        return (os.cpu_count() or 1) >= 2 and available_mb >= self.memory_mb * 1.25
 
-        if not self.init_complete:
-            # mount the submission directory using 9p virtiofs
-            ret, out, err = self._ssh_exec_command(f"sudo mkdir -p {self.submission_dir}")
-            ret, out, err = self._ssh_exec_command(f"sudo mount -t 9p -o trans=virtio,msize=262144 submission {self.submission_dir}")
-            # set permissions for scripts in BGPHijacking dir
-            ret, out, err = self._ssh_exec_command(f"cd {self.BGPHijacking_dir} && sudo chmod +x *.sh")
-            # create /tmp/anti_cheating_secret5566.txt with the anti-cheating secret
-            ret, out, err = self._ssh_exec_command(f"echo '{self.anti_cheating_secret}' > /tmp/anti_cheating_secret5566.txt")
-            # show contents of directories for debugging
-            ret, out, err = self._ssh_exec_command(f"ls -lAFgR {self.submission_dir}")
-            # # do required installs on QEMU VM
-            # ret, out, err = self._ssh_exec_command("sudo python3 -m pip install termcolor")
-            # ret, out, err = self._ssh_exec_command("sudo DEBIAN_FRONTEND=noninteractive apt-get update", True)
-            # ret, out, err = self._ssh_exec_command("sudo DEBIAN_FRONTEND=noninteractive apt-get install -y -q curl frr", True)
-            # ret, out, err = self._ssh_exec_command("sudo DEBIAN_FRONTEND=noninteractive apt-get clean", True)
-            # ret, out, err = self._ssh_exec_command("sudo rm -rf /var/lib/apt/lists/* /tmp/* /var/tmp/*", True)
-
-        self.init_complete = True
-
-        return self.init_complete
-
-
-    def _wait_for_sshd(self, hostname: str=None, port: int=None, total_wait: int = 120, interval: int = 10) -> bool:
-        """Wait until the QEMU VM sshd is initialized, which we test by looking for the SSH banner."""
-        print(f"\n==> BGPHVirtualMachine._wait_for_sshd()")
-
-        if hostname is None:
-            hostname = self.hostipv4
-        if port is None:
-            port = self.SSH_FWD_PORT
-
-        # first, wait until the QEMU VM is running and accepting TCP connections
-        deadline = time.time() + total_wait
+    def clone(self, name="clone", timeout=300) -> Optional["BGPHVirtualMachine"]:
+        """
+        A second running VM in exactly this VM's state, topology and converged BGP included.
+        The paused guest is migrated into a file, its disk is frozen as the common backing file of two
+        new overlays, this VM continues on one of them and a new QEMU loads the file on the other.
+        Returns None, with this VM running on unchanged, when the host is short on resources or cloning fails.
+        """
+        log.info(f"==> BGPHVirtualMachine.clone({name})")
+        if not self.staged:
+            print("    the submission is still on 9p, which blocks migration")
+            return None
+        if not self._room_for_clone():
+            print("    not enough memory or CPUs for a second VM")
+            return None
+
+        clone = BGPHVirtualMachine(self.transport_names, instance=name)
+        clone.SSH_FWD_PORT = self.SSH_FWD_PORT + 1
+        # kernel_args too: a -kernel boot adds an option ROM, the migration needs the same RAM blocks on both ends
+        for attr in ("anti_cheating_secret", "random_seed", "durations", "memory_mb", "vcpus", "memory_mode", "template",
+                     "kernel_args", "boot_mode", "cassette", "running_topology", "topology_start_output"):
+            setattr(clone, attr, getattr(self, attr))
+        state_file = Path(f"/tmp/bgph-{name}-state")
+        frozen = self.active_image
+        own_top = Path(f"/tmp/mininet-vm-overlay-{name}-parent.qcow2")
+        paused = time.time()
+        try:
+            with self._paused():
+                self._qmp_ok("stop")
+                try:
+                    self._qmp_ok("blockdev-snapshot-sync",
+                                 {"device": "disk0", "snapshot-file": str(own_top), "format": "qcow2"})
+                    self.active_image = own_top
+                    self.extra_images.append(own_top)
+                    if self.template:
+                        # this VM restored with x-ignore-shared, its RAM is private and has to go into the file
+                        self._set_ignore_shared(False)
+                    self._migrate_to_file(state_file, timeout)
+                finally:
+                    self._qmp_ok("cont")
+            print(f"    guest paused for {time.time() - paused:.1f}s, state {state_file.stat().st_size >> 20} MB")
+            subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", str(frozen),
+                            str(clone.overlay_image)], check=True, capture_output=True, timeout=30)
+            clone.active_image = clone.overlay_image
+            if not clone._start_incoming(state_file, timeout):
+                clone.shutdown()
+                return None
+        except (OSError, ValueError, RuntimeError, subprocess.SubprocessError) as e:
+            print(f"    cloning failed: {e}")
+            clone.shutdown()
+            return None
+        finally:
+            state_file.unlink(missing_ok=True)
+        clone._boot_result = True
+        clone.staged = True
+        if self.bmp:
+            # the clone's routers would reach this VM's collector through the same host port
+            clone.exec("sudo pkill -f '[b]mp_relay.py'")
+        print(f"    clone running {time.time() - paused:.1f}s after the pause")
+        return clone
+
+    def _migrate_to_file(self, state_file: Path, timeout=300):
+        """Migrate the paused guest into a file, raises RuntimeError unless the migration completed."""
+        # the guest is paused anyway, the default bandwidth cap would only make the pause longer
+        self._qmp_ok("migrate-set-parameters", {"max-bandwidth": 8 << 30})
+        self._qmp_ok("migrate", {"uri": f"exec:cat > {state_file}"})
+        deadline = time.time() + timeout
+        status = ""
         while time.time() < deadline:
-            print(f"Attempting socket.create_connection() ({hostname}:{port} @ {time.asctime(time.localtime())})")
-            try:
-                s = socket.create_connection((hostname, port), timeout=2)
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
-                s.close()
+            status = self._qmp_ok("query-migrate").get("status", "")
+            if status in ("completed", "failed", "cancelled"):
                 break
-            except OSError:
-                time.sleep(interval)
-
-        # wait for the SSH banner — use SO_LINGER to avoid TIME_WAIT accumulation
-        deadline = time.time() + total_wait
-        while time.time() < deadline:
-            try:
-                s = socket.create_connection((hostname, port), timeout=15)
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
-                s.settimeout(15)
-                banner = s.recv(256)
-                s.close()
-                print(f"sshd banner [{banner}] @ {time.asctime(time.localtime())}")
-                if banner.startswith(b"SSH-"):
-                    return True
-            except (OSError, ConnectionResetError, socket.timeout) as e:
-                print(f"sshd error  [{e}] @ {time.asctime(time.localtime())}")
-            time.sleep(interval)
-        return False
-
-
-    def shutdown(self):
-        print(f"\n==> BGPHVirtualMachine.shutdown()")
-        ret, out, err = self._ssh_exec_command("sudo shutdown now")
-
+            time.sleep(0.5)
+        if status != "completed":
+            raise RuntimeError(f"migration to {state_file} ended as '{status}'")
+
+    def _set_ignore_shared(self, state: bool):
+        # both ends of a migration must agree on it, it changes the stream format
+        self._qmp_ok("migrate-set-capabilities", {"capabilities": [{"capability": "x-ignore-shared", "state": state}]})
+
+    def _start_incoming(self, state_file: Path, timeout=300) -> bool:
+        """Start QEMU on a migration state file, the guest resumes where the source was paused."""
+        log.info(f"==> BGPHVirtualMachine._start_incoming()")
+        qemu_command = self._qemu_command(self.active_image) + ["-incoming", f"exec:cat {state_file}"]
+        print(f"{' '.join(qemu_command)}\n")
+        try:
+            self.qemu_process = subprocess.Popen(qemu_command, start_new_session=True, stdin=subprocess.DEVNULL,
+                                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            print(f"    QEMU failed to start: {e}")
+            return False
+        self.supervisor = QemuSupervisor(self)
+        if not self._wait_for_ga(total_wait=timeout, interval=1):
+            print(f"    the clone never answered: {self.supervisor.stderr_text(5)}")
+            return False
+        self.supervisor.guest_up.set()
+        return self._select_transport(start_guestd=False)
 
-    def send_cmd(self, shell, cmd: str, sleep_sec=2):
-        print(f"\n==> BGPHVirtualMachine.send_cmd()")
-        shell.send(cmd + '\n')
-        print(f"     {cmd}")
-        time.sleep(sleep_sec)
+    ## Memory sharing
 
+    def memory_footprint(self) -> dict:
+        """Real host memory of this VM's QEMU (see memshare.qemu_footprint) and the host's KSM savings."""
+        if self.qemu_process is None or self.qemu_process.poll() is not None:
+            return {}
+        return {**(qemu_footprint(self.qemu_process.pid) or {}), **ksm_status()}
 
-    def start_topology(self, shell, total_timeout=120) -> CommandResult:
-        print(f"\n==> BGPHVirtualMachine.start_topology()")
-        self.send_cmd(shell, f"cd {self.BGPHijacking_dir} && sudo python3 bgp.py", 30)
-        output = ""
-        shell.settimeout(10)
-
-        print("Waiting for topology to start")
-        deadline = time.time() + total_timeout
-        while "*** Starting CLI:" not in output:
-            if time.time() > deadline:
-                return CommandResult(False, f"Topology did not start within {total_timeout}s, please check bgp.py, output: {output}")
-            try:
-                chunk = shell.recv(2048).decode()
-                output += chunk
-                print(f"** recv chunk ({len(chunk):>4} bytes), total output: {len(output):>6} bytes: [{chunk}]")
-            except socket.timeout:
-                print(f"recv timed out, {int(deadline - time.time())}s remaining")
-
-        print(output)
-        self.topology_start_output = output
-        return CommandResult(True)
+    def _memory_template(self) -> Optional[MemoryTemplate]:
+        """The memory template to restore from, built first if there is none for this image. None to boot normally."""
+        template = MemoryTemplate(self.base_image, self.memory_mb, boot="kernel" if self.kernel_args else "firmware")
+        try:
+            with template.lock():
+                if template.ready():
+                    return template
+                template.discard()
+                if self._build_template(template):
+                    return template
+                template.discard()
+        except OSError as e:
+            print(f"    memory template unusable: {e}")
+        print("    booting without a memory template, guest memory is still marked mergeable")
+        return None
+
+    def _build_template(self, template: MemoryTemplate) -> bool:
+        """
+        Boot a VM whose RAM is ram.bin mapped shared, and save it once the guest agent answers.
+        Saving with x-ignore-shared leaves the RAM in ram.bin and writes only the device state.
+        A direct kernel boot mounts the 9p share itself, it is unmounted first since 9p blocks the
+        migration, and every restored VM mounts it again in the setup of start_vm().
+        """
+        log.info(f"==> BGPHVirtualMachine._build_template()\n    {template.dir}")
+        disk = self._create_overlay(overlay=template.disk)
+        if disk != template.disk:
+            return False
+        qemu_command = self._qemu_command(disk, memory_args=template.backend(share=True))
+        started = time.time()
+        with open(template.dir / "qemu.log", "wb") as stderr:
+            self.qemu_process = subprocess.Popen(qemu_command, start_new_session=True, stdin=subprocess.DEVNULL,
+                                                 stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            phase = self._boot_phase()
+            if not self._wait_for_ga(total_wait=self.durations.timeout(phase, 600, floor=60),
+                                     interval=self.durations.interval(phase, 10)):
+                print(f"    the template VM never answered, see {template.dir / 'qemu.log'}")
+                return False
+            self.durations.record(phase, time.time() - started)
+            share = self.submission_dir.parent
+            ret, out, err = self.ga.exec(f"! mountpoint -q {share} || umount {share}", timeout=30)
+            if ret != 0:
+                raise RuntimeError(f"could not unmount the 9p share ({ret}): {err.strip()}")
+            self._qmp_ok("stop")
+            self._set_ignore_shared(True)
+            self._migrate_to_file(template.state)
+            self._qmp_ok("quit")
+            self.qemu_process.wait(30)
+        except (OSError, ValueError, RuntimeError, TransportError, subprocess.TimeoutExpired) as e:
+            print(f"    saving the template failed: {e}")
+            return False
+        finally:
+            self._kill_qemu()
+            self.qemu_process = None
+        template.commit(boot_seconds=round(time.time() - started, 1), created=time.time())
+        print(f"    template saved {time.time() - started:.1f}s after launch, "
+              f"device state {template.state.stat().st_size >> 10} KB")
+        return True
+
+    def _restore_template(self) -> bool:
+        """Load the template's device state into the QEMU started with -incoming defer."""
+        log.info(f"==> BGPHVirtualMachine._restore_template()")
+        deadline = time.time() + 30
+        try:
+            while True:
+                try:
+                    self._set_ignore_shared(True)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.2)  # QEMU has not opened its QMP socket yet
+            self._qmp_ok("migrate-incoming", {"uri": f"exec:cat {self.template.state}"})
+            return True
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"==> Restoring the memory template failed: {e}")
+            return False
 
+    def _sync_guest_clock(self):
+        """The restored guest's clock still shows when the template was saved."""
+        try:
+            self.ga.command({"execute": "guest-set-time", "arguments": {"time": time.time_ns()}})
+        except TransportError as e:
+            log.warning(f"could not set the guest clock: {e}")
+
+    def collect_artifacts(self, dest=Path("/autograder/results/artifacts/guest-artifacts.tar.gz")) -> CommandResult:
+        """Pull FRR logs, topology logs and convergence timelines out of the guest as one compressed archive."""
+        log.info(f"==> BGPHVirtualMachine.collect_artifacts()")
+        patterns = [
+            "/tmp/R*-bgpd.log",
+            "/tmp/R*-zebra.log",
+            f"{self.submission_dir}/logs/*",
+            "/tmp/bgph-timeline-*.json",
+        ]
+        result = self.pull_archive(patterns, dest)
+        print(f"    artifacts: {dest if result.success else result.message}")
+        return result
+
+    def pull_archive(self, patterns, local_path) -> CommandResult:
+        """Pack every guest path matching the glob patterns into one tar.gz and copy it to the host."""
+        log.info(f"==> BGPHVirtualMachine.pull_archive()\n    {patterns}")
+        # named after the destination, never the clock, so a replayed run issues the same command
+        remote = f"/tmp/bgph-pull-{Path(local_path).name}"
+        # let the guest shell expand the globs, patterns that match nothing are dropped
+        ret, out, err = self.exec(
+            f"files=$(ls -d {' '.join(patterns)} 2>/dev/null); "
+            f"[ -n \"$files\" ] || exit 3; sudo tar czf {remote} --ignore-failed-read $files && sudo chmod 644 {remote}",
+            timeout=120)
+        if ret == 3:
+            return CommandResult(False, "no guest files matched")
+        if ret != 0:
+            return CommandResult(False, f"tar failed ({ret}): {err.strip()}")
+        Path(local_path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return self.read_file(remote, local_path)
+        finally:
+            self.exec(f"sudo rm -f {remote}")
 
     def get_anti_cheating_secret(self) -> str:
+        print(f"\n==> BGPHVirtualMachine.get_anti_cheating_secret()")
         return self.anti_cheating_secret
 
-
     def get_topology_start_output(self):
         print(f"\n==> BGPHVirtualMachine.get_topology_start_output()")
         return self.topology_start_output
 
+    ## Topology management
+
+    def _print_progress(self, stream, text):
+        for line in text.splitlines():
+            log.debug(f"[{stream}] {line}")
 
-    def stop_topology(self, shell):
+    def teardown_topology(self, record="/tmp/bgph-topology.json") -> CommandResult:
         """
-        Must use the same shell as start_topology
+        Remove what the topology recorded it created (scripts/teardown.py), and fall back to
+        cleanup.py, which runs `mn -c`, when there is no record or it does not match.
         """
-        print(f"\n==> BGPHVirtualMachine.stop_topology()")
-        self.send_cmd(shell, "exit", 5)
+        log.info(f"==> BGPHVirtualMachine.teardown_topology()\n    {record}")
+        self.running_topology = None
+        self.stop_bmp()  # the relay's sockets would keep the old namespaces alive
+        ret, out, err = self.exec(f"cd {self.submission_dir} && sudo python3 teardown.py teardown --record {record}")
+        print(f"    {out.strip()}")
+        if ret == 0:
+            return CommandResult(True)
+        print(f"    targeted teardown failed ({ret}), falling back to cleanup.py")
+        ret, out, err = self.exec(f"cd {self.submission_dir} && sudo python3 cleanup.py", timeout=120)
+        return CommandResult(ret == 0, err.strip())
+
+    def topology_signature(self) -> Optional[str]:
+        """sha256 over the nodes, links and addressing the submission's bgp.py would build, None if unknown."""
+        ret, out, err = self.exec(f"cd {self.submission_dir} && sudo python3 hot_restart.py signature")
+        try:
+            return json.loads(out)["sha256"] if ret == 0 else None
+        except (ValueError, KeyError):
+            return None
+
+    def hot_restart(self, settle=45) -> CommandResult:
+        """Restart only zebra/bgpd and the web servers inside the running topology."""
+        log.info(f"==> BGPHVirtualMachine.hot_restart()")
+        ret, out, err = self.exec(f"cd {self.submission_dir} && sudo python3 hot_restart.py restart", timeout=120)
+        print(f"    {out.strip()}")
+        if ret != 0:
+            return CommandResult(False, f"hot restart failed ({ret}): {out.strip()} {err.strip()}")
+        self.sleep(settle)  # BGP has to converge again, but there is no Mininet to build
+        return CommandResult(True)
+
+    def start_topology(self, total_timeout=None, reuse=True) -> CommandResult:
+        """
+        Start the submission's topology. With reuse, a topology that is already running from an earlier
+        submission (cohort.py) and has the same signature is kept and only FRR and the web servers are
+        restarted, any other running topology is torn down first.
+        """
+        print(f"\n==> BGPHVirtualMachine.start_topology()")
+        if self.running_topology:
+            signature = self.topology_signature() if reuse else None
+            if signature == self.running_topology:
+                result = self.hot_restart()
+                if result.success:
+                    return result
+                print(f"    {result.message}, rebuilding")
+            elif reuse:
+                print(f"    topology changed ({signature} != {self.running_topology}), rebuilding")
+            self.teardown_topology()
+
+        total_timeout = total_timeout or self.durations.timeout("topology_dry_run", 240, floor=60)
+        started = time.time()
+
+        ret, out, err = self.exec(f"cd {self.submission_dir} && sudo python3 bgp.py --scriptfile /dev/null",
+                                timeout=total_timeout, on_chunk=self._print_progress)
+
+        self.topology_start_output = f"{err}\n\n{out}".strip()
+        if ret == 0:
+            self.durations.record("topology_dry_run", time.time() - started)
+        log.debug(f"topology start output:\n{self.topology_start_output}")
+
+        # start the topology in the background, bgp.py cleans up after the dry run itself (`mn -c`), and
+        # bgp_sleep has it record what it created, so teardown_topology() can remove it without `mn -c`
+        self.exec_bg(f"cd {self.submission_dir} && sudo nohup python3 bgp.py --scriptfile bgp_sleep & disown")
+
+        self.sleep(90)
+
+        if "*** Starting CLI:" in self.topology_start_output:
+            self.running_topology = self.topology_signature()
+            return CommandResult(True)
+        else:
+            _out = self.topology_start_output
+            self.topology_start_output = None
+            return CommandResult(False, f"Topology did not start within {total_timeout}s, output: {_out}")
+
+    ## Rogue AS management
+
+    def _mark_event(self, event_file) -> str:
+        """Shell prefix that stores the guest time right before the command runs, for the convergence timeline"""
+        return f"date +%s.%N > {event_file}; " if event_file else ""
 
+    def _mark_done(self, event_file) -> str:
+        """Shell suffix that stores the guest time once the command returned, keeping its exit code"""
+        return f"; ret=$?; date +%s.%N > {event_file}.done; exit $ret" if event_file else ""
 
-    def start_rogue(self, use_hard=False) -> CommandResult:
+    def start_rogue(self, use_hard=False, settle=5, event_file=None) -> CommandResult:
         print(f"\n==> BGPHVirtualMachine.start_rogue()")
         script = "start_rogue_hard.sh" if use_hard else "start_rogue.sh"
-        ret, out, err = self._ssh_exec_command(f"cd {self.BGPHijacking_dir} && bash ./{script}")
-        time.sleep(5)
+        ret, out, err = self.exec(
+            f"{self._mark_event(event_file)}cd {self.submission_dir} && bash ./{script}{self._mark_done(event_file)}")
+        self.sleep(settle)
         return CommandResult(ret == 0, err if ret != 0 else "")
 
-
-
-    def stop_rogue(self) -> CommandResult:
+    def stop_rogue(self, settle=5, event_file=None) -> CommandResult:
         print(f"\n==> BGPHVirtualMachine.stop_rogue()")
-        ret, out, err = self._ssh_exec_command(f"cd {self.BGPHijacking_dir} && bash ./stop_rogue.sh")
-        time.sleep(5)
+        ret, out, err = self.exec(
+            f"{self._mark_event(event_file)}cd {self.submission_dir} && bash ./stop_rogue.sh{self._mark_done(event_file)}")
+        self.sleep(settle)
         return CommandResult(ret == 0, err if ret != 0 else "")
 
+    ## Control plane monitoring
+
+    BMP_PORT = 11019  # where bmp_relay.py listens inside every router namespace
+
+    def _vtysh(self, router, *commands) -> list:
+        """Run vtysh with one -c per command in a router, returns [exitcode, output]."""
+        command = "vtysh " + " ".join(f"-c '{c}'" for c in commands)
+        result = self._in_node(router, command)
+        if result is None:
+            result = self.exec(f"sudo python3 {self.submission_dir}/run.py --node {router} --cmd \"{command}\"",
+                               max_output=1024 * 1024)
+        ret, out, err = result
+        return [ret, out + err]
+
+    def start_bmp(self, routers) -> CommandResult:
+        """
+        Have every router's bgpd stream its routes over BMP to a collector on the host (bmp.py), which
+        times each router's switch of origin AS. Best effort: bgpd only knows BMP with its bmp module
+        loaded, which the image from prepare_image.py does.
+        """
+        log.info(f"==> BGPHVirtualMachine.start_bmp()")
+        self.stop_bmp()
+        local_as = {}
+        for router in routers:
+            ret, out = self._vtysh(router, "show running-config")
+            match = re.search(r"^router bgp (\d+)", out, re.M)
+            if match:
+                local_as[router] = int(match.group(1))
+        if not local_as:
+            return CommandResult(False, "no router runs bgpd")
+        self.bmp = BMPCollector(local_as=local_as)
+        self.exec_bg(f"cd {self.submission_dir} && sudo python3 bmp_relay.py --routers {','.join(local_as)} "
+                     f"--port {self.BMP_PORT} --collector {self.host_from_guest}:{self.bmp.port}")
+        self.sleep(1)  # bgpd retries its session anyway, this only saves it the first retry
+        configured = []
+        for router, asn in local_as.items():
+            # the Loc-RIB (RFC 9069) is what the router selected, older FRR only sends what it received
+            for monitor in ("loc-rib", "post-policy"):
+                ret, out = self._vtysh(router, "configure terminal", f"router bgp {asn}", "bmp targets bgph",
+                                       f"bmp monitor ipv4 unicast {monitor}",
+                                       f"bmp connect 127.0.0.1 port {self.BMP_PORT} min-retry 100 max-retry 1000")
+                if ret == 0 and "%" not in out:
+                    configured.append(router)
+                    break
+            else:
+                log.info(f"{router}: bgpd did not take the BMP configuration: {out.strip()}")
+        if not configured:
+            self.stop_bmp()
+            return CommandResult(False, "bgpd runs without the bmp module")
+        print(f"    BMP from {', '.join(configured)} to 127.0.0.1:{self.bmp.port}")
+        return CommandResult(True)
+
+    def stop_bmp(self):
+        if self.bmp is None:
+            return
+        self.bmp.close()
+        self.bmp = None
+        self.exec("sudo pkill -f '[b]mp_relay.py'")
+
+    ## Test Helpers
 
-    # def check_website(self, shell, host="h5-1") -> str:
     def check_website(self, host="h5-1") -> str:
         print(f"\n==> BGPHVirtualMachine.check_website()")
-        ret, out, err = self._ssh_exec_command(
-            f"sudo python3 {self.BGPHijacking_dir}/run.py --node {host} --cmd 'curl -s 11.0.1.1'")
-        return out
+        started = time.time()
+        try:
+            return self._check_website(host)
+        finally:
+            self.probe_latencies.append(("website", time.time() - started))
 
+    def _check_website(self, host) -> str:
+        if self.guestd is not None:
+            try:
+                return self.guestd.http(host, "11.0.1.1") or ""
+            except TransportError as e:
+                log.warning(f"guestd failed ({e}), falling back to run.py")
+                self.guestd = None
+        ret, out, err = self.exec(
+            f"sudo python3 {self.submission_dir}/run.py --node {host} --cmd 'curl -s 11.0.1.1'")
+        return out
 
-    # def bgp_messages(self, shell, router="R3") -> str:
     def bgp_messages(self, router="R3") -> str:
         print(f"\n==> BGPHVirtualMachine.bgp_messages()")
-        ret, out, err = self._ssh_exec_command(
-            f"sudo python3 {self.BGPHijacking_dir}/run.py --node {router} --cmd \"vtysh -c 'show ip bgp'\"")
+        result = self._in_node(router, "vtysh -c 'show ip bgp'")
+        if result is not None:
+            return result[1]
+        ret, out, err = self.exec(
+            f"sudo python3 {self.submission_dir}/run.py --node {router} --cmd \"vtysh -c 'show ip bgp'\"", max_output=1024 * 1024)
         return out
 
-    # def do_extra_checks(self, shell):
+    def survey(self, hosts=(), routers=(), timeout=10):
+        """
+        Website output of every host and `show ip bgp` of every router, all collected in parallel
+        inside the guest in one command. Returns {"hosts": {name: output}, "routers": {name: output}},
+        an output is None when the node is missing or the command failed. None if the pass itself failed.
+        """
+        log.info(f"==> BGPHVirtualMachine.survey()\n    {list(hosts)} {list(routers)}")
+        started = time.time()
+        try:
+            return self._survey(hosts, routers, timeout)
+        finally:
+            self.probe_latencies.append(("survey", time.time() - started))
+
+    def _survey(self, hosts, routers, timeout):
+        if self.guestd is not None:
+            survey = self._survey_guestd(hosts, routers, timeout)
+            if survey is not None:
+                return survey
+        ret, out, err = self.exec(
+            f"cd {self.submission_dir} && sudo python3 probe.py snapshot --hosts {','.join(hosts)} "
+            f"--routers {','.join(routers)} --timeout {timeout}", timeout=timeout + 30, max_output=4 * 1024 * 1024)
+        if ret != 0:
+            log.warning(f"survey failed ({ret}): {err.strip()}")
+            return None
+        try:
+            return json.loads(out)
+        except ValueError as e:
+            log.warning(f"survey returned unparsable output: {e}")
+            return None
+
+    def _survey_guestd(self, hosts, routers, timeout):
+        """survey() with one guestd request per node, all in flight at once."""
+        def host(name):
+            return self.guestd.http(name, "11.0.1.1", timeout=timeout)
+
+        def router(name):
+            ret, out, err = self.guestd.exec("vtysh -c 'show ip bgp'", timeout=timeout, node=name)
+            return out if ret == 0 else None
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(hosts) + len(routers))) as pool:
+                h = {name: pool.submit(host, name) for name in hosts}
+                r = {name: pool.submit(router, name) for name in routers}
+                return {"hosts": {k: f.result() for k, f in h.items()},
+                        "routers": {k: f.result() for k, f in r.items()}}
+        except TransportError as e:
+            log.warning(f"guestd failed ({e}), falling back to probe.py")
+            self.guestd = None
+            return None
+
     def do_extra_checks(self):
-        print(f"\n==> BGPHVirtualMachine.do_extra_checks()")
-        return
-        ret, out1, err = self._ssh_exec_command("ps -ef | grep webserver")
-        ret, out2, err = self._ssh_exec_command("ls -lAF /tmp/anti_cheating_secret5566.txt")
-        return out1 + "\n\n" + out2
+        """
+        log autograder debug information that might be helpful (students won't see this)
+        no need to return anything, the grader runs this in the background and the output only
+        lands in the debug log
+        """
+        log.info(f"==> BGPHVirtualMachine.do_extra_checks()")
+        debug_info_cmds = [
+            f"sudo python3 {self.submission_dir}/run.py --list",
+            "ps aux",
+            # "ls -lAF /tmp/anti_cheating_secret5566.txt",
+        ]
+        if not debug_info_cmds:
+            log.info(f"    No extra checks being run right now")
+        for cmd in debug_info_cmds:
+            ret, out, err = self.exec(cmd, max_output=1024 * 1024)
+            log.debug(f"> {cmd} (retcode = {ret})\nSTDOUT:\n{out.strip()}\nSTDERR:\n{err.strip()}")
@@ -0,0 +1,243 @@
+"""
+Host side of the BGP Monitoring Protocol (RFC 7854): every router's bgpd streams the routes it learns
+and selects to a BMPCollector, which keeps, per router, a timeline of the origin AS of the route it
+uses to reach the website. That gives exact per-router hijack times from the control plane, without
+polling `show ip bgp`.
+
+The routers live in Mininet namespaces inside the guest, scripts/bmp_relay.py accepts their BMP
+sessions there and forwards each one through the QEMU user network to the collector, after a first
+line that names the router.
+"""
+import time
+import socket
+import struct
+import ipaddress
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from debuglog import get_logger
+
+log = get_logger("bmp")
+
+TARGET = "11.0.1.1"  # the website every host probes, the hard rogue announces a more specific prefix of it
+
+MSG_ROUTE_MONITORING = 0
+MSG_PEER_DOWN = 2
+MSG_PEER_UP = 3
+MSG_INITIATION = 4
+MSG_TERMINATION = 5
+PEER_HEADER = struct.Struct("!BB8s16sII II")  # type, flags, distinguisher, address, AS, BGP ID, seconds, microseconds
+PEER_LOC_RIB = 3  # RFC 9069, the routes the router selected
+FLAG_LEGACY_AS_PATH = 0x20  # A flag: AS_PATH carries 2 byte ASNs
+BGP_UPDATE = 2
+ATTR_AS_PATH = 2
+
+
+def parse_prefixes(data: bytes) -> List[ipaddress.IPv4Network]:
+    prefixes, i = [], 0
+    while i < len(data):
+        length = data[i]
+        size = (length + 7) // 8
+        raw = data[i + 1:i + 1 + size].ljust(4, b"\0")
+        prefixes.append(ipaddress.IPv4Network((raw, length), strict=False))
+        i += 1 + size
+    return prefixes
+
+
+def parse_as_path(attrs: bytes, asn_size: int) -> Optional[List[int]]:
+    """ASNs of the AS_PATH attribute in order, None if the update carries none (a pure withdrawal)."""
+    i = 0
+    while i + 3 <= len(attrs):
+        flags, kind = attrs[i], attrs[i + 1]
+        if flags & 0x10:  # extended length
+            length, i = struct.unpack_from("!H", attrs, i + 2)[0], i + 4
+        else:
+            length, i = attrs[i + 2], i + 3
+        if kind == ATTR_AS_PATH:
+            path, j, value = [], 0, attrs[i:i + length]
+            while j + 2 <= len(value):
+                count = value[j + 1]
+                fmt = "!%d%s" % (count, "I" if asn_size == 4 else "H")
+                path.extend(struct.unpack_from(fmt, value, j + 2))
+                j += 2 + count * asn_size
+            return path
+        i += length
+    return None
+
+
+def parse_update(pdu: bytes, asn_size: int) -> Tuple[List, List, Optional[List[int]]]:
+    """Withdrawn prefixes, announced prefixes and AS_PATH of a BGP UPDATE, including its 19 byte header."""
+    if len(pdu) < 23 or pdu[18] != BGP_UPDATE:
+        return [], [], None
+    body = pdu[19:]
+    withdrawn_len = struct.unpack_from("!H", body, 0)[0]
+    withdrawn = parse_prefixes(body[2:2 + withdrawn_len])
+    i = 2 + withdrawn_len
+    attrs_len = struct.unpack_from("!H", body, i)[0]
+    attrs = body[i + 2:i + 2 + attrs_len]
+    return withdrawn, parse_prefixes(body[i + 2 + attrs_len:]), parse_as_path(attrs, asn_size)
+
+
+@dataclass
+class RouterFeed:
+    """What one router reported over its current BMP session."""
+    name: str
+    local_as: Optional[int] = None
+    tables: Dict[tuple, Dict[ipaddress.IPv4Network, List[int]]] = field(default_factory=dict)  # peer -> prefix -> AS_PATH
+    bgp_ids: Dict[tuple, int] = field(default_factory=dict)
+    loc_rib: bool = False
+    origins: List[Tuple[float, Optional[int]]] = field(default_factory=list)  # (time, origin AS) at every change
+
+    def selected(self, target: ipaddress.IPv4Address) -> Optional[int]:
+        """
+        Origin AS of the route to `target`: the longest matching prefix, from the Loc-RIB when the router
+        sends one, else the shortest AS_PATH among its peers (then lowest BGP ID), as the BGP decision
+        process would pick when nothing else differs.
+        """
+        candidates = []
+        for peer, table in self.tables.items():
+            if self.loc_rib and peer[0] != PEER_LOC_RIB:
+                continue
+            for prefix, path in table.items():
+                if target in prefix:
+                    candidates.append((-prefix.prefixlen, len(path), self.bgp_ids.get(peer, 0), path))
+        if not candidates:
+            return None
+        path = min(candidates, key=lambda c: c[:3])[3]
+        return path[-1] if path else self.local_as  # an empty AS_PATH is a route the router originates
+
+    def update(self, at: float, target: ipaddress.IPv4Address):
+        origin = self.selected(target)
+        if not self.origins or self.origins[-1][1] != origin:
+            self.origins.append((at, origin))
+
+
+class BMPCollector:
+    """
+    Accepts BMP sessions on 127.0.0.1:<port>, a guest reaches it at the QEMU user network's gateway.
+    Times are the routers' own BMP timestamps, the guest clock the convergence timelines use too.
+    """
+
+    def __init__(self, target: str = TARGET, local_as: Optional[Dict[str, int]] = None) -> None:
+        self.target = ipaddress.IPv4Address(target)
+        self.local_as = dict(local_as or {})
+        self.feeds: Dict[str, RouterFeed] = {}
+        self.sessions: Dict[str, socket.socket] = {}  # router -> its newest connection
+        self.lock = threading.Lock()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self._closed = False
+        threading.Thread(target=self._accept, name="bmp-accept", daemon=True).start()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._session, args=(conn,), name="bmp-session", daemon=True).start()
+
+    @staticmethod
+    def _read(conn: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _session(self, conn: socket.socket):
+        router = None
+        try:
+            line = b""
+            while not line.endswith(b"\n") and len(line) < 64:
+                line += self._read(conn, 1)
+            router = line.decode("ascii", "replace").strip()
+            with self.lock:
+                # a reconnect (bgpd retried, or the guest was reverted) starts over with a full table dump
+                old = self.sessions.get(router)
+                self.sessions[router] = conn
+                feed = self.feeds.setdefault(router, RouterFeed(router, self.local_as.get(router)))
+                feed.tables.clear()
+            if old is not None:
+                old.close()
+            log.info(f"BMP session from {router}")
+            while True:
+                version, length, kind = struct.unpack("!BIB", self._read(conn, 6))
+                if version != 3 or length < 6:
+                    log.warning(f"{router}: not BMP version 3 ({version}), closing the session")
+                    return
+                body = self._read(conn, length - 6)
+                with self.lock:
+                    if self.sessions.get(router) is not conn:
+                        return
+                    self._handle(feed, kind, body)
+        except (OSError, EOFError, struct.error, ValueError) as e:
+            if router and not self._closed:
+                log.info(f"BMP session from {router} ended ({e!r})")
+        finally:
+            with self.lock:
+                if router and self.sessions.get(router) is conn:
+                    del self.sessions[router]
+            conn.close()
+
+    def _handle(self, feed: RouterFeed, kind: int, body: bytes):
+        if kind in (MSG_INITIATION, MSG_TERMINATION) or len(body) < PEER_HEADER.size:
+            return
+        peer_type, flags, distinguisher, address, peer_as, bgp_id, seconds, micros = PEER_HEADER.unpack_from(body)
+        at = seconds + micros / 1e6 if seconds else time.time()
+        peer = (peer_type, distinguisher, address)
+        if kind == MSG_ROUTE_MONITORING:
+            withdrawn, announced, path = parse_update(body[PEER_HEADER.size:], 2 if flags & FLAG_LEGACY_AS_PATH else 4)
+            table = feed.tables.setdefault(peer, {})
+            feed.bgp_ids[peer] = bgp_id
+            feed.loc_rib = feed.loc_rib or peer_type == PEER_LOC_RIB
+            for prefix in withdrawn:
+                table.pop(prefix, None)
+            if path is not None:
+                for prefix in announced:
+                    table[prefix] = path
+        elif kind == MSG_PEER_DOWN:
+            feed.tables.pop(peer, None)
+        elif kind != MSG_PEER_UP:
+            return
+        feed.update(at, self.target)
+
+    def connected(self) -> List[str]:
+        with self.lock:
+            return sorted(self.sessions)
+
+    def switch_times(self, event: float) -> Dict[str, Tuple[Optional[int], Optional[float], int]]:
+        """
+        router -> (origin AS it uses now, seconds from the guest time `event` until its last origin
+        change, None if it did not change, number of changes after the event).
+        """
+        times = {}
+        with self.lock:
+            for router, feed in self.feeds.items():
+                after = [(at, origin) for at, origin in feed.origins if at >= event]
+                current = feed.origins[-1][1] if feed.origins else None
+                times[router] = (current, max(0.0, after[-1][0] - event) if after else None, len(after))
+        return times
+
+    def metrics(self, event: float, metric_name: str = "time to switch") -> str:
+        lines = [f"Control plane (BMP), origin AS of the route each router uses for {self.target}:"]
+        for router, (origin, seconds, changes) in sorted(self.switch_times(event).items()):
+            where = f"AS {origin}" if origin is not None else "no route"
+            if seconds is None:
+                lines.append(f"  {router}: {where}, unchanged")
+            else:
+                lines.append(f"  {router}: {where}, {metric_name} {seconds:.2f}s, {changes} changes")
+        return "\n".join(lines)
+
+    def close(self):
+        self._closed = True
+        self.server.close()
+        with self.lock:
+            for conn in self.sessions.values():
+                conn.close()
+            self.sessions.clear()
@@ -0,0 +1,184 @@
+import gzip
+import json
+import time
+import base64
+import threading
+from pathlib import Path
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+from utils import CommandResult
+from transports import Transport
+from debuglog import get_logger
+
+log = get_logger("cassette")
+
+CASSETTE_VERSION = 1
+
+
+class Cassette:
+    """
+    Every guest interaction of one grading run, one JSON object per line in a gzip file.
+    The first line holds the run's nondeterministic inputs (anti-cheating secret, random seed) and grader settings,
+    every later line one interaction: kind, node, command, exit code, stdout, stderr and duration.
+    """
+
+    def __init__(self, meta: dict, entries: Optional[List[dict]] = None) -> None:
+        self.meta = meta
+        self.entries = entries or []
+        self._file = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create(path: Path, meta: dict) -> "Cassette":
+        cassette = Cassette(dict(meta, version=CASSETTE_VERSION, recorded=time.time()))
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        cassette._file = gzip.open(path, "wt")
+        cassette._file.write(json.dumps(cassette.meta) + "\n")
+        return cassette
+
+    @staticmethod
+    def load(path: Path) -> "Cassette":
+        with gzip.open(path, "rt") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if not lines or lines[0].get("version") != CASSETTE_VERSION:
+            raise ValueError(f"{path} is not a version {CASSETTE_VERSION} cassette")
+        return Cassette(lines[0], lines[1:])
+
+    def append(self, entry: dict):
+        with self._lock:
+            self.entries.append(entry)
+            if self._file:
+                self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def _key(kind: str, command: str, node: Optional[str] = None) -> tuple:
+    return kind, node or "", command
+
+
+class RecordingTransport(Transport):
+    """Passes everything through to `inner` and appends each interaction to the cassette."""
+
+    def __init__(self, inner: Transport, cassette: Cassette) -> None:
+        self.inner = inner
+        self.cassette = cassette
+        self.name = f"recording({inner.name})"
+
+    def _record(self, kind, command, started, node=None, rc=0, out="", err="", **extra):
+        self.cassette.append({"k": kind, "n": node, "c": command, "rc": rc, "o": out, "e": err,
+                              "dt": round(time.time() - started, 4), **extra})
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None, node=None) -> list:
+        started = time.time()
+        kwargs = {"node": node} if node else {}
+        ret, out, err = self.inner.exec(command, timeout=timeout, on_chunk=on_chunk, max_output=max_output, **kwargs)
+        self._record("exec", command, started, node, ret, out, err)
+        return [ret, out, err]
+
+    def http(self, node: str, address="11.0.1.1", timeout=5) -> Optional[str]:
+        started = time.time()
+        body = self.inner.http(node, address, timeout=timeout)
+        self._record("http", address, started, node, 0 if body is not None else 1, body or "")
+        return body
+
+    def exec_background(self, command: str):
+        started = time.time()
+        result = self.inner.exec_background(command)
+        self._record("exec_background", command, started)
+        return result
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        started = time.time()
+        result = self.inner.read_file(remote_path, local_path)
+        data = base64.b64encode(Path(local_path).read_bytes()).decode() if result.success else ""
+        self._record("read_file", remote_path, started, rc=0 if result.success else 1, err=result.message, data=data)
+        return result
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        started = time.time()
+        result = self.inner.write_file(local_path, remote_path)
+        self._record("write_file", remote_path, started, rc=0 if result.success else 1, err=result.message)
+        return result
+
+    def health(self) -> Optional[float]:
+        return self.inner.health()
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Serves the recorded responses instead of talking to a guest. Interactions are matched by
+    kind, node and command, in recorded order per key, so background tasks that interleaved
+    differently still match. Anything never recorded fails and is listed in mismatch_report().
+    """
+    name = "replay"
+
+    def __init__(self, cassette: Cassette) -> None:
+        self.cassette = cassette
+        self.responses: Dict[tuple, deque] = defaultdict(deque)
+        for entry in cassette.entries:
+            self.responses[_key(entry["k"], entry["c"], entry.get("n"))].append(entry)
+        self.last: Dict[tuple, dict] = {}
+        self.missing: List[tuple] = []
+        self.repeated: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _take(self, kind, command, node=None) -> Optional[dict]:
+        key = _key(kind, command, node)
+        with self._lock:
+            if self.responses[key]:
+                entry = self.last[key] = self.responses[key].popleft()
+                return entry
+            if key in self.last:
+                # asked more often than recorded, e.g. a retry the recorded run did not need
+                self.repeated.append(key)
+                return self.last[key]
+            self.missing.append(key)
+            log.warning(f"replay has no recording of {kind} {node or ''} {command[:200]}")
+            return None
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None, node=None) -> list:
+        entry = self._take("exec", command, node)
+        if entry is None:
+            return [-1, "", f"not recorded: {command}"]
+        if on_chunk:
+            on_chunk("stdout", entry["o"])
+            on_chunk("stderr", entry["e"])
+        return [entry["rc"], entry["o"], entry["e"]]
+
+    def http(self, node: str, address="11.0.1.1", timeout=5) -> Optional[str]:
+        entry = self._take("http", address, node)
+        return entry["o"] if entry and entry["rc"] == 0 else None
+
+    def exec_background(self, command: str):
+        self._take("exec_background", command)
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        entry = self._take("read_file", remote_path)
+        if entry is None:
+            return CommandResult(False, f"not recorded: {remote_path}")
+        if entry["rc"] == 0:
+            Path(local_path).write_bytes(base64.b64decode(entry.get("data", "")))
+        return CommandResult(entry["rc"] == 0, entry["e"])
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        entry = self._take("write_file", remote_path)
+        return CommandResult(entry is not None and entry["rc"] == 0, "" if entry else f"not recorded: {remote_path}")
+
+    def health(self) -> Optional[float]:
+        return 0.0
+
+    def mismatch_report(self) -> str:
+        unused = sum(len(q) for q in self.responses.values())
+        lines = [f"Replay: {len(self.cassette.entries)} recorded interactions, {len(self.missing)} never recorded, "
+                 f"{len(self.repeated)} served again, {unused} recorded but not asked for"]
+        for kind, node, command in self.missing:
+            lines.append(f"  missing {kind}{f' [{node}]' if node else ''}: {command[:200]}")
+        return "\n".join(lines)
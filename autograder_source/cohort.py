@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Grade several submissions one after another on a single VM.
+
+    python3 cohort.py <submission-dir> [<submission-dir> ...] --out cohort/
+
+Every submission is copied into the folder the VM shares over 9p and graded by BGPHGrader with the
+settings bgph_grader.py takes from the BGPH_* variables, its results.json and artifacts go to
+<out>/<submission name>/. The topology stays up between submissions: when the next bgp.py builds the
+same nodes, links and addresses, start_topology() keeps the Mininet namespaces and only restarts
+zebra/bgpd and the web servers with the new configs (scripts/hot_restart.py), otherwise it tears the
+running topology down and builds the new one from scratch.
+
+Clones and retries are turned off, both unmount the share the next submission arrives through.
+"""
+import os
+import time
+import shutil
+from argparse import ArgumentParser
+from pathlib import Path
+from bgph_vm import BGPHVirtualMachine
+from bgph_grader import BGPHGrader, grader_options
+from results import Result
+import debuglog
+
+
+def copy_submission(submission: Path, folder: Path):
+    """Replace the shared folder's contents with `submission`, the guest sees the new files right away."""
+    shutil.rmtree(folder, ignore_errors=True)
+    shutil.copytree(submission, folder, symlinks=True)
+    for script in folder.glob("*.sh"):
+        script.chmod(script.stat().st_mode | 0o111)
+
+
+def main():
+    parser = ArgumentParser("Grade a cohort of submissions on one VM")
+    parser.add_argument("submissions", type=Path, nargs="+")
+    parser.add_argument("--out", type=Path, default=Path("cohort"),
+                        help="folder for one results.json and artifacts folder per submission")
+    parser.add_argument("--share", type=Path, default=Path("/tmp/bgph-cohort-share"),
+                        help="host folder the VM mounts as /autograder/submission")
+    args = parser.parse_args()
+
+    debuglog.setup()
+    options = grader_options()
+    if options["sharded"] or options["retries"]:
+        print("==> clones and retries need the share unmounted, grading the cohort without them")
+        options.update(sharded=False, retries=0)
+    vm = BGPHVirtualMachine(memory_mode=os.environ.get("BGPH_MEMORY_MODE", "private"),
+                            boot_mode=os.environ.get("BGPH_BOOT_MODE", "firmware"))
+    vm.host_share_dir = args.share
+    folder = args.share / vm.submission_dir.name
+    copy_submission(args.submissions[0], folder)  # the VM's setup already looks into the folder
+    vm.start_vm_async()
+
+    scores = []
+    try:
+        for i, submission in enumerate(args.submissions):
+            print(f"\n\n###\n### Submission {i + 1}/{len(args.submissions)}: {submission}\n###\n")
+            started = time.time()
+            if i:
+                copy_submission(submission, folder)
+            out = args.out / submission.name
+            grader = BGPHGrader(vm, **options)
+            grader.submission_path = folder
+            grader.artifacts_path = out / "artifacts"
+            grader.grade()
+            grader.store_run(started)
+            result = Result()
+            grader.generate_results(result)
+            result.write_json(out / "results.json")
+            scores.append((submission.name, sum(t.score for t in result.tests), sum(t.max_score for t in result.tests),
+                           time.time() - started))
+            if not vm.healthy():
+                print("==> the VM failed, the remaining submissions need a run of their own")
+                break
+    finally:
+        vm.shutdown()
+
+    for name, score, max_score, seconds in scores:
+        print(f"{name:<40} {score:>4}/{max_score}  {seconds:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from debuglog import get_logger
+
+log = get_logger("convergence")
+
+STATE_NAMES = {"D": "Default", "A": "Attacker", "X": "unreachable", "?": "unexpected reply"}
+
+
+@dataclass
+class HostTimeline:
+    host: str
+    runs: List[list] = field(default_factory=list)  # [start, state, samples, end], seconds since recording started
+    bodies: Dict[str, str] = field(default_factory=dict)
+    found: bool = True
+    nodes: Dict[str, str] = field(default_factory=dict)  # state -> Mininet node that served it
+
+    def final_state(self, stable: float) -> Optional[str]:
+        """The state the host settled in, None if it was still changing when recording stopped."""
+        if not self.runs:
+            return None
+        start, state, samples, end = self.runs[-1]
+        return state if end - start >= stable else None
+
+    def settle_time(self, event: float) -> Optional[float]:
+        """Seconds from the event until the host entered its final state."""
+        if not self.runs:
+            return None
+        return max(0.0, self.runs[-1][0] - event)
+
+    def flaps(self, event: float) -> int:
+        """State changes after the event, beyond the one needed to reach the final state."""
+        changes = sum(1 for run in self.runs[1:] if run[0] >= event)
+        return max(0, changes - 1)
+
+    def served_by(self, state: str) -> str:
+        return f" (served by {self.nodes[state]})" if state in self.nodes else ""
+
+    def compact(self) -> str:
+        return " | ".join(f"{state} {end - start:.1f}s" for start, state, samples, end in self.runs) or "no samples"
+
+
+@dataclass
+class Timeline:
+    label: str
+    event: float = 0.0  # seconds since recording started
+    stable: float = 5.0
+    duration: float = 0.0
+    hosts: Dict[str, HostTimeline] = field(default_factory=dict)
+
+    @staticmethod
+    def from_json(label: str, text: str) -> "Timeline":
+        data = json.loads(text)
+        t0 = data["t0"]
+        event = data["event"] - t0 if data.get("event") else 0.0
+        timeline = Timeline(label, event=event, stable=data.get("stable", 5.0), duration=data["end"] - t0)
+        for host, h in data["hosts"].items():
+            timeline.hosts[host] = HostTimeline(host, h["runs"], h["bodies"], h.get("found", True), h.get("nodes", {}))
+        return timeline
+
+    def output_for(self, host: str) -> Optional[str]:
+        """What a single `curl` from this host would have printed in the settled state, None if unknown or unstable."""
+        h = self.hosts.get(host)
+        if h is None or not h.found:
+            return None
+        state = h.final_state(self.stable)
+        if state is None:
+            return None
+        return h.bodies.get(state, "")
+
+    def settle_times(self) -> Dict[str, float]:
+        """Seconds from the event until each host settled, for hosts that settled and changed after the event."""
+        times = {}
+        for host, h in self.hosts.items():
+            if h.found and h.final_state(self.stable) is not None and h.runs[-1][0] >= self.event:
+                times[host] = h.settle_time(self.event)
+        return times
+
+    def metrics(self, metric_name: str = "time to settle") -> str:
+        lines = [f"Convergence timeline ({self.label}, {self.duration:.1f}s recorded, states: "
+                 "D=Default, A=Attacker, X=unreachable):"]
+        for host, h in sorted(self.hosts.items()):
+            if not h.found:
+                lines.append(f"  {host}: node not found")
+                continue
+            state = h.final_state(self.stable)
+            if state is None:
+                lines.append(f"  {host}: did not settle, {h.flaps(self.event)} flaps [{h.compact()}]")
+                continue
+            if h.runs[-1][0] < self.event:
+                lines.append(f"  {host}: {STATE_NAMES[state]}{h.served_by(state)}, unchanged [{h.compact()}]")
+                continue
+            lines.append(f"  {host}: {STATE_NAMES[state]}{h.served_by(state)}, {metric_name} {h.settle_time(self.event):.1f}s, "
+                         f"{h.flaps(self.event)} flaps [{h.compact()}]")
+        return "\n".join(lines)
+
+
+class ConvergenceRecorder:
+    """
+    Records how the website answer changes on every host while the rogue AS is started or stopped.
+    The probing runs inside the guest (scripts/probe.py), all hosts in parallel at a high rate,
+    and stops once every host has held the same answer for `stable` seconds after the action returned.
+    """
+
+    def __init__(self, vm, hosts: List[str], interval: float = 0.2, stable: float = 5.0) -> None:
+        self.vm = vm
+        self.hosts = hosts
+        self.interval = interval
+        self.stable = stable
+        self._pending = {}  # label -> max duration
+
+    def _out_path(self, label: str) -> str:
+        return f"/tmp/bgph-timeline-{label}.json"
+
+    def event_file(self, label: str) -> str:
+        return f"/tmp/bgph-event-{label}"
+
+    def event_time(self, label: str) -> Optional[float]:
+        """Guest clock time the event of a recorded phase was marked at, None if it was not."""
+        ret, out, err = self.vm.exec(f"cat {self.event_file(label)}")
+        try:
+            return float(out) if ret == 0 else None
+        except ValueError:
+            return None
+
+    def start(self, label: str, min_duration: float = 5.0, max_duration: float = 60.0):
+        log.info(f"==> ConvergenceRecorder.start({label})")
+        out = self._out_path(label)
+        ready = f"/tmp/bgph-ready-{label}"
+        # removed before probe.py starts, a leftover event or timeline would end the new recording right away
+        self.vm.exec(f"rm -f {out} {ready} {self.event_file(label)} {self.event_file(label)}.done", timeout=30)
+        self.vm.exec_bg(
+            f"cd {self.vm.submission_dir} && "
+            f"sudo python3 probe.py timeline --hosts {','.join(self.hosts)} --out {out} "
+            f"--interval {self.interval} --stable {self.stable} --min-duration {min_duration} "
+            f"--max-duration {max_duration} --event-file {self.event_file(label)} --ready-file {ready}")
+        self._pending[label] = max_duration
+        # the action must wait until every host answered once, or the timeline misses the event
+        ret, _, _ = self.vm.exec(f"for i in $(seq 1 150); do [ -f {ready} ] && exit 0; sleep 0.1; done; exit 1",
+                                 timeout=30)
+        if ret != 0:
+            print(f"    probe.py did not report ready for {label}, recording anyway")
+
+    def collect(self, label: str) -> Optional[Timeline]:
+        log.info(f"==> ConvergenceRecorder.collect({label})")
+        max_duration = self._pending.pop(label, 60.0)
+        out = self._out_path(label)
+        ret, text, err = self.vm.exec(
+            f"for i in $(seq 1 {int(max_duration * 2) + 40}); do [ -f {out} ] && break; sleep 0.5; done; cat {out}",
+            timeout=max_duration + 30)
+        if ret != 0 or not text.strip():
+            print(f"    No timeline recorded for {label} ({ret = }): {err.strip()}")
+            return None
+        try:
+            timeline = Timeline.from_json(label, text)
+        except (ValueError, KeyError) as e:
+            print(f"    Could not parse timeline for {label}: {e}")
+            return None
+        print(timeline.metrics())
+        return timeline
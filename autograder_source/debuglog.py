@@ -0,0 +1,100 @@
+import sys
+import time
+import logging
+import threading
+from pathlib import Path
+from collections import deque
+from typing import Optional
+
+LOGGER_NAME = "bgph"
+DEFAULT_DUMP_PATH = Path("/autograder/results/artifacts/debug-log.txt")
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last `capacity` formatted records in memory, older ones are dropped."""
+
+    def __init__(self, capacity: int = 20000) -> None:
+        super().__init__(level=logging.DEBUG)
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+        self.setFormatter(logging.Formatter("%(asctime)s.%(msecs)03d %(levelname)-7s %(threadName)s %(name)s: %(message)s",
+                                            datefmt="%H:%M:%S"))
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def dump(self, path: Path, reason: str = "") -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            lines = list(self.records)
+        with open(path, "w") as f:
+            f.write(f"# bgph debug log, written {time.asctime()}: {reason}\n")
+            if self.dropped:
+                f.write(f"# {self.dropped} older records were dropped from the ring buffer\n")
+            f.write("\n".join(lines) + "\n")
+        return path
+
+
+_ring: Optional[RingBufferHandler] = None
+
+
+def setup(capacity: int = 20000, console_level: int = logging.INFO) -> RingBufferHandler:
+    """
+    Everything at DEBUG and above goes to the ring buffer, only `console_level` and above to stdout.
+    Calling it again returns the handler that is already installed.
+    """
+    global _ring
+    if _ring is not None:
+        return _ring
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    _ring = RingBufferHandler(capacity)
+    logger.addHandler(_ring)
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(console)
+    return _ring
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def dump(reason: str, path: Path = DEFAULT_DUMP_PATH) -> Optional[Path]:
+    """Write the whole ring buffer out, only meant for failed tests and errored runs."""
+    if _ring is None:
+        return None
+    written = _ring.dump(path, reason)
+    print(f"==> debug log written to {written} ({reason})")
+    return written
+
+
+class BackgroundTask:
+    """Runs a function on a daemon thread, so diagnostics never hold up the scoring path."""
+
+    def __init__(self, name: str, fn, *args, **kwargs) -> None:
+        self.name = name
+        self.error: Optional[BaseException] = None
+        self.result = None
+        self._thread = threading.Thread(target=self._run, args=(fn, args, kwargs), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, fn, args, kwargs):
+        try:
+            self.result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.error = e
+            get_logger("background").warning(f"{self.name} failed: {e!r}")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the task, returns False if it is still running after `timeout`."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,106 @@
+import time
+import base64
+import shlex
+import hashlib
+from pathlib import Path
+from typing import Optional
+from utils import CommandResult
+from debuglog import get_logger
+
+log = get_logger("transfer")
+
+
+class GuestTransfer:
+    """
+    Move files between the host and the guest through the guest agent file API
+    (guest-file-open / guest-file-read / guest-file-write) in fixed-size chunks,
+    instead of squeezing them through the stdout of guest-exec.
+    """
+
+    def __init__(self, ga, chunk_size: int = 256 * 1024, max_bytes_per_sec: Optional[int] = None) -> None:
+        self.ga = ga  # a transports.GuestAgentTransport
+        self.chunk_size = chunk_size
+        self.max_bytes_per_sec = max_bytes_per_sec
+
+    def _open(self, path: str, mode: str) -> int:
+        result = self.ga.command({"execute": "guest-file-open", "arguments": {"path": path, "mode": mode}})
+        if "return" not in result:
+            raise RuntimeError(f"guest-file-open {path} failed: {result.get('error')}")
+        return result["return"]
+
+    def _close(self, handle: int):
+        self.ga.command({"execute": "guest-file-close", "arguments": {"handle": handle}})
+
+    def _throttle(self, started: float, transferred: int):
+        if not self.max_bytes_per_sec:
+            return
+        ahead = transferred / self.max_bytes_per_sec - (time.time() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def _guest_sha256(self, path: str) -> str:
+        ret, out, err = self.ga.exec(f"sha256sum {shlex.quote(path)}")
+        return out.split()[0] if ret == 0 and out else ""
+
+    def pull(self, remote_path: str, local_path: Path) -> CommandResult:
+        """Copy one guest file to the host, verifying the checksum at the end."""
+        log.info(f"==> GuestTransfer.pull() {remote_path} -> {local_path}")
+        local_path = Path(local_path)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        expected = self._guest_sha256(remote_path)
+        digest = hashlib.sha256()
+        transferred = 0
+        started = time.time()
+
+        handle = self._open(remote_path, "r")
+        try:
+            with open(local_path, "wb") as f:
+                while True:
+                    result = self.ga.command({"execute": "guest-file-read",
+                                               "arguments": {"handle": handle, "count": self.chunk_size}})
+                    if "return" not in result:
+                        return CommandResult(False, f"guest-file-read failed: {result.get('error')}")
+                    chunk = base64.b64decode(result["return"].get("buf-b64", ""))
+                    f.write(chunk)
+                    digest.update(chunk)
+                    transferred += len(chunk)
+                    if result["return"].get("eof") or not chunk:
+                        break
+                    self._throttle(started, transferred)
+        finally:
+            self._close(handle)
+
+        elapsed = max(time.time() - started, 1e-6)
+        log.info(f"    {transferred} bytes in {elapsed:.1f}s ({transferred / elapsed / 1024:.0f} KiB/s)")
+        if expected and digest.hexdigest() != expected:
+            return CommandResult(False, f"checksum mismatch for {remote_path}: {digest.hexdigest()} != {expected}")
+        return CommandResult(True)
+
+    def push(self, local_path: Path, remote_path: str) -> CommandResult:
+        """Copy one host file into the guest, verifying the checksum at the end."""
+        log.info(f"==> GuestTransfer.push() {local_path} -> {remote_path}")
+        digest = hashlib.sha256()
+        transferred = 0
+        started = time.time()
+
+        handle = self._open(remote_path, "w")
+        try:
+            with open(local_path, "rb") as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    result = self.ga.command({"execute": "guest-file-write", "arguments": {
+                        "handle": handle, "buf-b64": base64.b64encode(chunk).decode()}})
+                    if "return" not in result:
+                        return CommandResult(False, f"guest-file-write failed: {result.get('error')}")
+                    digest.update(chunk)
+                    transferred += len(chunk)
+                    self._throttle(started, transferred)
+        finally:
+            self._close(handle)
+
+        actual = self._guest_sha256(remote_path)
+        if actual != digest.hexdigest():
+            return CommandResult(False, f"checksum mismatch for {remote_path}: {actual} != {digest.hexdigest()}")
+        return CommandResult(True)
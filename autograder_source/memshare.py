@@ -0,0 +1,107 @@
+import os
+import json
+import fcntl
+import hashlib
+from pathlib import Path
+from typing import Optional
+from debuglog import get_logger
+
+log = get_logger("memshare")
+
+MEMORY_MODES = ("private", "ksm", "template")
+KSM = Path("/sys/kernel/mm/ksm")
+DEFAULT_TEMPLATE_DIR = Path(os.environ.get("BGPH_TEMPLATE_DIR", "/dev/shm/bgph-template"))
+
+
+def enable_ksm() -> bool:
+    """Start the host's KSM daemon if we may, guest RAM is only merged while it runs."""
+    try:
+        if (KSM / "run").read_text().strip() == "1":
+            return True
+        (KSM / "run").write_text("1\n")
+        return True
+    except OSError as e:
+        log.info(f"KSM is not available ({e}), guest memory is marked mergeable but not merged")
+        return False
+
+
+def ksm_status() -> dict:
+    """Host-wide KSM counters in MB, empty if the kernel has no KSM."""
+    page_mb = os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    status = {}
+    for name in ("pages_shared", "pages_sharing"):
+        try:
+            status[name.replace("pages", "ksm") + "_mb"] = round(int((KSM / name).read_text()) * page_mb, 1)
+        except (OSError, ValueError):
+            pass
+    return status
+
+
+def qemu_footprint(pid: int) -> Optional[dict]:
+    """
+    What one QEMU really costs the host, from smaps_rollup: rss counts shared pages in full,
+    pss splits them between the processes that map them, private is what only this VM uses.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {k: int(v.split()[0]) for k, v in (line.split(":", 1) for line in f.readlines()[1:])}
+    except (OSError, ValueError):
+        return None
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    return {"rss_mb": round(fields.get("Rss", 0) / 1024, 1), "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+            "private_mb": round(private / 1024, 1), "shared_mb": round(shared / 1024, 1)}
+
+
+class MemoryTemplate:
+    """
+    RAM and device state of a VM saved right after its guest agent answered, with the disk it booted on.
+    VMs restore from it instead of booting: they map ram.bin copy-on-write (share=off), so every page
+    they never write stays one page in the host page cache for all of them, and load only the small
+    device state, which x-ignore-shared keeps free of RAM.
+    """
+
+    def __init__(self, base_image: Path, memory_mb: int, directory: Path = DEFAULT_TEMPLATE_DIR,
+                 boot: str = "firmware") -> None:
+        self.base_image = Path(base_image)
+        self.memory_mb = memory_mb
+        self.boot = boot
+        self.dir = Path(directory)
+        self.ram = self.dir / "ram.bin"
+        self.state = self.dir / "state.bin"
+        self.disk = self.dir / "disk.qcow2"
+        self.manifest = self.dir / "template.json"
+
+    def key(self) -> str:
+        """Changes whenever the base image, the RAM size or the boot mode changes, any of them makes a template unusable."""
+        stat = self.base_image.stat()
+        with open(self.base_image, "rb") as f:
+            header = hashlib.sha256(f.read(1024 * 1024)).hexdigest()
+        return hashlib.sha256(f"{header}:{stat.st_size}:{stat.st_mtime_ns}:{self.memory_mb}:{self.boot}".encode()).hexdigest()
+
+    def ready(self) -> bool:
+        try:
+            manifest = json.loads(self.manifest.read_text())
+            return manifest.get("key") == self.key() and all(p.exists() for p in (self.ram, self.state, self.disk))
+        except (OSError, ValueError):
+            return False
+
+    def lock(self):
+        """Exclusive lock while a template is built, so concurrent graders build it only once."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        f = open(self.dir / ".lock", "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def discard(self):
+        for p in (self.ram, self.state, self.disk, self.manifest):
+            p.unlink(missing_ok=True)
+
+    def commit(self, **info):
+        self.manifest.write_text(json.dumps({"key": self.key(), "memory_mb": self.memory_mb, "boot": self.boot, **info}))
+
+    def backend(self, share: bool) -> list:
+        """QEMU arguments backing guest RAM with ram.bin, shared to build the template, private to use it."""
+        return ["-object", f"memory-backend-file,id=ram0,size={self.memory_mb}M,mem-path={self.ram},"
+                           f"share={'on' if share else 'off'},merge=on",
+                "-machine", "memory-backend=ram0,mem-merge=on"]
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Reproducible preparation of the Mininet guest image.
+
+    python3 prepare_image.py --source mininet-vm-x86_64.vmdk --output mininet-vm-x86_64.qcow2
+
+1. converts the source image (VMDK or qcow2) to a fresh qcow2 with the chosen cluster size
+   and preallocation, skipping zeroed blocks
+2. sparsifies it (virt-sparsify when available, the conversion already drops zero clusters)
+3. customizes the guest: installs qemu-guest-agent and the grader's guest helpers,
+   disables boot services grading never uses, drops the GRUB timeout and has bgpd load
+   its BMP module, so the grader can stream the routers' routes to the host (bmp.py)
+4. extracts the guest kernel and initrd to <output>.kernel/ for the direct kernel boot
+   (BGPH_BOOT_MODE=kernel), which skips firmware and GRUB and starts only bgph-fast.target
+5. boots the result to measure the time until the guest agent answers, both ways
+6. writes <output>.manifest.json, which BGPHVirtualMachine.start_vm() checks
+
+    python3 prepare_image.py --extract-kernel --output mininet-vm-x86_64.qcow2
+
+only repeats step 4 for an image that is already prepared.
+"""
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Optional
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import debuglog
+
+TOOL_VERSION = 4
+SCRIPT_DIR = Path(__file__).parent
+GUEST_HELPER_DIR = "/usr/local/lib/bgph"
+GUEST_HELPERS = ["scripts/probe.py", "scripts/webserver.py"]
+GUEST_UNIT_DIR = "/etc/systemd/system"
+GUEST_UNITS = ["scripts/bgph-fast.target", "scripts/autograder-submission.mount"]
+FAST_TARGET = "bgph-fast.target"
+BGPD = "/usr/lib/frr/bgpd"
+BGPD_BMP_MODULE = "/usr/lib/frr/modules/bgpd_bmp.so"
+BGPD_DIVERTED = "/usr/lib/frr/bmp/bgpd"  # keeps the name bgpd, so pgrep -x and pkill still find the daemon
+
+# services that only slow down the boot or compete for CPU while grading
+DISABLED_SERVICES = [
+    "apt-daily.timer",
+    "apt-daily-upgrade.timer",
+    "unattended-upgrades.service",
+    "motd-news.timer",
+    "man-db.timer",
+    "fstrim.timer",
+    "e2scrub_all.timer",
+    "snapd.service",
+    "snapd.socket",
+    "snapd.seeded.service",
+    "cloud-init.service",
+    "cloud-init-local.service",
+    "cloud-config.service",
+    "cloud-final.service",
+    "lxd.socket",
+    "ModemManager.service",
+    "multipathd.service",
+    "apport.service",
+    "systemd-networkd-wait-online.service",
+    "NetworkManager-wait-online.service",
+]
+
+
+def run(cmd, **kwargs):
+    print(f"    $ {' '.join(str(c) for c in cmd)}")
+    return subprocess.run([str(c) for c in cmd], check=True, **kwargs)
+
+
+def sha256_file(path: Path, limit: int = None) -> str:
+    h = hashlib.sha256()
+    remaining = limit
+    with open(path, "rb") as f:
+        while True:
+            size = 4 * 1024 * 1024 if remaining is None else min(4 * 1024 * 1024, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            h.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+    return h.hexdigest()
+
+
+def detect_format(path: Path) -> str:
+    out = run(["qemu-img", "info", "--output=json", path], capture_output=True).stdout
+    return json.loads(out)["format"]
+
+
+def convert(source: Path, output: Path, cluster_size: str, preallocation: str):
+    print(f"\n==> convert()")
+    fmt = detect_format(source)
+    options = f"cluster_size={cluster_size},preallocation={preallocation},lazy_refcounts=on"
+    # -S 4k turns runs of zeroes into unallocated clusters, so the conversion already sparsifies
+    run(["qemu-img", "convert", "-p", "-f", fmt, "-O", "qcow2", "-o", options, "-S", "4k", source, output])
+
+
+def sparsify(image: Path) -> bool:
+    print(f"\n==> sparsify()")
+    if not shutil.which("virt-sparsify"):
+        print("    virt-sparsify not found, relying on the zero detection of the conversion")
+        return False
+    run(["virt-sparsify", "--in-place", image])
+    return True
+
+
+def guest_commands():
+    cmds = [f"systemctl disable {svc} || true" for svc in DISABLED_SERVICES]
+    cmds += [
+        "systemctl mask systemd-networkd-wait-online.service || true",
+        "systemctl enable qemu-guest-agent || true",
+        "sed -i 's/^GRUB_TIMEOUT=.*/GRUB_TIMEOUT=0/' /etc/default/grub && (update-grub || true)",
+        # bgp.py starts bgpd itself, not through watchfrr and /etc/frr/daemons, so the module has to
+        # come from the binary it runs. A module without `bmp targets` configured does nothing.
+        # TOOL_VERSION 3 diverted it to bgpd.real, which renamed the process, put that binary back first
+        f"if [ -e {BGPD}.real ]; then rm -f {BGPD} && dpkg-divert --local --rename --remove {BGPD}; fi",
+        f"if [ -e {BGPD_BMP_MODULE} ] && [ ! -e {BGPD_DIVERTED} ]; then mkdir -p {Path(BGPD_DIVERTED).parent} && "
+        f"dpkg-divert --local --rename --divert {BGPD_DIVERTED} --add {BGPD} && "
+        f"printf '#!/bin/sh\\nexec {BGPD_DIVERTED} -M bmp \"$@\"\\n' > {BGPD} && chmod 755 {BGPD}; fi",
+    ]
+    return cmds
+
+
+def customize_offline(image: Path) -> bool:
+    """Customize with libguestfs without booting the guest, returns False if virt-customize is not installed."""
+    print(f"\n==> customize_offline()")
+    if not shutil.which("virt-customize"):
+        return False
+    cmd = ["virt-customize", "-a", image, "--install", "qemu-guest-agent", "--mkdir", GUEST_HELPER_DIR]
+    for helper in GUEST_HELPERS:
+        cmd += ["--copy-in", f"{SCRIPT_DIR / helper}:{GUEST_HELPER_DIR}"]
+    for unit in GUEST_UNITS:
+        cmd += ["--copy-in", f"{SCRIPT_DIR / unit}:{GUEST_UNIT_DIR}"]
+    for guest_cmd in guest_commands():
+        cmd += ["--run-command", guest_cmd]
+    run(cmd)
+    return True
+
+
+def customize_online(image: Path):
+    """Customize by booting the image itself, which needs qemu-guest-agent to already be in the image."""
+    print(f"\n==> customize_online()")
+    from bgph_vm import BGPHVirtualMachine
+
+    vm = BGPHVirtualMachine(transports=("guest-agent",))
+    vm.base_image = image
+    vm.use_overlay = False  # the changes have to land in the image
+    vm.host_share_dir = Path(tempfile.mkdtemp(prefix="bgph-share-"))
+    if not vm.start_vm():
+        raise RuntimeError("could not boot the image to customize it")
+
+    vm.exec(f"sudo mkdir -p {GUEST_HELPER_DIR}")
+    for helper in GUEST_HELPERS:
+        result = vm.write_file(SCRIPT_DIR / helper, f"{GUEST_HELPER_DIR}/{Path(helper).name}")
+        if not result.success:
+            raise RuntimeError(result.message)
+    for unit in GUEST_UNITS:
+        result = vm.write_file(SCRIPT_DIR / unit, f"{GUEST_UNIT_DIR}/{Path(unit).name}")
+        if not result.success:
+            raise RuntimeError(result.message)
+    for guest_cmd in guest_commands():
+        vm.exec(f"sudo sh -c {shlex.quote(guest_cmd)}", timeout=300)
+
+    vm.exec("sync")
+    vm.shutdown(graceful=True, timeout=180)
+
+
+def kernel_dir(image: Path) -> Path:
+    return image.with_name(image.name + ".kernel")
+
+
+def root_from_fstab(fstab: str) -> str:
+    for line in fstab.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and not fields[0].startswith("#") and fields[1] == "/":
+            return fields[0]
+    raise RuntimeError("no root file system in /etc/fstab")
+
+
+def extract_kernel_offline(image: Path, out: Path) -> Optional[dict]:
+    """Kernel and initrd with libguestfs, None if it is not installed."""
+    if not shutil.which("virt-get-kernel"):
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        run(["virt-get-kernel", "--ro", "-a", image, "-o", tmp])
+        kernels = sorted(Path(tmp).glob("vmlinuz-*"))
+        if not kernels:
+            raise RuntimeError("virt-get-kernel found no kernel")
+        release = kernels[-1].name[len("vmlinuz-"):]
+        shutil.move(str(kernels[-1]), out / "vmlinuz")
+        shutil.move(str(Path(tmp) / f"initrd.img-{release}"), out / "initrd.img")
+    fstab = run(["virt-cat", "--ro", "-a", image, "/etc/fstab"], capture_output=True, text=True).stdout
+    units = run(["virt-ls", "--ro", "-a", image, GUEST_UNIT_DIR], capture_output=True, text=True).stdout.split()
+    return {"release": release, "root": root_from_fstab(fstab), "fast_target": FAST_TARGET in units}
+
+
+def extract_kernel_online(image: Path, out: Path) -> dict:
+    """Kernel and initrd copied out of the booted image, the one running is the one GRUB picks."""
+    from bgph_vm import BGPHVirtualMachine
+
+    vm = BGPHVirtualMachine(transports=("guest-agent",))
+    vm.base_image = image
+    vm.overlay_image = image.with_name(image.name + ".kernel-overlay")
+    vm.host_share_dir = Path(tempfile.mkdtemp(prefix="bgph-share-"))
+    try:
+        if not vm.start_vm():
+            raise RuntimeError("could not boot the image to extract its kernel")
+        release = vm.exec("uname -r")[1].strip()
+        fstab = vm.exec("cat /etc/fstab")[1]
+        fast_target = vm.exec(f"test -e {GUEST_UNIT_DIR}/{FAST_TARGET}")[0] == 0
+        for guest, host in ((f"/boot/vmlinuz-{release}", "vmlinuz"), (f"/boot/initrd.img-{release}", "initrd.img")):
+            result = vm.read_file(guest, out / host)
+            if not result.success:
+                raise RuntimeError(result.message)
+    finally:
+        vm.cancel_boot()
+    return {"release": release, "root": root_from_fstab(fstab), "fast_target": fast_target}
+
+
+def extract_kernel(image: Path) -> dict:
+    """
+    Write the guest's kernel and initrd to <image>.kernel/ with kernel.json, which holds the kernel
+    command line and the image header it belongs to. The command line starts bgph-fast.target when
+    the image has it, a plain default boot otherwise.
+    """
+    print(f"\n==> extract_kernel()")
+    out = kernel_dir(image)
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir()
+    info = extract_kernel_offline(image, out) or extract_kernel_online(image, out)
+    append = f"root={info['root']} ro quiet"
+    if info["fast_target"]:
+        append += f" systemd.unit={FAST_TARGET}"
+    info.update(append=append, header_sha256=sha256_file(image, limit=1024 * 1024))
+    (out / "kernel.json").write_text(json.dumps(info, indent=2) + "\n")
+    print(f"    kernel {info['release']}, {append}")
+    return info
+
+
+def measure_boot(image: Path, boot_mode: str = "firmware") -> dict:
+    """Boot the image once on a throwaway overlay and time it until the guest agent answers."""
+    print(f"\n==> measure_boot({boot_mode})")
+    from bgph_vm import BGPHVirtualMachine
+
+    vm = BGPHVirtualMachine(transports=("guest-agent",), boot_mode=boot_mode)
+    vm.base_image = image
+    vm.overlay_image = image.with_name(image.name + ".measure-overlay")
+    vm.host_share_dir = Path(tempfile.mkdtemp(prefix="bgph-share-"))
+    try:
+        # start_vm() falls back to the firmware boot, which would only be measured twice
+        if not vm.start_vm() or (boot_mode == "kernel" and not vm.kernel_args):
+            raise RuntimeError(f"the prepared image did not boot ({boot_mode})")
+        key = "boot_seconds" if boot_mode == "firmware" else f"{boot_mode}_boot_seconds"
+        return {key: round(vm.time_to_agent, 1), "accel": "kvm" if Path("/dev/kvm").exists() else "tcg"}
+    finally:
+        vm.cancel_boot()
+
+
+def main():
+    parser = ArgumentParser("Prepare an optimized Mininet guest image")
+    parser.add_argument("--source", type=Path, help="VMDK or qcow2 image to start from")
+    parser.add_argument("--output", required=True, type=Path, help="qcow2 image to write")
+    parser.add_argument("--cluster-size", default="64k", help="qcow2 cluster size (default 64k)")
+    parser.add_argument("--preallocation", default="metadata", choices=["off", "metadata", "falloc", "full"])
+    parser.add_argument("--skip-customize", action="store_true", help="only convert and sparsify")
+    parser.add_argument("--skip-measure", action="store_true", help="don't boot the result to measure it")
+    parser.add_argument("--extract-kernel", action="store_true",
+                        help="only extract the kernel of the already prepared --output image, and time its boot")
+    args = parser.parse_args()
+    debuglog.setup()
+    if args.extract_kernel:
+        update_kernel(args.output.resolve(), measure=not args.skip_measure)
+        return
+    if args.source is None:
+        parser.error("--source is required")
+    args.source = args.source.resolve()
+    args.output = args.output.resolve()  # overlays refer to the image by path
+
+    started = time.time()
+    tmp = args.output.with_name(args.output.name + ".tmp")
+    convert(args.source, tmp, args.cluster_size, args.preallocation)
+    sparsified = sparsify(tmp)
+
+    customized = "none"
+    if not args.skip_customize:
+        if customize_offline(tmp):
+            customized = "virt-customize"
+        else:
+            customize_online(tmp)
+            customized = "guest-agent"
+
+    tmp.rename(args.output)
+    try:
+        kernel = extract_kernel(args.output)
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"    could not extract the kernel ({e}), the image only boots through firmware")
+        kernel = None
+
+    manifest = {
+        "tool_version": TOOL_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source": args.source.name,
+        "source_sha256": sha256_file(args.source),
+        "image": args.output.name,
+        "sha256": sha256_file(args.output),
+        "header_sha256": sha256_file(args.output, limit=1024 * 1024),
+        "size": args.output.stat().st_size,
+        "cluster_size": args.cluster_size,
+        "preallocation": args.preallocation,
+        "sparsified": "virt-sparsify" if sparsified else "zero-detect",
+        "customized": customized,
+        "guest_helper_dir": GUEST_HELPER_DIR if customized != "none" else None,
+        "guest_helpers": [Path(h).name for h in GUEST_HELPERS] if customized != "none" else [],
+        "disabled_services": DISABLED_SERVICES if customized != "none" else [],
+        "kernel": kernel["release"] if kernel else None,
+        "kernel_append": kernel["append"] if kernel else None,
+        "boot_seconds": None,
+        "kernel_boot_seconds": None,
+        "accel": None,
+    }
+    if not args.skip_measure:
+        manifest.update(measure_boot(args.output))
+        if kernel:
+            manifest.update(measure_boot(args.output, "kernel"))
+            print(f"    time to agent: {manifest['boot_seconds']}s through firmware and GRUB, "
+                  f"{manifest['kernel_boot_seconds']}s with the direct kernel boot")
+
+    manifest_path = args.output.with_name(args.output.name + ".manifest.json")
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n")
+    print(f"\n==> wrote {manifest_path} in {time.time() - started:.0f}s\n{json.dumps(manifest, indent=2)}")
+
+
+def update_kernel(image: Path, measure: bool = True):
+    """extract_kernel() for an image prepared earlier, and add the result to its manifest."""
+    manifest_path = image.with_name(image.name + ".manifest.json")
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    kernel = extract_kernel(image)
+    manifest.update(kernel=kernel["release"], kernel_append=kernel["append"])
+    if measure:
+        manifest.update(measure_boot(image, "kernel"))
+        print(f"    time to agent: {manifest.get('boot_seconds')}s through firmware and GRUB, "
+              f"{manifest['kernel_boot_seconds']}s with the direct kernel boot")
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
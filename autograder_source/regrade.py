@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Re-score a recorded grading run with the current grader, without a VM.
+
+    BGPH_CASSETTE=/autograder/results/artifacts/cassette.jsonl.gz python3 bgph_grader.py   # record
+    python3 regrade.py cassette.jsonl.gz --submission <submission-dir> --out regraded/
+
+The cassette supplies every guest response, the anti-cheating secret and the random seed of the
+recorded run, so rubric changes in BGPHGrader apply to exactly what the guest answered back then.
+A rubric that needs a guest command the recorded run never issued gets a failed response for it,
+and the mismatch report printed at the end lists every such command.
+
+The grader runs on a temporary copy of the submission, since it copies its scripts into the folder,
+and writes results.json and its artifacts under --out. It uses the settings recorded in the cassette,
+or for an older cassette the ones the BGPH_* variables give bgph_grader.py.
+"""
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from bgph_vm import BGPHVirtualMachine
+from bgph_grader import BGPHGrader, grader_options
+from cassette import Cassette
+from results import Result
+import debuglog
+
+
+def main():
+    parser = ArgumentParser("Regrade a recorded run from its cassette")
+    parser.add_argument("cassette", type=Path)
+    parser.add_argument("--submission", type=Path, default=Path("/autograder/submission/BGPHijacking"),
+                        help="host copy of the submission the run graded, for the report and sanity checks")
+    parser.add_argument("--out", type=Path, default=Path("regraded"),
+                        help="folder for results.json and the artifacts of the regrade")
+    args = parser.parse_args()
+
+    debuglog.setup()
+    cassette = Cassette.load(args.cassette)
+    vm = BGPHVirtualMachine.replay(cassette)
+    grader = BGPHGrader(vm, **(cassette.meta.get("grader") or grader_options()))
+    grader.artifacts_path = args.out / "artifacts"
+    with tempfile.TemporaryDirectory(prefix="bgph-regrade-") as tmp:
+        grader.submission_path = Path(tmp) / args.submission.name
+        shutil.copytree(args.submission, grader.submission_path, symlinks=True)
+        grader.grade()
+
+    result = Result()
+    grader.generate_results(result)
+    result.write_json(args.out / "results.json")
+    for test in result.tests:
+        print(f"{test.name:<40} {test.score:>4}/{test.max_score}")
+    print(vm.transport.mismatch_report())
+
+
+if __name__ == "__main__":
+    main()
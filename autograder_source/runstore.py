@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Performance history of grading runs, one compact record per run in a local SQLite file.
+
+    python3 runstore.py --db runs.sqlite percentiles [--version V] [--profile P]
+    python3 runstore.py --db runs.sqlite slowest [--phase NAME] [--limit 10]
+    python3 runstore.py --db runs.sqlite regressions <base-version> <head-version> [--ratio 1.2]
+    python3 runstore.py --db runs.sqlite timeouts [--version V]
+
+A run is its phase durations (one row per grading DAG node, with its status, budget and whether it ran
+out of it) and its samples (probe latencies, convergence times per host, time to agent), tagged with the
+submission, grader version, host profile and outcome. Aggregates are computed inside SQLite with window
+functions, a single set-based pass over the history instead of a Python loop per row.
+"""
+import os
+import json
+import sqlite3
+from pathlib import Path
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DB = Path(os.environ.get("BGPH_RUNSTORE", Path.home() / ".cache" / "bgph" / "runs.sqlite"))
+PERCENTILES = (50, 95, 99)
+
+# the same linear interpolation between closest ranks as timeouts.percentile(), for every key at once
+PERCENTILE_SQL = """
+    WITH src (key, value) AS ({source}),
+    ranked AS (
+        SELECT key, value,
+               ROW_NUMBER() OVER w - 1 AS i,
+               COUNT(*) OVER (PARTITION BY key) AS n,
+               LEAD(value) OVER w AS next_value
+        FROM src WINDOW w AS (PARTITION BY key ORDER BY value)
+    ),
+    pct (p) AS (VALUES {percentiles})
+    SELECT key, n, p, value + (COALESCE(next_value, value) - value) * ((n - 1) * p / 100.0 - i)
+    FROM ranked JOIN pct ON i = CAST((n - 1) * p / 100.0 AS INTEGER)
+    ORDER BY key, p
+"""
+
+
+@dataclass
+class RunRecord:
+    submission: str
+    grader_version: str
+    profile: str
+    outcome: str  # passed, failed or vm-failed
+    score: float
+    max_score: float
+    started: float
+    finished: float
+    restarts: int = 0
+    phases: List[Tuple[str, str, float, Optional[float], bool]] = field(default_factory=list)  # name, status, seconds, budget, timed out
+    samples: List[Tuple[str, float]] = field(default_factory=list)  # metric, value
+
+
+class RunStore:
+    """Append-only history of RunRecords."""
+
+    def __init__(self, path: Path = DEFAULT_DB) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), timeout=30)  # several graders may share one store
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                submission TEXT NOT NULL,
+                grader_version TEXT NOT NULL,
+                profile TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                score REAL NOT NULL,
+                max_score REAL NOT NULL,
+                started REAL NOT NULL,
+                finished REAL NOT NULL,
+                restarts INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS phases (
+                run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+                phase TEXT NOT NULL,
+                status TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                budget REAL,
+                timed_out INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS samples (
+                run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+                metric TEXT NOT NULL,
+                value REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS runs_version ON runs (grader_version, profile);
+            CREATE INDEX IF NOT EXISTS phases_run ON phases (run);
+            CREATE INDEX IF NOT EXISTS samples_run ON samples (run);
+        """)
+
+    def append(self, record: RunRecord) -> int:
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO runs (submission, grader_version, profile, outcome, score, max_score, started, finished, "
+                "restarts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.submission, record.grader_version, record.profile, record.outcome, record.score,
+                 record.max_score, record.started, record.finished, record.restarts))
+            run = cur.lastrowid
+            self.db.executemany("INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?)",
+                                [(run, name, status, round(seconds, 3), budget, int(timed_out))
+                                 for name, status, seconds, budget, timed_out in record.phases])
+            self.db.executemany("INSERT INTO samples VALUES (?, ?, ?)",
+                                [(run, metric, round(value, 4)) for metric, value in record.samples])
+        return run
+
+    @staticmethod
+    def _filter(version: Optional[str], profile: Optional[str]) -> Tuple[str, list]:
+        clauses, args = [], []
+        if version:
+            clauses.append("r.grader_version = ?")
+            args.append(version)
+        if profile:
+            clauses.append("r.profile = ?")
+            args.append(profile)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def percentiles(self, version: Optional[str] = None, profile: Optional[str] = None,
+                    percentiles=PERCENTILES) -> Dict[str, dict]:
+        """{key: {"n": count, "p50": ..., ...}} for every phase that passed and every sample metric."""
+        where, args = self._filter(version, profile)
+        source = (f"SELECT 'phase.' || x.phase, x.seconds FROM phases x JOIN runs r ON r.id = x.run{where}"
+                  f"{' AND' if where else ' WHERE'} x.status = 'passed' "
+                  f"UNION ALL SELECT x.metric, x.value FROM samples x JOIN runs r ON r.id = x.run{where}")
+        sql = PERCENTILE_SQL.format(source=source, percentiles=", ".join(f"({int(p)})" for p in percentiles))
+        table: Dict[str, dict] = {}
+        for key, n, p, value in self.db.execute(sql, args + args):
+            table.setdefault(key, {"n": n})[f"p{p}"] = round(value, 3)
+        return table
+
+    def slowest(self, phase: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """Slowest runs overall, or slowest executions of one phase."""
+        if phase:
+            rows = self.db.execute(
+                "SELECT r.submission, r.grader_version, r.profile, x.seconds, x.status FROM phases x "
+                "JOIN runs r ON r.id = x.run WHERE x.phase = ? ORDER BY x.seconds DESC LIMIT ?", (phase, limit))
+        else:
+            rows = self.db.execute(
+                "SELECT submission, grader_version, profile, finished - started, outcome FROM runs "
+                "ORDER BY finished - started DESC LIMIT ?", (limit,))
+        return [{"submission": s, "version": v, "profile": p, "seconds": round(t, 1), "status": st}
+                for s, v, p, t, st in rows]
+
+    def regressions(self, base: str, head: str, ratio: float = 1.2, profile: Optional[str] = None) -> List[dict]:
+        """Keys whose p50 or p95 grew by more than `ratio` from grader version `base` to `head`."""
+        before = self.percentiles(base, profile)
+        after = self.percentiles(head, profile)
+        found = []
+        for key in sorted(before.keys() & after.keys()):
+            for p in ("p50", "p95"):
+                old, new = before[key][p], after[key][p]
+                if old > 0 and new / old > ratio:
+                    found.append({"key": key, "percentile": p, base: old, head: new, "ratio": round(new / old, 2),
+                                  "runs": [before[key]["n"], after[key]["n"]]})
+        return found
+
+    def timeouts(self, version: Optional[str] = None, profile: Optional[str] = None) -> List[dict]:
+        """How often each phase ran out of its budget."""
+        where, args = self._filter(version, profile)
+        rows = self.db.execute(
+            f"SELECT x.phase, COUNT(*), SUM(x.timed_out), AVG(x.timed_out) FROM phases x JOIN runs r ON r.id = x.run"
+            f"{where} GROUP BY x.phase ORDER BY AVG(x.timed_out) DESC, x.phase", args)
+        return [{"phase": phase, "runs": n, "timeouts": hits, "rate": round(rate, 4)} for phase, n, hits, rate in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = ArgumentParser("Performance history of grading runs")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB)
+    sub = parser.add_subparsers(dest="mode")
+    p = sub.add_parser("percentiles")
+    p.add_argument("--version")
+    p.add_argument("--profile")
+    p = sub.add_parser("slowest")
+    p.add_argument("--phase")
+    p.add_argument("--limit", type=int, default=10)
+    p = sub.add_parser("regressions")
+    p.add_argument("base")
+    p.add_argument("head")
+    p.add_argument("--ratio", type=float, default=1.2)
+    p.add_argument("--profile")
+    p = sub.add_parser("timeouts")
+    p.add_argument("--version")
+    p.add_argument("--profile")
+    args = parser.parse_args()
+
+    store = RunStore(args.db)
+    if args.mode == "percentiles":
+        rows = [{"key": k, **v} for k, v in store.percentiles(args.version, args.profile).items()]
+    elif args.mode == "slowest":
+        rows = store.slowest(args.phase, args.limit)
+    elif args.mode == "regressions":
+        rows = store.regressions(args.base, args.head, args.ratio, args.profile)
+    elif args.mode == "timeouts":
+        rows = store.timeouts(args.version, args.profile)
+    else:
+        parser.print_help()
+        return
+    for row in rows:
+        print(json.dumps(row))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
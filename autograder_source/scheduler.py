@@ -0,0 +1,183 @@
+import time
+import traceback
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Tuple
+from results import Test
+
+
+@dataclass
+class TestNode:
+    """
+    One step of the grading DAG.
+    run: returns True if nodes that require this one may run
+    requires: names of the nodes that must pass first
+    vm_state: VM state the node needs before it can run, None for host-only nodes
+    next_vm_state: VM state the node leaves behind when it passes
+    budget: wall-clock seconds the node may take before its dependents are skipped
+    test: the Test that receives the feedback if this node is skipped
+    """
+    name: str
+    run: Callable[[], bool]
+    requires: Tuple[str, ...] = ()
+    vm_state: Optional[str] = None
+    next_vm_state: Optional[str] = None
+    budget: Optional[float] = None
+    test: Optional[Test] = None
+    status: str = "pending"  # pending, running, passed, failed, skipped
+    message: str = ""
+    started: float = 0.0
+    elapsed: float = 0.0
+    timed_out: bool = False
+
+
+class TestScheduler:
+    """
+    Run a DAG of TestNodes. Host-only nodes run concurrently with each other and with the VM nodes,
+    VM nodes run one at a time because they all share the same topology.
+    As soon as a node fails, everything that depends on it is skipped with an explanation. A node that runs
+    over its budget fails and its test is closed, the next VM node still waits until its thread returned.
+    If a VM node fails while vm_healthy() says the VM is gone, recover_vm(state) may bring a new VM
+    to the state the node needs, and the node runs again, at most max_recoveries times per run.
+    """
+
+    def __init__(self, nodes: List[TestNode], vm_state: str = "", max_workers: int = 4,
+                 vm_healthy: Optional[Callable[[], bool]] = None,
+                 recover_vm: Optional[Callable[[str], bool]] = None, max_recoveries: int = 1) -> None:
+        self.nodes: Dict[str, TestNode] = {node.name: node for node in nodes}
+        self.vm_state = vm_state
+        self.max_workers = max_workers
+        self.vm_healthy = vm_healthy
+        self.recover_vm = recover_vm
+        self.max_recoveries = max_recoveries
+        self.recoveries = 0
+        for node in nodes:
+            for req in node.requires:
+                if req not in self.nodes:
+                    raise ValueError(f"Node {node.name} requires unknown node {req}")
+
+    def _skip(self, node: TestNode, reason: str):
+        print(f"    [skip] {node.name}: {reason}")
+        node.status = "skipped"
+        node.message = reason
+        if node.test is not None:
+            node.test.set_passed(False)
+            node.test.add_feedback(f"Skipped: {reason}")
+
+    def _finish(self, node: TestNode, passed: bool, message: str = ""):
+        node.elapsed = time.time() - node.started
+        node.status = "passed" if passed else "failed"
+        node.message = message
+        print(f"    [{node.status}] {node.name} ({node.elapsed:.1f}s) {message}")
+        if passed and node.next_vm_state is not None:
+            self.vm_state = node.next_vm_state
+
+    def _recover(self, node: TestNode) -> bool:
+        """Try to replace a dead VM so the failed node can run again, returns True if it will."""
+        if node.vm_state is None or self.recover_vm is None or self.vm_healthy is None:
+            return False
+        if self.vm_healthy() or self.recoveries >= self.max_recoveries:
+            return False
+        self.recoveries += 1
+        print(f"    [recover] {node.name}: the VM died, restarting it in state '{node.vm_state}'")
+        if not self.recover_vm(node.vm_state):
+            return False
+        self.vm_state = node.vm_state
+        node.status = "pending"
+        if node.test is not None:
+            node.test.add_feedback("The grading VM crashed during this step, it was restarted and the step ran again")
+        return True
+
+    def _call(self, node: TestNode):
+        try:
+            return bool(node.run()), ""
+        except Exception as e:
+            traceback.print_exc()
+            return False, f"raised {type(e).__name__}: {e}"
+
+    def _ready(self, node: TestNode) -> bool:
+        """Returns True if all prerequisites passed, skips the node if any of them did not."""
+        for req in node.requires:
+            status = self.nodes[req].status
+            if status in ("failed", "skipped"):
+                self._skip(node, f"prerequisite '{req}' did not pass ({self.nodes[req].message or status})")
+                return False
+            if status != "passed":
+                return False
+        return True
+
+    def run(self) -> Dict[str, TestNode]:
+        print(f"==> TestScheduler.run()")
+        running = {}  # future -> node
+        vm_busy = None  # future of the VM node that is still executing (even if it ran over budget)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                # start everything that is ready, in declaration order
+                progress = True
+                while progress:
+                    progress = False
+                    for node in self.nodes.values():
+                        if node.status != "pending":
+                            continue
+                        if not self._ready(node):
+                            progress = progress or node.status == "skipped"
+                            continue
+                        if node.vm_state is not None:
+                            if vm_busy is not None:
+                                continue
+                            if node.vm_state != self.vm_state:
+                                self._skip(node, f"VM is in state '{self.vm_state}', needs '{node.vm_state}'")
+                                progress = True
+                                continue
+                        node.status = "running"
+                        node.started = time.time()
+                        future = pool.submit(self._call, node)
+                        running[future] = node
+                        if node.vm_state is not None:
+                            vm_busy = future
+                        progress = True
+
+                if not running:
+                    break
+
+                # wake up on the first completion or the first budget expiry
+                deadlines = [n.started + n.budget for n in running.values() if n.budget and n.status == "running"]
+                timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    node = running.pop(future)
+                    if future is vm_busy:
+                        vm_busy = None
+                    if node.status != "running":
+                        continue  # already failed for running over budget
+                    passed, message = future.result()
+                    if not passed and self._recover(node):
+                        continue
+                    self._finish(node, passed, message)
+
+                now = time.time()
+                for node in running.values():
+                    if node.status == "running" and node.budget and now >= node.started + node.budget:
+                        self._finish(node, False, f"exceeded its {node.budget:.0f}s budget")
+                        node.timed_out = True
+                        if node.test is not None:
+                            node.test.set_passed(False)
+                            node.test.set_score(0)  # whatever it granted so far was for a step that never finished
+                            node.test.add_feedback(f"Stopped waiting after {node.budget:.0f}s, this step took too long")
+                            # the node's thread cannot be stopped, what it still writes must not change the result
+                            node.test.close()
+
+        # anything still pending could never become ready
+        for node in self.nodes.values():
+            if node.status == "pending":
+                self._skip(node, "prerequisites never completed")
+
+        return self.nodes
+
+    def summary(self) -> str:
+        lines = [f"{'node':<24} {'status':<8} {'elapsed':>8}"]
+        for node in self.nodes.values():
+            lines.append(f"{node.name:<24} {node.status:<8} {node.elapsed:>7.1f}s {node.message}")
+        return "\n".join(lines)
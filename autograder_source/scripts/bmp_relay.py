@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Grader-owned helper, copied into the submission folder before the topology starts.
+#
+#   bmp_relay.py --routers R1,R2,R3,R4,R5 --port 11019 --collector 192.168.101.2:40123
+#       opens a listener on 127.0.0.1:<port> inside each router's network namespace, where its bgpd
+#       connects with `bmp connect`, and forwards every session to the grader's BMP collector on the
+#       host through the QEMU user network, after one line naming the router. Runs in the root
+#       namespace as root, a socket keeps the namespace it was created in after setns() switches back.
+
+import os
+import re
+import sys
+import ctypes
+import socket
+import subprocess
+import threading
+from argparse import ArgumentParser
+
+CLONE_NEWNET = 0x40000000
+node_pat = re.compile(r'\s*(\d+) .*bash .* mininet:(\S+)')
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def list_nodes():
+    """Mapping from Mininet node name to pid, same approach as run.py"""
+    out = subprocess.run(["ps", "-eo", "pid,args"], stdout=subprocess.PIPE).stdout.decode("utf-8", "replace")
+    ret = {}
+    for line in out.split('\n'):
+        match = node_pat.match(line)
+        if match:
+            ret[match.group(2)] = int(match.group(1))
+    return ret
+
+
+def setns(fd):
+    if libc.setns(fd, CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def listen_in(pid, port):
+    """A listening socket on 127.0.0.1:port inside the network namespace of `pid`."""
+    home = os.open("/proc/self/ns/net", os.O_RDONLY)
+    target = os.open("/proc/%d/ns/net" % pid, os.O_RDONLY)
+    try:
+        setns(target)
+        try:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(("127.0.0.1", port))
+            server.listen(4)
+            return server
+        finally:
+            setns(home)
+    finally:
+        os.close(target)
+        os.close(home)
+
+
+def pump(src, dst):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (src, dst):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def relay(router, server, collector):
+    while True:
+        conn, _ = server.accept()
+        try:
+            upstream = socket.create_connection(collector, timeout=5)
+            upstream.settimeout(None)
+            upstream.sendall(("%s\n" % router).encode())
+        except OSError as e:
+            print("%s: collector unreachable: %s" % (router, e), file=sys.stderr)
+            conn.close()  # bgpd retries the session
+            continue
+        threading.Thread(target=pump, args=(conn, upstream), daemon=True).start()
+        threading.Thread(target=pump, args=(upstream, conn), daemon=True).start()
+
+
+def main():
+    parser = ArgumentParser("Forward the routers' BMP sessions to the host")
+    parser.add_argument("--routers", required=True)
+    parser.add_argument("--port", type=int, default=11019)
+    parser.add_argument("--collector", required=True, help="host:port of the collector, as the guest sees it")
+    args = parser.parse_args()
+    host, port = args.collector.rsplit(":", 1)
+    nodes = list_nodes()
+    threads = []
+    for router in args.routers.split(","):
+        if router not in nodes:
+            print("%s: no such Mininet node" % router, file=sys.stderr)
+            continue
+        server = listen_in(nodes[router], args.port)
+        t = threading.Thread(target=relay, args=(router, server, (host, int(port))), daemon=True)
+        t.start()
+        threads.append(t)
+    print("relaying %d routers" % len(threads), flush=True)
+    for t in threads:
+        t.join()
+
+
+if __name__ == '__main__':
+    main()
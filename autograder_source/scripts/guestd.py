@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Grader-owned guest daemon, pushed into the guest and started once by BGPHVirtualMachine.start_vm().
+#
+#   guestd.py --port /dev/virtio-ports/org.bgph.guestd.0
+#
+# Reads one JSON request per line from the virtio-serial port and writes one JSON reply per line
+# as soon as that request finishes, so several requests can be in flight and none is polled for.
+#
+#   {"id": 1, "op": "ping"}
+#   {"id": 2, "op": "exec", "cmd": "ls /tmp", "node": "h1-1", "timeout": 10}   node is optional
+#   {"id": 3, "op": "http", "node": "h5-1", "address": "11.0.1.1", "timeout": 5}
+#   {"id": 4, "op": "read", "path": "/tmp/x"}  /  {"id": 5, "op": "write", "path": "/tmp/x", "data": "<base64>"}
+#
+# Every Mininet node gets one worker thread that entered the node's network namespace with setns()
+# once, requests for that node run on it: HTTP probes natively, commands as children that inherit
+# the namespace. Runs as root, so there is no sudo, ps or mnexec per request.
+
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import ctypes
+import threading
+import subprocess
+import http.client
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+CLONE_NEWNET = 0x40000000
+MAX_OUTPUT = 4 * 1024 * 1024
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def setns(fd, nstype):
+    if libc.setns(fd, nstype) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def scan_nodes():
+    """Mapping from Mininet node name to the pid of its shell, read straight from /proc."""
+    nodes = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/%s/cmdline" % pid, "rb") as f:
+                args = f.read().split(b"\0")
+        except OSError:
+            continue
+        if not args or not args[0].endswith(b"bash"):
+            continue
+        for arg in args:
+            if arg.startswith(b"mininet:"):
+                nodes[arg[len(b"mininet:"):].decode()] = int(pid)
+    return nodes
+
+
+def run_command(cmd, timeout):
+    started = time.time()
+    try:
+        proc = subprocess.run(["/bin/bash", "-c", cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              timeout=timeout)
+        rc, out, err = proc.returncode, proc.stdout, proc.stderr
+    except subprocess.TimeoutExpired as e:
+        rc, out, err = -1, e.stdout or b"", (e.stderr or b"") + b"\nCommand timed out after %ds" % timeout
+    return {"rc": rc, "out": out[-MAX_OUTPUT:].decode("utf-8", "replace"),
+            "err": err[-MAX_OUTPUT:].decode("utf-8", "replace"), "elapsed": round(time.time() - started, 4)}
+
+
+def http_probe(address, timeout):
+    started = time.time()
+    conn = http.client.HTTPConnection(address, 80, timeout=timeout)
+    try:
+        conn.request("GET", "/")
+        body = conn.getresponse().read().decode("utf-8", "replace")
+        rc = 0
+    except (OSError, http.client.HTTPException) as e:
+        body, rc = str(e), 1
+    finally:
+        conn.close()
+    return {"rc": rc, "out": body if rc == 0 else "", "err": "" if rc == 0 else body,
+            "elapsed": round(time.time() - started, 4)}
+
+
+class NodeWorker:
+    """A thread living in one node's network namespace, serving that node's requests in order."""
+
+    def __init__(self, name, pid, reply):
+        self.name = name
+        self.pid = pid
+        self.reply = reply
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="node-%s" % name, daemon=True)
+        self.thread.start()
+
+    def alive(self):
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def run(self):
+        try:
+            fd = os.open("/proc/%d/ns/net" % self.pid, os.O_RDONLY)
+            try:
+                setns(fd, CLONE_NEWNET)  # affects this thread only, and the children it forks
+            finally:
+                os.close(fd)
+        except OSError as e:
+            failure = "cannot enter namespace of %s: %s" % (self.name, e)
+            while True:
+                req = self.requests.get()
+                if req is None:
+                    return
+                self.reply(req, {"rc": -1, "out": "", "err": failure})
+        while True:
+            req = self.requests.get()
+            if req is None:
+                return
+            if req["op"] == "http":
+                result = http_probe(req.get("address", "11.0.1.1"), req.get("timeout", 5))
+            else:
+                result = run_command(req["cmd"], req.get("timeout", 60))
+            self.reply(req, result)
+
+
+class Daemon:
+    def __init__(self, port):
+        self.port = port
+        self.out_lock = threading.Lock()
+        self.nodes = {}  # name -> NodeWorker
+        self.nodes_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=16)
+
+    def reply(self, req, result):
+        result["id"] = req.get("id")
+        line = (json.dumps(result, separators=(",", ":")) + "\n").encode()
+        with self.out_lock:
+            view = memoryview(line)
+            while view:
+                try:
+                    written = os.write(self.out_fd, view)
+                except BlockingIOError:
+                    time.sleep(0.01)
+                    continue
+                view = view[written:]
+
+    def worker(self, name):
+        with self.nodes_lock:
+            worker = self.nodes.get(name)
+            if worker is not None and worker.alive():
+                return worker
+            pid = scan_nodes().get(name)  # the topology was (re)started since we last looked
+            if pid is None:
+                return None
+            if worker is not None:
+                worker.requests.put(None)
+            worker = self.nodes[name] = NodeWorker(name, pid, self.reply)
+            return worker
+
+    def handle(self, req):
+        op = req.get("op")
+        if op == "ping":
+            self.reply(req, {"rc": 0, "out": "pong", "err": ""})
+        elif op in ("exec", "http") and req.get("node"):
+            worker = self.worker(req["node"])
+            if worker is None:
+                self.reply(req, {"rc": -1, "out": "", "err": "node `%s' not found" % req["node"]})
+            else:
+                worker.requests.put(req)
+        elif op == "exec":
+            self.pool.submit(lambda: self.reply(req, run_command(req["cmd"], req.get("timeout", 60))))
+        elif op == "read":
+            try:
+                with open(req["path"], "rb") as f:
+                    self.reply(req, {"rc": 0, "out": "", "err": "", "data": base64.b64encode(f.read()).decode()})
+            except OSError as e:
+                self.reply(req, {"rc": -1, "out": "", "err": str(e)})
+        elif op == "write":
+            try:
+                with open(req["path"], "wb") as f:
+                    f.write(base64.b64decode(req["data"]))
+                self.reply(req, {"rc": 0, "out": "", "err": ""})
+            except (OSError, ValueError) as e:
+                self.reply(req, {"rc": -1, "out": "", "err": str(e)})
+        else:
+            self.reply(req, {"rc": -1, "out": "", "err": "unknown op %r" % op})
+
+    def serve(self):
+        fd = os.open(self.port, os.O_RDWR)
+        self.out_fd = fd
+        buf = b""
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                time.sleep(0.1)  # the host side is not connected
+                continue
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                try:
+                    req = json.loads(line)
+                except ValueError:
+                    continue
+                try:
+                    self.handle(req)
+                except Exception as e:
+                    self.reply(req, {"rc": -1, "out": "", "err": "guestd: %r" % e})
+
+
+def main():
+    parser = ArgumentParser("Grader command daemon")
+    parser.add_argument("--port", default="/dev/virtio-ports/org.bgph.guestd.0")
+    args = parser.parse_args()
+    Daemon(args.port).serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Grader-owned helper, copied into the submission folder before the topology starts.
+#
+#   hot_restart.py signature
+#       builds SimpleTopo from the submission's bgp.py without starting Mininet and prints
+#       the nodes, links and host addressing plus a sha256 over them as JSON
+#   hot_restart.py restart --routers R1,R2,R3,R4,R5
+#       keeps the running Mininet namespaces and links, only restarts zebra/bgpd with the
+#       submission's conf/ files and the web servers, the same way bgp.py starts them
+
+import os
+import re
+import sys
+import json
+import hashlib
+import subprocess
+from argparse import ArgumentParser
+
+node_pat = re.compile('.*bash .* mininet:(.*)')
+webserver_pat = re.compile(r"start_webserver\(\s*net\s*,\s*['\"]([\w-]+)['\"]\s*,\s*['\"](.*?)['\"]\s*\)")
+DEFAULT_WEBSERVERS = [("h1-1", "Default web server 2.1.1"), ("h6-1", "*** Attacker web server 2.1.1***")]
+
+
+def list_nodes():
+    """Mapping from Mininet node name to pid, same approach as run.py"""
+    out = subprocess.run(["ps", "aux"], stdout=subprocess.PIPE).stdout.decode("utf-8", "replace")
+    ret = {}
+    for line in out.split('\n'):
+        match = node_pat.match(line)
+        if match:
+            ret[match.group(1)] = line.split()[1]
+    return ret
+
+
+def signature(args):
+    # bgp.py parses its arguments at import time, main() only runs as a script
+    sys.argv = ["bgp.py"]
+    sys.path.insert(0, os.getcwd())
+    import bgp
+
+    topo = bgp.SimpleTopo()
+    hosts = sorted(topo.hosts())
+    topology = {
+        "switches": sorted(topo.switches()),
+        "hosts": hosts,
+        "links": sorted(sorted(link) for link in topo.links()),
+        "addresses": {h: [bgp.get_ip(h), bgp.get_gateway(h)] for h in hosts},
+    }
+    canonical = json.dumps(topology, sort_keys=True, separators=(",", ":"))
+    topology["sha256"] = hashlib.sha256(canonical.encode()).hexdigest()
+    json.dump(topology, sys.stdout, separators=(",", ":"))
+
+
+def webservers():
+    try:
+        with open("bgp.py") as f:
+            found = webserver_pat.findall(f.read())
+    except OSError:
+        found = []
+    return found or DEFAULT_WEBSERVERS
+
+
+def in_node(pid, shell_cmd):
+    return subprocess.run(["mnexec", "-a", pid, "sh", "-c", shell_cmd]).returncode
+
+
+def restart(args):
+    nodes = list_nodes()
+    # same cleanup as bgp.py and cleanup.py, except for `mn -c`
+    os.system("pkill -9 bgpd > /dev/null 2>&1")
+    os.system("pkill -9 zebra > /dev/null 2>&1")
+    os.system("pkill -9 -f webserver.py > /dev/null 2>&1")
+    os.system("rm -f /tmp/R*.log /tmp/*-R*.pid logs/*")
+
+    result = {"routers": {}, "webservers": {}}
+    for router in filter(None, args.routers.split(",")):
+        pid = nodes.get(router)
+        if pid is None:
+            result["routers"][router] = "missing"
+            continue
+        rc = in_node(pid, "ip link set dev lo up; "
+                          f"/usr/lib/frr/zebra -f conf/zebra-{router}.conf -d -i /tmp/zebra-{router}.pid "
+                          f"> logs/{router}-zebra-stdout 2>&1 && "
+                          f"/usr/lib/frr/bgpd -f conf/bgpd-{router}.conf -d -i /tmp/bgp-{router}.pid "
+                          f"> logs/{router}-bgpd-stdout 2>&1")
+        result["routers"][router] = "started" if rc == 0 else f"failed ({rc})"
+
+    for host, text in webservers():
+        pid = nodes.get(host)
+        if pid is None:
+            result["webservers"][host] = "missing"
+            continue
+        text = text.replace("'", "")
+        rc = in_node(pid, f"nohup {sys.executable} webserver.py --text '{text}' > /dev/null 2>&1 &")
+        result["webservers"][host] = "started" if rc == 0 else f"failed ({rc})"
+
+    json.dump(result, sys.stdout, separators=(",", ":"))
+    if any(state != "started" for kind in result.values() for state in kind.values()):
+        sys.exit(1)
+
+
+def main():
+    parser = ArgumentParser("Reuse a running Mininet topology for a new submission")
+    sub = parser.add_subparsers(dest="mode")
+    sub.add_parser("signature")
+    p = sub.add_parser("restart")
+    p.add_argument("--routers", default="R1,R2,R3,R4,R5")
+
+    args = parser.parse_args()
+    if args.mode == "signature":
+        signature(args)
+    elif args.mode == "restart":
+        restart(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
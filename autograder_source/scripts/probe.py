@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# Grader-owned helper, copied into the submission folder before the topology starts.
+#
+#   probe.py timeline --hosts h1-1,h2-1 --out /tmp/timeline.json
+#       probe the website from every host in parallel at a high rate and write a
+#       run-length encoded timeline of Default (D) / Attacker (A) / unreachable (X) / other (?) states,
+#       --ready-file is written once every host's worker answered
+#   probe.py worker --address 11.0.1.1
+#       runs inside one host's namespace (started through mnexec), prints one JSON line per probe
+#   probe.py snapshot --hosts h1-1,h2-1 --routers R1,R2
+#       one pass over all the given nodes in parallel: curl the website from every host and dump
+#       `show ip bgp` from every router, prints a single JSON object
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import subprocess
+import http.client
+from argparse import ArgumentParser
+
+node_pat = re.compile('.*bash .* mininet:(.*)')
+
+
+def list_nodes():
+    """Mapping from Mininet node name to pid, same approach as run.py"""
+    out = subprocess.run(["ps", "aux"], stdout=subprocess.PIPE).stdout.decode("utf-8", "replace")
+    ret = {}
+    for line in out.split('\n'):
+        match = node_pat.match(line)
+        if match:
+            ret[match.group(1)] = line.split()[1]
+    return ret
+
+
+def classify(body):
+    if body is None:
+        return "X"
+    if "Attacker" in body:
+        return "A"
+    if "Default" in body:
+        return "D"
+    return "?"
+
+
+## Worker, runs inside a host namespace
+
+def fetch(host, port, path, timeout):
+    """(body, serving node, server time) of one request, body None if it failed."""
+    # a fresh connection per probe, a kept-alive one would stick to the old server after the route moves
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        body = response.read().decode("utf-8", "replace")
+        try:
+            served = float(response.getheader("X-Server-Time"))
+        except (TypeError, ValueError):
+            served = None
+        return body, response.getheader("X-Node"), served
+    except (OSError, http.client.HTTPException):
+        return None, None, None
+    finally:
+        conn.close()
+
+
+def worker(args):
+    last = None
+    deadline = time.time() + args.duration
+    while time.time() < deadline:
+        started = time.time()
+        body, node, served = fetch(args.address, 80, "/", args.timeout)
+        state = classify(body)
+        # when the server answered is when the traffic was there, the request may have left before the route moved
+        sample = {"t": round(served or started, 3), "s": state}
+        if state != last:
+            sample["body"] = (body or "").strip()
+            sample["node"] = node
+            last = state
+        try:
+            sys.stdout.write(json.dumps(sample) + "\n")
+            sys.stdout.flush()
+        except BrokenPipeError:
+            return
+        time.sleep(max(0.0, args.interval - (time.time() - started)))
+
+
+## Snapshot, one parallel pass over hosts and routers
+
+def run_in_node(pid, cmd, timeout):
+    """Output of cmd run in the node's namespaces, None if it failed or timed out."""
+    try:
+        proc = subprocess.run(["mnexec", "-a", pid] + cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    return proc.stdout.decode("utf-8", "replace") if proc.returncode == 0 else None
+
+
+def snapshot(args):
+    nodes = list_nodes()
+    jobs = {}
+    for host in filter(None, args.hosts.split(",")):
+        jobs[("hosts", host)] = ["curl", "-s", "-m", str(args.timeout), args.address]
+    for router in filter(None, args.routers.split(",")):
+        jobs[("routers", router)] = ["vtysh", "-c", "show ip bgp"]
+
+    result = {"hosts": {}, "routers": {}, "missing": []}
+    lock = threading.Lock()
+
+    def job(kind, name, cmd):
+        pid = nodes.get(name)
+        output = run_in_node(pid, cmd, args.timeout + 5) if pid else None
+        with lock:
+            result[kind][name] = output
+            if pid is None:
+                result["missing"].append(name)
+
+    threads = [threading.Thread(target=job, args=(kind, name, cmd), daemon=True)
+               for (kind, name), cmd in jobs.items()]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    json.dump(result, sys.stdout, separators=(",", ":"))
+
+
+## Orchestrator, runs in the root namespace
+
+class HostRecorder:
+    def __init__(self, host):
+        self.host = host
+        self.runs = []  # [start time, state, samples, last sample time]
+        self.bodies = {}  # state -> last body seen in that state
+        self.nodes = {}  # state -> node that served it, from the X-Node header
+        self.proc = None
+
+    def add(self, sample):
+        state = sample["s"]
+        if "body" in sample:
+            self.bodies[state] = sample["body"]
+        if sample.get("node"):
+            self.nodes[state] = sample["node"]
+        if self.runs and self.runs[-1][1] == state:
+            self.runs[-1][2] += 1
+            self.runs[-1][3] = sample["t"]
+        else:
+            self.runs.append([sample["t"], state, 1, sample["t"]])
+
+    def stable_for(self, now, since):
+        """How long the host has held its state, counting from `since` at the earliest."""
+        return now - max(self.runs[-1][0], since) if self.runs else 0.0
+
+
+def read_samples(rec, lock):
+    for line in rec.proc.stdout:
+        try:
+            sample = json.loads(line)
+        except ValueError:
+            continue
+        with lock:
+            rec.add(sample)
+
+
+def read_time(path):
+    try:
+        with open(path) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def timeline(args):
+    nodes = list_nodes()
+    hosts = [h for h in args.hosts.split(",") if h]
+    recorders = {h: HostRecorder(h) for h in hosts}
+    lock = threading.Lock()
+    t0 = time.time()
+    me = os.path.abspath(__file__)
+
+    for host, rec in recorders.items():
+        pid = nodes.get(host)
+        if pid is None:
+            continue
+        cmd = ["mnexec", "-a", pid, sys.executable, me, "worker", "--address", args.address,
+               "--interval", str(args.interval), "--timeout", str(args.timeout), "--duration", str(args.max_duration)]
+        rec.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+        threading.Thread(target=read_samples, args=(rec, lock), daemon=True).start()
+
+    # the grader starts the action once this file exists, every host answered once by then
+    # (or its worker died), so the timeline covers the event
+    if args.ready_file:
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            with lock:
+                if all(rec.runs or rec.proc.poll() is not None for rec in recorders.values() if rec.proc):
+                    break
+            time.sleep(0.05)
+        with open(args.ready_file, "w") as f:
+            f.write("%f\n" % time.time())
+
+    # stop early once the action returned, --min-duration passed since, and every host has held
+    # the same state for --stable seconds since then. Without an event file the recording starts
+    # the clock, with one that never completes only --max-duration ends it.
+    event = done = None
+    while time.time() - t0 < args.max_duration:
+        time.sleep(0.25)
+        if args.event_file:
+            event = event or read_time(args.event_file)
+            done = done or read_time(args.event_file + ".done")
+            if done is None:
+                continue
+        since = done or t0
+        now = time.time()
+        if now - since < args.min_duration:
+            continue
+        with lock:
+            if all(rec.stable_for(now, since) >= args.stable for rec in recorders.values() if rec.proc):
+                break
+
+    for rec in recorders.values():
+        if rec.proc and rec.proc.poll() is None:
+            rec.proc.terminate()
+    for rec in recorders.values():
+        if rec.proc:
+            try:
+                rec.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                rec.proc.kill()
+
+    if args.event_file and event is None:
+        event = read_time(args.event_file)
+
+    result = {
+        "t0": t0,
+        "end": time.time(),
+        "event": event,
+        "interval": args.interval,
+        "stable": args.stable,
+        "hosts": {},
+    }
+    with lock:
+        for host, rec in recorders.items():
+            result["hosts"][host] = {
+                "found": rec.proc is not None,
+                # times relative to t0 keep the file small: [start, state, samples, end]
+                "runs": [[round(r[0] - t0, 3), r[1], r[2], round(r[3] - t0, 3)] for r in rec.runs],
+                "bodies": rec.bodies,
+                "nodes": rec.nodes,
+            }
+
+    tmp = args.out + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(result, f, separators=(",", ":"))
+    os.rename(tmp, args.out)  # the grader waits for the file to appear
+
+
+def main():
+    parser = ArgumentParser("Probe the website from Mininet hosts")
+    sub = parser.add_subparsers(dest="mode")
+
+    p = sub.add_parser("timeline")
+    p.add_argument("--hosts", required=True)
+    p.add_argument("--out", required=True)
+    p.add_argument("--address", default="11.0.1.1")
+    p.add_argument("--interval", type=float, default=0.2)
+    p.add_argument("--timeout", type=float, default=0.5)
+    p.add_argument("--stable", type=float, default=5.0)
+    p.add_argument("--min-duration", type=float, default=5.0)
+    p.add_argument("--max-duration", type=float, default=60.0)
+    p.add_argument("--event-file", default=None)
+    p.add_argument("--ready-file", default=None)
+
+    p = sub.add_parser("worker")
+    p.add_argument("--address", default="11.0.1.1")
+    p.add_argument("--interval", type=float, default=0.2)
+    p.add_argument("--timeout", type=float, default=0.5)
+    p.add_argument("--duration", type=float, default=60.0)
+
+    p = sub.add_parser("snapshot")
+    p.add_argument("--hosts", default="")
+    p.add_argument("--routers", default="")
+    p.add_argument("--address", default="11.0.1.1")
+    p.add_argument("--timeout", type=float, default=10.0)
+
+    args = parser.parse_args()
+    if args.mode == "timeline":
+        timeline(args)
+    elif args.mode == "snapshot":
+        snapshot(args)
+    elif args.mode == "worker":
+        worker(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
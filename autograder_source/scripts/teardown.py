@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Grader-owned helper, copied into the submission folder before the topology starts.
+#
+#   px import teardown; teardown.record(net, "/tmp/bgph-topology.json")
+#       from the Mininet CLI (bgp_sleep): writes down what this topology created,
+#       node shells, their network namespaces, root-namespace interfaces, OVS bridges, the FRR
+#       pid files and every process living in a node namespace (zebra, bgpd, web servers)
+#   teardown.py teardown --record /tmp/bgph-topology.json
+#       removes exactly what the record names, in parallel, and checks that it is gone.
+#       Exits 2 if there is no record and 3 if it does not match what is running, the caller
+#       then falls back to cleanup.py (`mn -c`). Exits 1 if something could not be removed.
+
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import subprocess
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+
+def start_time(pid):
+    """Process start time in clock ticks, tells a recorded process from a later one with the same pid."""
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def netns(pid):
+    try:
+        return os.stat("/proc/%d/ns/net" % pid).st_ino
+    except OSError:
+        return None
+
+
+def processes_in(namespaces):
+    """pid -> start time of every process whose network namespace is one of `namespaces`."""
+    found = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit() and netns(int(entry)) in namespaces:
+            started = start_time(int(entry))
+            if started is not None:
+                found[int(entry)] = started
+    return found
+
+
+def mininet_shells():
+    shells = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/cmdline" % entry, "rb") as f:
+                args = f.read().split(b"\0")
+        except OSError:
+            continue
+        if args and args[0].endswith(b"bash") and any(a.startswith(b"mininet:") for a in args):
+            shells[int(entry)] = start_time(int(entry))
+    return shells
+
+
+def record(net, path):
+    nodes, interfaces, bridges = {}, [], []
+    root_ns = netns(os.getpid())
+    for node in net.hosts + net.switches + net.controllers:
+        pid = getattr(node, "pid", None)
+        if pid is None:
+            continue
+        ns = netns(pid)
+        nodes[node.name] = {"pid": pid, "started": start_time(pid), "netns": ns}
+        if ns == root_ns:
+            # links of nodes in the root namespace do not disappear with a namespace
+            interfaces.extend(intf.name for intf in node.intfList() if intf.name != "lo")
+        if "OVS" in type(node).__name__:
+            bridges.append(node.name)
+    namespaces = set(n["netns"] for n in nodes.values()) - set([root_ns, None])
+    rec = {
+        "created": time.time(),
+        "mininet": {"pid": os.getpid(), "started": start_time(os.getpid())},
+        "nodes": nodes,
+        "interfaces": sorted(set(interfaces)),
+        "bridges": bridges,
+        "pidfiles": sorted(glob.glob("/tmp/zebra-*.pid") + glob.glob("/tmp/bgp*-*.pid")),
+        "processes": dict((str(pid), started) for pid, started in processes_in(namespaces).items()),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(rec, f)
+    os.replace(tmp, path)
+
+
+def run(cmd):
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+def link_exists(name):
+    return os.path.exists("/sys/class/net/%s" % name)
+
+
+def bridge_exists(name):
+    return run(["ovs-vsctl", "br-exists", name]) == 0
+
+
+def teardown(args):
+    started = time.time()
+    try:
+        with open(args.record) as f:
+            rec = json.load(f)
+    except (OSError, ValueError) as e:
+        print(json.dumps({"error": "no record: %s" % e}))
+        sys.exit(2)
+
+    # a recorded node pid that now belongs to another process, or node shells nobody recorded,
+    # mean the record does not describe what is running
+    recorded_shells = dict((n["pid"], n["started"]) for n in rec["nodes"].values())
+    for pid, started in recorded_shells.items():
+        now = start_time(pid)
+        if now is not None and now != started:
+            print(json.dumps({"error": "pid %d was reused" % pid}))
+            sys.exit(3)
+    unknown = [pid for pid in mininet_shells() if pid not in recorded_shells]
+    if unknown:
+        print(json.dumps({"error": "unrecorded Mininet nodes %s" % unknown}))
+        sys.exit(3)
+
+    # everything recorded that is still the same process, plus whatever started in a node namespace since
+    namespaces = set(n["netns"] for n in rec["nodes"].values() if n["netns"]) - set([netns(os.getpid())])
+    victims = dict((int(pid), started) for pid, started in rec["processes"].items())
+    victims.update(recorded_shells)
+    victims[rec["mininet"]["pid"]] = rec["mininet"]["started"]
+    for path in rec["pidfiles"]:
+        try:
+            with open(path) as f:
+                pid = int(f.read().strip())
+            victims[pid] = start_time(pid)
+        except (OSError, ValueError):
+            pass
+    victims.update(processes_in(namespaces))
+    victims = dict((pid, s) for pid, s in victims.items() if s is not None and start_time(pid) == s and pid != os.getpid())
+
+    for pid in victims:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    links = [name for name in rec["interfaces"] if link_exists(name)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        # deleting one end of a veth pair removes the other end too, so failures here are expected
+        list(pool.map(lambda name: run(["ip", "link", "del", name]), links))
+        list(pool.map(lambda name: run(["ovs-vsctl", "--if-exists", "del-br", name]), rec["bridges"]))
+    for path in rec["pidfiles"] + glob.glob("/tmp/R*.log") + glob.glob("logs/*"):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    deadline = time.time() + args.wait
+    while True:
+        left = ["pid %d" % pid for pid, s in victims.items() if start_time(pid) == s]
+        left += ["link %s" % name for name in rec["interfaces"] if link_exists(name)]
+        left += ["namespace process %d" % pid for pid in processes_in(namespaces)]
+        if not left or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    left += ["bridge %s" % name for name in rec["bridges"] if bridge_exists(name)]
+
+    print(json.dumps({"killed": len(victims), "links": len(links), "bridges": len(rec["bridges"]),
+                      "left": left, "seconds": round(time.time() - started, 2)}))
+    if left:
+        sys.exit(1)
+    os.unlink(args.record)
+
+
+def main():
+    parser = ArgumentParser("Remove exactly what a recorded Mininet topology created")
+    sub = parser.add_subparsers(dest="mode")
+    p = sub.add_parser("teardown")
+    p.add_argument("--record", default="/tmp/bgph-topology.json")
+    p.add_argument("--wait", type=float, default=5.0)
+    args = parser.parse_args()
+    if args.mode == "teardown":
+        teardown(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
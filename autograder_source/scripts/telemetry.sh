@@ -0,0 +1,21 @@
+#!/bin/bash
+# Grader-owned helper, copied into the submission folder before the topology starts.
+#
+#   telemetry.sh <out-file> <interval-seconds>
+#       appends one line per interval until killed:
+#       time load1 mem_total_kb mem_available_kb netns bgpd zebra net_rx_softirqs net_tx_softirqs
+
+out=${1:-/tmp/bgph-telemetry.txt}
+interval=${2:-5}
+
+while true; do
+    t=$(date +%s.%N)
+    read -r load1 _ < /proc/loadavg
+    mem=$(awk '/^MemTotal:/ {t=$2} /^MemAvailable:/ {a=$2} END {print t, a}' /proc/meminfo)
+    netns=$(readlink /proc/[0-9]*/ns/net 2>/dev/null | sort -u | wc -l)
+    bgpd=$(pgrep -c -x bgpd)
+    zebra=$(pgrep -c -x zebra)
+    softirq=$(awk '/NET_RX:|NET_TX:/ {s=0; for (i = 2; i <= NF; i++) s += $i; printf "%d ", s}' /proc/softirqs)
+    echo "$t $load1 $mem $netns $bgpd $zebra $softirq" >> "$out"
+    sleep "$interval"
+done
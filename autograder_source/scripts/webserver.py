@@ -4,29 +4,80 @@
 # All rights reserved
 # Do not post or publish in any public or forbidden forums or websites
 
+import os
+import time
 import http.server
 import socketserver
 import argparse
+import threading
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--text', default="Default web server")
+parser.add_argument('--node', default=None, help="Name of the Mininet node serving this page (detected if omitted)")
 FLAGS = parser.parse_args()
 
 with open("/tmp/anti_cheating_secret5566.txt", "r") as f:
     anti_cheating_secret = f.read().strip()
 
-class Handler(http.server.SimpleHTTPRequestHandler):
+
+def detect_node_name():
+    # Mininet names the interfaces of a node <node>-eth<N>, and we only see our own namespace
+    try:
+        for intf in sorted(os.listdir("/sys/class/net")):
+            if "-eth" in intf:
+                return intf.rsplit("-eth", 1)[0]
+    except OSError:
+        pass
+    return "unknown"
+
+
+NODE = FLAGS.node or detect_node_name()
+BODY = "<h1>{} (anti-hardcode secret: {})</h1>\n".format(FLAGS.text, anti_cheating_secret).encode('UTF-8')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, every reply carries a Content-Length
+    protocol_version = "HTTP/1.1"
+    requests = 0
+    requests_lock = threading.Lock()
+
     # Disable logging DNS lookups
     def address_string(self):
         return str(self.client_address[0])
 
-    def do_GET(self):
+    # Don't write a log line per request, probes hit this at a high rate
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, with_body):
+        # probe.py times the move between servers by these, the body stays exactly as before
+        with Handler.requests_lock:
+            Handler.requests += 1
+            number = Handler.requests
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.send_header("X-Node", NODE)
+        self.send_header("X-Request", str(number))
+        self.send_header("X-Server-Time", "{:.6f}".format(time.time()))
         self.end_headers()
-        self.wfile.write("<h1>{} (anti-hardcode secret: {})</h1>\n".format(FLAGS.text, anti_cheating_secret).encode('UTF-8'))
+        if with_body:
+            self.wfile.write(BODY)
         self.wfile.flush()
 
+    def do_GET(self):
+        self._reply(True)
+
+    def do_HEAD(self):
+        self._reply(False)
+
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
 PORT = 80
-httpd = socketserver.TCPServer(("", PORT), Handler)
+httpd = ThreadedHTTPServer(("", PORT), Handler)
 httpd.serve_forever()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for the students' bgpd configurations across a whole cohort.
+
+    python3 similarity.py --db cohort.sqlite add <submission-id> <submission-dir>
+    python3 similarity.py --db cohort.sqlite query <submission-dir>
+    python3 similarity.py --db cohort.sqlite pairs
+
+Configs are normalized (comments, hostnames, passwords, log settings and whitespace dropped,
+neighbor statements grouped per neighbor and sorted), turned into token shingles and summarized
+by a MinHash signature. Locality sensitive hashing over bands of the signature finds candidate
+pairs without comparing every pair, and the index is a SQLite file that grows one submission at a time.
+"""
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from array import array
+from pathlib import Path
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: pairs above ~0.7 Jaccard almost always share a bucket
+ROWS = NUM_PERM // BANDS
+SHINGLE = 5
+MERSENNE = (1 << 61) - 1
+DEFAULT_PATTERNS = ("conf/bgpd-*.conf",)  # zebra configs only carry the handout's interface addressing
+
+IGNORED_LINE = re.compile(r"^\s*(!|#)|^\s*(hostname|password|enable password|log\s)")
+NEIGHBOR_LINE = re.compile(r"^neighbor\s+(\S+)\s+(.*)$")
+
+
+def _permutations():
+    """NUM_PERM (a, b) pairs for a*x + b mod p, derived from a fixed seed so signatures are stable everywhere."""
+    perms = []
+    for i in range(NUM_PERM):
+        digest = hashlib.sha256(f"bgph-minhash-{i}".encode()).digest()
+        a = int.from_bytes(digest[:8], "big") % (MERSENNE - 1) + 1
+        b = int.from_bytes(digest[8:16], "big") % MERSENNE
+        perms.append((a, b))
+    return perms
+
+
+PERMUTATIONS = _permutations()
+
+
+def normalize(text: str) -> List[str]:
+    """Canonical lines of a zebra/bgpd config, formatting and ordering choices don't survive this."""
+    lines, neighbors = [], {}
+    for raw in text.splitlines():
+        if IGNORED_LINE.match(raw):
+            continue
+        line = " ".join(raw.split()).lower()
+        if not line:
+            continue
+        match = NEIGHBOR_LINE.match(line)
+        if match:
+            neighbors.setdefault(match.group(1), []).append(match.group(2))
+            continue
+        lines.append(line)
+    # neighbor blocks may be written in any order, per neighbor or per attribute
+    for address in sorted(neighbors):
+        lines.extend(f"neighbor {address} {attr}" for attr in sorted(neighbors[address]))
+    return lines
+
+
+def shingles(lines: List[str]) -> set:
+    tokens = " ".join(lines).split()
+    if len(tokens) < SHINGLE:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + SHINGLE]) for i in range(len(tokens) - SHINGLE + 1)}
+
+
+def minhash(items: Iterable[str]) -> array:
+    signature = array("Q", [MERSENNE] * NUM_PERM)
+    for item in items:
+        x = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        for i, (a, b) in enumerate(PERMUTATIONS):
+            h = (a * x + b) % MERSENNE
+            if h < signature[i]:
+                signature[i] = h
+    return signature
+
+
+def band_keys(signature: array) -> List[int]:
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        # SQLite integers are signed 64 bit, keep 63 bits
+        keys.append(int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "big") >> 1)
+    return keys
+
+
+def estimate(sig_a: array, sig_b: array) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+@dataclass
+class Match:
+    submission: str
+    name: str
+    other_submission: str
+    other_name: str
+    similarity: float
+    identical: bool
+
+
+class SimilarityIndex:
+    """Persistent MinHash/LSH index of configuration files, keyed by (submission, file name)."""
+
+    def __init__(self, path: Path, threshold: float = 0.8) -> None:
+        self.path = Path(path)
+        self.threshold = threshold
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                submission TEXT NOT NULL,
+                name TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                added REAL NOT NULL,
+                UNIQUE (submission, name)
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                key INTEGER NOT NULL,
+                doc INTEGER NOT NULL REFERENCES docs(id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, key);
+            CREATE INDEX IF NOT EXISTS buckets_doc ON buckets (doc);
+        """)
+        self.db.execute("PRAGMA foreign_keys = ON")
+
+    @staticmethod
+    def _signature(text: str):
+        lines = normalize(text)
+        canonical = "\n".join(lines)
+        return hashlib.sha256(canonical.encode()).hexdigest(), minhash(shingles(lines))
+
+    @staticmethod
+    def _files(folder: Path, patterns=DEFAULT_PATTERNS) -> Dict[str, str]:
+        files = {}
+        for pattern in patterns:
+            for fn in sorted(Path(folder).glob(pattern)):
+                files[fn.name] = fn.read_text(errors="replace")
+        return files
+
+    def _candidates(self, keys: List[int], signature: array, sha256: str, exclude: Optional[str]):
+        seen = {}
+        for band, key in enumerate(keys):
+            rows = self.db.execute(
+                "SELECT d.id, d.submission, d.name, d.sha256, d.signature FROM buckets b JOIN docs d ON d.id = b.doc "
+                "WHERE b.band = ? AND b.key = ?", (band, key))
+            for doc_id, submission, name, other_sha, blob in rows:
+                if submission == exclude or doc_id in seen:
+                    continue
+                other = array("Q")
+                other.frombytes(blob)
+                seen[doc_id] = (submission, name, estimate(signature, other), other_sha == sha256)
+        return [v for v in seen.values() if v[2] >= self.threshold or v[3]]
+
+    def query(self, folder: Path, submission: Optional[str] = None) -> List[Match]:
+        """Near copies of the folder's configs among the indexed submissions other than `submission`."""
+        matches = []
+        for name, text in self._files(folder).items():
+            sha256, signature = self._signature(text)
+            for other_sub, other_name, similarity, identical in self._candidates(
+                    band_keys(signature), signature, sha256, submission):
+                matches.append(Match(submission or "", name, other_sub, other_name, round(similarity, 3), identical))
+        matches.sort(key=lambda m: -m.similarity)
+        return matches
+
+    def add(self, submission: str, folder: Path) -> List[Match]:
+        """Index (or re-index) one submission, returns its matches against what was indexed before."""
+        matches = self.query(folder, submission)
+        with self.db:
+            self.db.execute("DELETE FROM docs WHERE submission = ?", (submission,))
+            for name, text in self._files(folder).items():
+                sha256, signature = self._signature(text)
+                cur = self.db.execute(
+                    "INSERT INTO docs (submission, name, sha256, signature, added) VALUES (?, ?, ?, ?, ?)",
+                    (submission, name, sha256, signature.tobytes(), time.time()))
+                self.db.executemany("INSERT INTO buckets (band, key, doc) VALUES (?, ?, ?)",
+                                    [(band, key, cur.lastrowid) for band, key in enumerate(band_keys(signature))])
+        return matches
+
+    def pairs(self) -> List[Match]:
+        """Every near-duplicate pair in the index, found through shared buckets only."""
+        found = {}
+        rows = self.db.execute(
+            "SELECT a.doc, b.doc FROM buckets a JOIN buckets b ON a.band = b.band AND a.key = b.key AND a.doc < b.doc")
+        docs = {}
+        for doc_a, doc_b in rows:
+            if (doc_a, doc_b) in found:
+                continue
+            for doc in (doc_a, doc_b):
+                if doc not in docs:
+                    sub, name, sha, blob = self.db.execute(
+                        "SELECT submission, name, sha256, signature FROM docs WHERE id = ?", (doc,)).fetchone()
+                    sig = array("Q")
+                    sig.frombytes(blob)
+                    docs[doc] = (sub, name, sha, sig)
+            a, b = docs[doc_a], docs[doc_b]
+            if a[0] == b[0]:
+                continue
+            similarity = estimate(a[3], b[3])
+            if similarity >= self.threshold or a[2] == b[2]:
+                found[(doc_a, doc_b)] = Match(a[0], a[1], b[0], b[1], round(similarity, 3), a[2] == b[2])
+        return sorted(found.values(), key=lambda m: -m.similarity)
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = ArgumentParser("Cohort-wide similarity index of BGP router configurations")
+    parser.add_argument("--db", required=True, type=Path)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    sub = parser.add_subparsers(dest="mode")
+    p = sub.add_parser("add")
+    p.add_argument("submission")
+    p.add_argument("folder", type=Path)
+    p = sub.add_parser("query")
+    p.add_argument("folder", type=Path)
+    sub.add_parser("pairs")
+    args = parser.parse_args()
+
+    index = SimilarityIndex(args.db, args.threshold)
+    if args.mode == "add":
+        matches = index.add(args.submission, args.folder)
+    elif args.mode == "query":
+        matches = index.query(args.folder)
+    elif args.mode == "pairs":
+        matches = index.pairs()
+    else:
+        parser.print_help()
+        return
+    for m in matches:
+        print(json.dumps(m.__dict__))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import time
+import select
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import paramiko
+from debuglog import get_logger
+
+log = get_logger("ssh")
+
+
+class SSHChannelPool:
+    """
+    Multiplex commands over the one authenticated paramiko.Transport.
+    Every command gets its own session channel, so several can run at once, and a few spare
+    channels are opened ahead of time so a command does not pay for the channel round trip.
+    Keepalives make a dead connection show up as an inactive transport instead of a hang.
+    """
+
+    def __init__(self, transport: paramiko.Transport, spares: int = 2, keepalive: int = 15) -> None:
+        self.transport = transport
+        self.spares = spares
+        self.transport.set_keepalive(keepalive)
+        self._spare_channels = deque()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ssh-chan")  # refills the spares
+        self.refill()
+
+    def is_alive(self) -> bool:
+        return self.transport is not None and self.transport.is_active()
+
+    def _open(self) -> paramiko.Channel:
+        return self.transport.open_session(timeout=10)
+
+    def refill(self):
+        """Open spare channels until there are `spares` of them."""
+        while self.is_alive():
+            with self._lock:
+                if len(self._spare_channels) >= self.spares:
+                    return
+            try:
+                chan = self._open()
+            except (paramiko.SSHException, OSError) as e:
+                log.warning(f"could not pre-open an SSH channel: {e}")
+                return
+            with self._lock:
+                self._spare_channels.append(chan)
+
+    def _take(self) -> paramiko.Channel:
+        chan = None
+        with self._lock:
+            while self._spare_channels and chan is None:
+                candidate = self._spare_channels.popleft()
+                if candidate.active and not candidate.closed:
+                    chan = candidate
+        if chan is None:
+            chan = self._open()
+        self._executor.submit(self.refill)
+        return chan
+
+    def exec(self, cmd: str, on_chunk: Optional[Callable[[str, str], None]] = None, timeout: Optional[float] = None):
+        """
+        Run one command on its own channel. on_chunk(stream, text) gets every piece of output as it arrives.
+        Returns [exitcode, stdout, stderr].
+        """
+        if not self.is_alive():
+            return [-1, "", "SSH transport is not active"]
+        try:
+            chan = self._take()
+            chan.exec_command(cmd)
+        except (paramiko.SSHException, OSError) as e:
+            return [-1, "", str(e)]
+
+        out_chunks, err_chunks = [], []
+        deadline = time.time() + timeout if timeout else None
+        try:
+            while True:
+                if deadline and time.time() > deadline:
+                    return [-1, "".join(out_chunks), "".join(err_chunks) + f"\nCommand timed out after {timeout}s"]
+                select.select([chan], [], [], 1.0)
+                got = False
+                while chan.recv_ready():
+                    text = chan.recv(32768).decode(errors="replace")
+                    out_chunks.append(text)
+                    got = True
+                    if on_chunk:
+                        on_chunk("stdout", text)
+                while chan.recv_stderr_ready():
+                    text = chan.recv_stderr(32768).decode(errors="replace")
+                    err_chunks.append(text)
+                    got = True
+                    if on_chunk:
+                        on_chunk("stderr", text)
+                if not got and chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    break
+                if not got and not self.is_alive():
+                    return [-1, "".join(out_chunks), "".join(err_chunks) + "\nSSH connection lost"]
+            return [chan.recv_exit_status(), "".join(out_chunks), "".join(err_chunks)]
+        finally:
+            chan.close()
+
+    def close(self):
+        with self._lock:
+            while self._spare_channels:
+                self._spare_channels.popleft().close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,136 @@
+import json
+import socket
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+from debuglog import get_logger
+
+log = get_logger("supervisor")
+
+
+class QMPClient:
+    """Minimal QEMU Machine Protocol client, one connection per command."""
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+
+    def command(self, execute: str, arguments: Optional[dict] = None, timeout: float = 5) -> dict:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        try:
+            s.connect(self.socket_path)
+            reader = s.makefile("r")
+            json.loads(reader.readline())  # greeting
+            s.sendall(b'{"execute": "qmp_capabilities"}\n')
+            self._reply(reader)
+            request = {"execute": execute}
+            if arguments:
+                request["arguments"] = arguments
+            s.sendall(json.dumps(request).encode() + b"\n")
+            return self._reply(reader)
+        finally:
+            s.close()
+
+    @staticmethod
+    def _reply(reader) -> dict:
+        while True:
+            line = reader.readline()
+            if not line:
+                return {"error": {"class": "Disconnected", "desc": "QMP connection closed"}}
+            msg = json.loads(line)
+            if "event" not in msg:  # asynchronous events can arrive before the reply
+                return msg
+
+
+class QemuSupervisor:
+    """
+    Watches the QEMU process for the lifetime of the VM.
+    One thread drains QEMU's stderr into a bounded buffer so a chatty QEMU can never block on a full pipe,
+    another checks that the process is alive and that the guest agent still answers. When either fails,
+    `failed` is set, a hung guest is killed so that pending guest commands fail fast instead of timing out.
+    Inside paused() only the process is checked, the grader stopped the guest itself.
+    """
+
+    def __init__(self, vm, health_interval: float = 15.0, max_missed: int = 3, stderr_lines: int = 500) -> None:
+        self.vm = vm
+        self.process = vm.qemu_process
+        self.health_interval = health_interval
+        self.max_missed = max_missed
+        self.stderr = deque(maxlen=stderr_lines)
+        self.failed = threading.Event()
+        self.reason = ""
+        self.guest_up = threading.Event()  # health checks only start once the guest agent answered once
+        self._stop = threading.Event()
+        self._pauses = 0
+        self._pause_epoch = 0  # changes whenever a pause starts or ends
+        self._pause_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._drain, name="qemu-stderr", daemon=True),
+            threading.Thread(target=self._watch, name="qemu-watch", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _drain(self):
+        for raw in iter(self.process.stderr.readline, b""):
+            line = raw.decode(errors="replace").rstrip()
+            self.stderr.append(line)
+            log.debug(f"qemu stderr: {line}")
+
+    def _fail(self, reason: str):
+        if self.failed.is_set() or self._stop.is_set():
+            return
+        self.reason = reason
+        log.warning(f"QEMU supervisor: {reason}")
+        self.failed.set()
+
+    def _watch(self):
+        missed = 0
+        while not self._stop.wait(1.0 if not self.guest_up.is_set() else self.health_interval):
+            code = self.process.poll()
+            if code is not None:
+                self._fail(f"QEMU exited with code {code}: {self.stderr_text(5)}")
+                return
+            if not self.guest_up.is_set() or self._pauses:
+                missed = 0
+                continue
+            epoch = self._pause_epoch
+            if self.vm.ga.ping(timeout=5):
+                missed = 0
+                continue
+            if epoch != self._pause_epoch:  # the guest was stopped on purpose during the ping
+                continue
+            missed += 1
+            log.warning(f"guest agent missed {missed}/{self.max_missed} health checks")
+            if missed >= self.max_missed:
+                self._fail(f"guest stopped answering for {missed * self.health_interval:.0f}s, killing QEMU")
+                self.vm._kill_qemu()
+                return
+
+    @contextmanager
+    def paused(self):
+        """Suspend the guest agent health checks while the guest is stopped on purpose (savevm, loadvm, migrate)."""
+        with self._pause_lock:
+            self._pauses += 1
+            self._pause_epoch += 1
+        try:
+            yield
+        finally:
+            with self._pause_lock:
+                self._pauses -= 1
+                self._pause_epoch += 1
+
+    def wait_stderr(self, timeout: float):
+        """Wait until QEMU closed its stderr, for reading the message of a process that just exited."""
+        self._threads[0].join(timeout)
+
+    def stderr_text(self, lines: Optional[int] = None) -> str:
+        captured = list(self.stderr)
+        return "\n".join(captured[-lines:] if lines else captured)
+
+    def healthy(self) -> bool:
+        return not self.failed.is_set() and self.process.poll() is None
+
+    def stop(self):
+        self._stop.set()
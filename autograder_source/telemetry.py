@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+from debuglog import get_logger
+
+log = get_logger("telemetry")
+
+HOST_FIELDS = ["cpu_seconds", "rss_kb", "read_bytes", "write_bytes"]
+GUEST_FIELDS = ["load1", "mem_total_kb", "mem_available_kb", "netns", "bgpd", "zebra", "net_rx", "net_tx"]
+
+
+class Series:
+    """Samples of fixed named fields, one array('d') per field so thousands of samples stay small."""
+
+    def __init__(self, fields: List[str]) -> None:
+        self.t = array("d")
+        self.columns: Dict[str, array] = {f: array("d") for f in fields}
+
+    def append(self, t: float, values: List[float]):
+        self.t.append(t)
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+
+    def __len__(self):
+        return len(self.t)
+
+    def window(self, start: float, end: float) -> range:
+        return range(next((i for i, t in enumerate(self.t) if t >= start), len(self.t)),
+                     next((i for i, t in enumerate(self.t) if t > end), len(self.t)))
+
+    def as_dict(self) -> dict:
+        return {"t": [round(t, 2) for t in self.t], **{k: list(v) for k, v in self.columns.items()}}
+
+
+def _qemu_sample(pid: int) -> Optional[List[float]]:
+    """CPU time, RSS and block I/O of the QEMU process from /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+        rss = 0
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+        io = {}
+        try:
+            with open(f"/proc/{pid}/io") as f:
+                io = dict(line.split(": ") for line in f.read().splitlines())
+        except OSError:
+            pass  # not readable in every container
+        return [cpu, rss, int(io.get("read_bytes", 0)), int(io.get("write_bytes", 0))]
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class TelemetrySampler:
+    """
+    Samples the QEMU process on the host every `interval` seconds, and has telemetry.sh sample the
+    guest at the same interval into a guest file that is fetched in batches every `batch_interval`
+    seconds, so it costs one guest command per batch instead of one per sample.
+    Guest samples are moved onto the host clock by the offset measured with every batch.
+    """
+
+    def __init__(self, vm, interval: float = 5.0, batch_interval: float = 60.0, vcpus: Optional[int] = None) -> None:
+        self.vm = vm
+        self.interval = interval
+        self.batch_interval = batch_interval
+        self.vcpus = vcpus or vm.vcpus
+        self.host = Series(HOST_FIELDS)
+        self.guest = Series(GUEST_FIELDS)
+        self.guest_file = "/tmp/bgph-telemetry.txt"
+        self._guest_started = False
+        self._guest_lines = 0
+        self.clock_offset = 0.0  # host time minus guest time, as of the last batch
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def _start_guest(self):
+        # run a copy off the guest disk, a shell reading from the 9p share would keep it from being unmounted
+        ret, out, err = self.vm.exec(f"cp {self.vm.submission_dir}/telemetry.sh /tmp/bgph-telemetry.sh && "
+                                     f"rm -f {self.guest_file}", timeout=30)
+        if ret != 0:
+            log.warning(f"could not copy telemetry.sh into the guest: {err.strip()}")
+            return  # tried again after the next interval
+        self.vm.exec_bg(f"cd /tmp && sudo nohup bash bgph-telemetry.sh {self.guest_file} {self.interval} "
+                        f"> /dev/null 2>&1 &")
+        self._guest_started = True
+
+    def _fetch_guest(self):
+        sent = time.time()
+        ret, out, err = self.vm.exec(f"date +%s.%N; tail -n +{self._guest_lines + 1} {self.guest_file} 2>/dev/null",
+                                     timeout=30, max_output=8 * 1024 * 1024)
+        guest_now, _, out = out.partition("\n")
+        try:
+            # the guest read its clock somewhere between sending and receiving, most likely near the middle
+            self.clock_offset = (sent + time.time()) / 2 - float(guest_now)
+        except ValueError:
+            pass  # keep the last offset
+        lines = out.splitlines()
+        # the last line may still be being written
+        if lines and not out.endswith("\n"):
+            lines = lines[:-1]
+        for line in lines:
+            self._guest_lines += 1
+            parts = line.split()
+            if len(parts) != len(GUEST_FIELDS) + 1:
+                continue
+            try:
+                self.guest.append(float(parts[0]) + self.clock_offset, [float(p) for p in parts[1:]])
+            except ValueError:
+                continue
+
+    def _run(self):
+        last_fetch = time.time()
+        while not self._stop.wait(self.interval):
+            process = self.vm.qemu_process
+            if process is not None and process.poll() is None:
+                sample = _qemu_sample(process.pid)
+                if sample:
+                    self.host.append(time.time(), sample)
+            if not (self.vm.is_ready() and self.vm.healthy()):
+                continue
+            try:
+                if not self._guest_started:
+                    self._start_guest()
+                elif time.time() - last_fetch >= self.batch_interval:
+                    last_fetch = time.time()
+                    self._fetch_guest()
+            except Exception as e:  # telemetry must never disturb grading
+                log.warning(f"guest telemetry failed: {e!r}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.interval + 5)
+        if self._guest_started and self.vm.healthy():
+            try:
+                self._fetch_guest()
+                self.vm.exec("sudo pkill -f [t]elemetry.sh", timeout=10)
+            except Exception as e:
+                log.warning(f"final guest telemetry fetch failed: {e!r}")
+
+    def phase_summary(self, name: str, start: float, end: float) -> dict:
+        """Peak memory and CPU saturation of one phase, fields without samples in the phase are left out."""
+        summary = {"phase": name, "seconds": round(end - start, 1)}
+        h = self.host.window(start, end)
+        if len(h) >= 2:
+            cpu, t = self.host.columns["cpu_seconds"], self.host.t
+            busy = [(cpu[i] - cpu[i - 1]) / max(t[i] - t[i - 1], 1e-6) for i in h if i > 0]
+            summary["qemu_peak_rss_mb"] = round(max(self.host.columns["rss_kb"][i] for i in h) / 1024, 1)
+            # share of the vCPUs QEMU kept busy, above 1.0 means the emulator threads add on top
+            summary["qemu_peak_cpu_saturation"] = round(max(busy) / self.vcpus, 2)
+            summary["qemu_mean_cpu_saturation"] = round(sum(busy) / len(busy) / self.vcpus, 2)
+        g = self.guest.window(start, end)
+        if len(g) >= 1:
+            cols = self.guest.columns
+            summary["guest_peak_mem_used_mb"] = round(
+                max(cols["mem_total_kb"][i] - cols["mem_available_kb"][i] for i in g) / 1024, 1)
+            summary["guest_peak_load1"] = max(cols["load1"][i] for i in g)
+            summary["guest_max_netns"] = int(max(cols["netns"][i] for i in g))
+            summary["guest_max_bgpd"] = int(max(cols["bgpd"][i] for i in g))
+            if len(g) >= 2:
+                t = self.guest.t
+                rates = [(cols["net_rx"][i] + cols["net_tx"][i] - cols["net_rx"][i - 1] - cols["net_tx"][i - 1])
+                         / max(t[i] - t[i - 1], 1e-6) for i in g if i > 0]
+                summary["guest_peak_net_softirq_per_s"] = round(max(rates))
+        return summary
+
+    def write(self, path: Path, phases: List[dict]) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"interval": self.interval, "vcpus": self.vcpus, "phases": phases,
+                                    "host": self.host.as_dict(), "guest": self.guest.as_dict()},
+                                   separators=(",", ":")))
+        return path
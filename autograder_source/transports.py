@@ -0,0 +1,586 @@
+import os
+import time
+import json
+import shlex
+import socket
+import codecs
+import base64
+import statistics
+import threading
+import importlib.util
+from pathlib import Path
+from collections import deque
+from typing import List, Optional
+from utils import CommandResult
+from debuglog import get_logger
+
+log = get_logger("transport")
+
+
+class TransportError(Exception):
+    """The channel to the guest failed, as opposed to the command itself failing."""
+
+
+class Transport:
+    """
+    How commands and files reach the guest. Every method runs in the guest's root namespace.
+    exec returns [exitcode, stdout, stderr] like the old ga_exec/_ssh_exec_command and raises
+    TransportError only when the channel itself is broken.
+    """
+    name = "transport"
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None) -> list:
+        raise NotImplementedError
+
+    def exec_background(self, command: str):
+        raise NotImplementedError
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        raise NotImplementedError
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        raise NotImplementedError
+
+    def health(self) -> Optional[float]:
+        """Round trip time of a trivial request in seconds, None if the transport is not usable."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _log_result(command: str, exitcode, stdout: str, stderr: str, limit: int = 4000):
+    """Outputs only go to the debug ring buffer, and only their tail."""
+    log.debug(f"exec [{exitcode = }, {len(stdout)} + {len(stderr)} chars] {command[:200]}")
+    if stdout:
+        log.debug(f"stdout:\n{stdout[-limit:]}")
+    if stderr:
+        log.debug(f"stderr:\n{stderr[-limit:]}")
+
+
+## QEMU guest agent
+
+class GuestAgentTransport(Transport):
+    name = "guest-agent"
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        # the chardev socket serves one client at a time, so requests from several threads take turns
+        self._lock = threading.Lock()
+
+    def command(self, cmd_dict, timeout=30):
+        """Send a command to the QEMU guest agent and return the parsed response."""
+        log.debug(f"GA > {str(cmd_dict)[:200]}")
+        with self._lock:
+            try:
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.connect(self.socket_path)
+            except OSError as e:
+                raise TransportError(f"guest agent socket: {e}")
+            s.settimeout(timeout)
+            s.sendall(json.dumps(cmd_dict).encode() + b"\n")
+            data = bytearray()
+            while True:
+                try:
+                    chunk = s.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+                    # replies are newline terminated, only try to parse once one could be complete
+                    if not chunk.endswith(b"\n"):
+                        continue
+                    result = json.loads(data)
+                    s.close()
+                    if "error" in result:
+                        log.warning(f"GA error: {result['error']}")
+                    else:
+                        log.debug(f"GA < {bytes(data[:200])}")
+                    return result
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                except (socket.timeout, OSError):
+                    break
+            s.close()
+        if data:
+            try:
+                return json.loads(data)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        raise TransportError(f"No response from guest agent for: {str(cmd_dict)[:200]}")
+
+    def ping(self, timeout=5) -> bool:
+        try:
+            return "return" in self.command({"execute": "guest-ping"}, timeout=timeout)
+        except TransportError:
+            return False
+
+    def health(self) -> Optional[float]:
+        started = time.time()
+        return time.time() - started if self.ping() else None
+
+    def exec_background(self, command: str):
+        """Execute a shell command inside the VM, fully detached. Returns the GA pid."""
+        log.debug(f"exec_background > {command}")
+        result = self.command({"execute": "guest-exec", "arguments": {
+            "path": "/bin/bash", "arg": ["-c", command], "capture-output": False}})
+        pid = result["return"]["pid"]
+        log.debug(f"exec_background [{pid = }]")
+        return pid
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None) -> list:
+        """Small outputs come back through capture-output, streaming is used when a callback or cap is given."""
+        if on_chunk is not None or max_output is not None:
+            return self.exec_stream(command, timeout=timeout, on_chunk=on_chunk, max_output=max_output)
+
+        log.debug(f"exec > {command}")
+        result = self.command({"execute": "guest-exec", "arguments": {
+            "path": "/bin/bash", "arg": ["-c", command], "capture-output": True}})
+        pid = result["return"]["pid"]
+
+        # Poll for completion, quickly at first so short commands return in milliseconds
+        deadline = time.time() + timeout
+        delay = 0.01
+        while time.time() < deadline:
+            status = self.command({"execute": "guest-exec-status", "arguments": {"pid": pid}})
+            if status["return"]["exited"]:
+                ret = status["return"]
+                exitcode = ret.get("exitcode", -1)
+                stdout = base64.b64decode(ret.get("out-data", "")).decode() if ret.get("out-data") else ""
+                stderr = base64.b64decode(ret.get("err-data", "")).decode() if ret.get("err-data") else ""
+                _log_result(command, exitcode, stdout, stderr)
+                return [exitcode, stdout, stderr]
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+        log.warning(f"exec timed out after {timeout}s: {command}")
+        return [-1, "", f"Command timed out after {timeout}s"]
+
+    def file_read(self, handle, count):
+        """Read up to count bytes from an open guest file. Returns (data, eof)."""
+        result = self.command({"execute": "guest-file-read", "arguments": {"handle": handle, "count": count}})
+        ret = result.get("return", {})
+        data = base64.b64decode(ret["buf-b64"]) if ret.get("buf-b64") else b""
+        if ret.get("eof"):
+            # qemu-ga reads with stdio, whose EOF flag is sticky, a zero seek clears it so we can keep tailing
+            self.command({"execute": "guest-file-seek", "arguments": {"handle": handle, "offset": 0, "whence": "cur"}})
+        return data, bool(ret.get("eof"))
+
+    def exec_stream(self, command, timeout=60, on_chunk=None, chunk_size=64 * 1024, poll_interval=0.5,
+                    max_output=None):
+        """
+        Execute a shell command inside the VM, streaming its output instead of relying on capture-output,
+        which qemu-ga truncates and returns as one base64 blob.
+        stdout/stderr are redirected to guest files that are tailed with guest-file-read while the command runs.
+        on_chunk(stream, text) is called for every decoded chunk, stream is "stdout" or "stderr".
+        max_output keeps only the last max_output characters of each stream.
+        """
+        log.debug(f"exec_stream > {command}")
+        tag = f"/tmp/bgph-ga-{os.getpid()}-{int(time.time() * 1000)}"
+        paths = {"stdout": f"{tag}.out", "stderr": f"{tag}.err"}
+        wrapped = f": > {paths['stdout']}; : > {paths['stderr']}; ( {command} ) > {paths['stdout']} 2> {paths['stderr']}"
+        pid = self.command({"execute": "guest-exec", "arguments": {
+            "path": "/bin/bash", "arg": ["-c", wrapped], "capture-output": False}})["return"]["pid"]
+
+        streams = {}
+        for name, path in paths.items():
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            streams[name] = {"path": path, "handle": None, "decoder": decoder, "chunks": deque(), "size": 0}
+
+        def _append(name, text):
+            if not text:
+                return
+            st = streams[name]
+            st["chunks"].append(text)
+            st["size"] += len(text)
+            # drop whole chunks from the front once we hold more than max_output characters
+            while max_output and st["size"] - len(st["chunks"][0]) >= max_output:
+                st["size"] -= len(st["chunks"].popleft())
+            if on_chunk:
+                on_chunk(name, text)
+
+        exitcode = None
+        deadline = time.time() + timeout
+        try:
+            while time.time() < deadline:
+                got_data = False
+                for name, st in streams.items():
+                    if st["handle"] is None:
+                        result = self.command({"execute": "guest-file-open", "arguments": {"path": st["path"], "mode": "r"}})
+                        if "return" not in result:
+                            continue  # the shell has not created it yet
+                        st["handle"] = result["return"]
+                    while True:
+                        data, eof = self.file_read(st["handle"], chunk_size)
+                        if data:
+                            got_data = True
+                            _append(name, st["decoder"].decode(data))
+                        if eof or not data:
+                            break
+                if exitcode is not None:
+                    break  # this was the final drain after the command exited
+                status = self.command({"execute": "guest-exec-status", "arguments": {"pid": pid}})
+                if status["return"]["exited"]:
+                    exitcode = status["return"].get("exitcode", -1)
+                    continue
+                if not got_data:
+                    time.sleep(poll_interval)
+        finally:
+            for st in streams.values():
+                if st["handle"] is not None:
+                    self.command({"execute": "guest-file-close", "arguments": {"handle": st["handle"]}})
+            self.exec_background(f"rm -f {tag}.*")
+
+        for name, st in streams.items():
+            _append(name, st["decoder"].decode(b"", final=True))
+        stdout = "".join(streams["stdout"]["chunks"])
+        stderr = "".join(streams["stderr"]["chunks"])
+        if exitcode is None:
+            log.warning(f"exec_stream timed out after {timeout}s: {command}")
+            return [-1, stdout, stderr + f"\nCommand timed out after {timeout}s"]
+        _log_result(command, exitcode, stdout, stderr)
+        return [exitcode, stdout, stderr]
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        from ga_transfer import GuestTransfer
+        return GuestTransfer(self).pull(remote_path, local_path)
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        from ga_transfer import GuestTransfer
+        return GuestTransfer(self).push(local_path, remote_path)
+
+
+## SSH (paramiko), only imported when this transport is in play
+
+class SSHTransport(Transport):
+    name = "ssh"
+
+    def __init__(self, hostname="127.0.0.1", port=8022, username="mininet", password="mininet") -> None:
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.ssh_client = None
+        self.channel_pool = None
+        self.attempted = False  # connect() ran, a lazily used transport only tries once
+        self._connect_lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        return importlib.util.find_spec("paramiko") is not None
+
+    def connect(self, max_retries=3, retry_interval=5, timeout=10) -> bool:
+        log.info(f"==> SSHTransport.connect()")
+        self.attempted = True
+        import paramiko
+        from ssh_pool import SSHChannelPool
+
+        for attempt in range(max_retries):
+            log.info(f"SSH connection attempt {attempt + 1}/{max_retries}")
+            try:
+                ssh_client = paramiko.SSHClient()
+                ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh_client.connect(
+                    hostname=self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    timeout=timeout,
+                    banner_timeout=30,
+                    auth_timeout=20,
+                    look_for_keys=False,
+                    allow_agent=False,
+                )
+                self.ssh_client = ssh_client
+                self.channel_pool = SSHChannelPool(ssh_client.get_transport())
+                log.info(f"Successfully connected to {self.hostname}:{self.port}")
+                return True
+            except (paramiko.SSHException, OSError, EOFError) as e:
+                log.warning(f"Connection error (retryable): {e}")
+            time.sleep(retry_interval)
+        return False
+
+    def _pool(self):
+        if self.channel_pool is None and not self.attempted:
+            # a fallback that was never benchmarked connects, and imports paramiko, on first use
+            with self._connect_lock:
+                if not self.attempted:
+                    self.connect(max_retries=1)
+        if self.channel_pool is None or not self.channel_pool.is_alive():
+            raise TransportError("SSH connection is not active")
+        return self.channel_pool
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None) -> list:
+        log.debug(f"ssh exec > {command}")
+        ret, out, err = self._pool().exec(command, on_chunk=on_chunk, timeout=timeout)
+        if ret == -1 and not self._pool().is_alive():
+            raise TransportError(err)
+        if max_output:
+            out, err = out[-max_output:], err[-max_output:]
+        _log_result(command, ret, out, err)
+        return [ret, out, err]
+
+    def exec_background(self, command: str):
+        log.debug(f"ssh exec_background > {command}")
+        self._pool().exec(f"nohup bash -c {shlex.quote(command)} > /dev/null 2>&1 &", timeout=10)
+
+    def health(self) -> Optional[float]:
+        started = time.time()
+        try:
+            ret, out, err = self._pool().exec("true", timeout=10)
+        except TransportError:
+            return None
+        return time.time() - started if ret == 0 else None
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                sftp.get(remote_path, str(local_path))
+            finally:
+                sftp.close()
+        except Exception as e:
+            return CommandResult(False, f"sftp get {remote_path}: {e}")
+        return CommandResult(True)
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                sftp.put(str(local_path), remote_path)
+            finally:
+                sftp.close()
+        except Exception as e:
+            return CommandResult(False, f"sftp put {remote_path}: {e}")
+        return CommandResult(True)
+
+    def close(self):
+        if self.channel_pool:
+            self.channel_pool.close()
+        if self.ssh_client:
+            self.ssh_client.close()
+
+
+## Grader daemon inside the guest (scripts/guestd.py) on its own virtio-serial port
+
+class GuestDaemonTransport(Transport):
+    """
+    Requests go out as JSON lines over one persistent connection and replies are pushed back as each
+    request finishes, matched by id, so nothing is polled and many requests can be in flight.
+    Besides the Transport interface it can run commands and HTTP probes inside a Mininet node.
+    """
+    name = "guestd"
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self.sock = None
+        self._send_lock = threading.Lock()
+        self._pending = {}  # id -> [threading.Event, reply]
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._reader = None
+
+    def connect(self, timeout=30) -> bool:
+        log.info(f"==> GuestDaemonTransport.connect()")
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.socket_path)
+        except OSError as e:
+            log.warning(f"guestd socket: {e}")
+            self.sock = None
+            return False
+        self._reader = threading.Thread(target=self._read_replies, name="guestd-reader", daemon=True)
+        self._reader.start()
+        # the daemon may still be starting, it answers once it opened its port
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if self.request({"op": "ping"}, timeout=2).get("rc") == 0:
+                    return True
+            except TransportError as e:
+                if not self._reader.is_alive():
+                    log.warning(f"guestd closed the connection: {e}")
+                    break
+                time.sleep(0.2)
+        self.close()
+        return False
+
+    def _read_replies(self):
+        reader = self.sock.makefile("rb")
+        try:
+            for line in reader:
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    continue
+                with self._pending_lock:
+                    waiter = self._pending.get(reply.get("id"))
+                if waiter:
+                    waiter[1] = reply
+                    waiter[0].set()
+        except OSError:
+            pass
+        self.sock = None
+        with self._pending_lock:
+            for waiter in self._pending.values():
+                waiter[0].set()  # fail everything still waiting
+
+    def request(self, req: dict, timeout=60) -> dict:
+        if self.sock is None:
+            raise TransportError("guestd is not connected")
+        waiter = [threading.Event(), None]
+        with self._pending_lock:
+            self._next_id += 1
+            req = dict(req, id=self._next_id)
+            self._pending[req["id"]] = waiter
+        try:
+            with self._send_lock:
+                self.sock.sendall(json.dumps(req).encode() + b"\n")
+            if not waiter[0].wait(timeout + 5) or waiter[1] is None:
+                raise TransportError(f"no reply from guestd for {str(req)[:200]}")
+            return waiter[1]
+        except OSError as e:
+            raise TransportError(f"guestd: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(req["id"], None)
+
+    def health(self) -> Optional[float]:
+        started = time.time()
+        try:
+            return time.time() - started if self.request({"op": "ping"}, timeout=5).get("rc") == 0 else None
+        except TransportError:
+            return None
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None, node=None) -> list:
+        log.debug(f"guestd exec{f' [{node}]' if node else ''} > {command}")
+        reply = self.request({"op": "exec", "cmd": command, "node": node, "timeout": timeout}, timeout=timeout)
+        out, err = reply.get("out", ""), reply.get("err", "")
+        if max_output:
+            out, err = out[-max_output:], err[-max_output:]
+        if on_chunk:  # no incremental output, the whole reply arrives at once
+            on_chunk("stdout", out)
+            on_chunk("stderr", err)
+        _log_result(command, reply.get("rc", -1), out, err)
+        return [reply.get("rc", -1), out, err]
+
+    def http(self, node: str, address="11.0.1.1", timeout=5) -> Optional[str]:
+        """Body served to `node` by `address`, None if the request failed."""
+        reply = self.request({"op": "http", "node": node, "address": address, "timeout": timeout}, timeout=timeout)
+        return reply["out"] if reply.get("rc") == 0 else None
+
+    def exec_background(self, command: str):
+        log.debug(f"guestd exec_background > {command}")
+        self.request({"op": "exec", "cmd": f"nohup bash -c {shlex.quote(command)} > /dev/null 2>&1 &",
+                      "timeout": 10}, timeout=10)
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        reply = self.request({"op": "read", "path": remote_path}, timeout=300)
+        if reply.get("rc") != 0:
+            return CommandResult(False, f"guestd read {remote_path}: {reply.get('err')}")
+        Path(local_path).write_bytes(base64.b64decode(reply["data"]))
+        return CommandResult(True)
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        data = base64.b64encode(Path(local_path).read_bytes()).decode()
+        reply = self.request({"op": "write", "path": remote_path, "data": data}, timeout=300)
+        if reply.get("rc") != 0:
+            return CommandResult(False, f"guestd write {remote_path}: {reply.get('err')}")
+        return CommandResult(True)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+
+## Selection and failover
+
+class FailoverTransport(Transport):
+    """
+    Uses the first healthy transport of a latency-ordered list.
+    If it fails mid-run, the call is retried once on the next one, which becomes the active transport.
+    """
+    name = "failover"
+
+    def __init__(self, transports: List[Transport]) -> None:
+        self.transports = list(transports)
+        self._lock = threading.Lock()  # DAG nodes run in parallel, only one of them may drop a failed transport
+
+    @property
+    def active(self) -> Transport:
+        with self._lock:
+            if not self.transports:
+                raise TransportError("no usable transport to the guest")
+            return self.transports[0]
+
+    def _call(self, method: str, *args, **kwargs):
+        while True:
+            transport = self.active
+            try:
+                return getattr(transport, method)(*args, **kwargs)
+            except TransportError as e:
+                with self._lock:
+                    # another call may have dropped it already, then just retry on the new active one
+                    if not self.transports or self.transports[0] is not transport:
+                        continue
+                    self.transports.pop(0)
+                log.warning(f"transport {transport.name} failed ({e}), falling back")
+                transport.close()
+
+    def exec(self, command: str, timeout=60, on_chunk=None, max_output=None) -> list:
+        return self._call("exec", command, timeout=timeout, on_chunk=on_chunk, max_output=max_output)
+
+    def exec_background(self, command: str):
+        return self._call("exec_background", command)
+
+    def read_file(self, remote_path: str, local_path: Path) -> CommandResult:
+        return self._call("read_file", remote_path, local_path)
+
+    def write_file(self, local_path: Path, remote_path: str) -> CommandResult:
+        return self._call("write_file", local_path, remote_path)
+
+    def health(self) -> Optional[float]:
+        return self.active.health() if self.transports else None
+
+    def close(self):
+        with self._lock:
+            transports = list(self.transports)
+        for transport in transports:
+            transport.close()
+
+
+def _time_exec(transport: Transport) -> Optional[float]:
+    started = time.time()
+    try:
+        ret, out, err = transport.exec("true", timeout=10)
+    except TransportError:
+        return None
+    return time.time() - started if ret == 0 else None
+
+
+def benchmark(transports: List[Transport], rounds: int = 5, fallbacks: List[Transport] = ()) -> FailoverTransport:
+    """
+    Order the usable transports by the median time a trivial command takes, fastest first. A health ping
+    says little here, the guest agent answers pings at once but has to poll for a command's exit.
+    `fallbacks` go last, unmeasured, they only connect if everything before them failed.
+    """
+    log.info(f"==> transports.benchmark()")
+    timed = []
+    for transport in transports:
+        samples = [_time_exec(transport) for _ in range(rounds)]
+        if any(s is None for s in samples):
+            log.info(f"    {transport.name:<12} unusable")
+            transport.close()
+            continue
+        latency = statistics.median(samples)
+        log.info(f"    {transport.name:<12} {latency * 1000:8.1f} ms")
+        timed.append((latency, transport))
+    timed.sort(key=lambda pair: pair[0])
+    selected = FailoverTransport([t for _, t in timed] + list(fallbacks))
+    if selected.transports:
+        log.info(f"    selected {selected.active.name}")
+    return selected
@@ -1,3 +1,4 @@
+import hashlib
 from pathlib import Path
 from dataclasses import dataclass
 
@@ -9,14 +10,15 @@ class CommandResult:
 def all_unique(folder: Path, fn_pattern: str = "") -> bool:
     """
     Check if all files in a folder are unique in terms of content.
-    Load each file and compute its hash. If the hash is already in the set, return False.
+    Load each file and compute its sha256. If the digest is already in the set, return False.
+    Unlike hash(), the digest is the same in every process. Near copies are the job of similarity.py.
     fn_pattern: filter files by a pattern in filename
     """
     hashes = set()
     for fn in folder.glob(fn_pattern):
         with open(fn, "rb") as f:
             content = f.read()
-        h = hash(content)
+        h = hashlib.sha256(content).hexdigest()
         if h in hashes:
             return False
         hashes.add(h)